@@ -0,0 +1,222 @@
+"""A process-wide cache of sample array values with a byte budget.
+
+`SampleArray.values` reads the values through `array_cache`, so iterating
+over a large dataset keeps at most `max_bytes` of materialized arrays in memory.
+The least recently used arrays are evicted first, and the arrays are released
+when their `SampleArray` is garbage collected.
+
+Memory-mapped arrays and lazily read `zarr.Array`s do not count towards the
+budget, since their data is not held in the process memory.
+
+Use `configure_array_cache` to change the budget, and `array_cache.stats()`
+to monitor the hits, misses and evictions.
+"""
+import logging
+import numpy as np
+import threading
+import weakref
+
+from collections import OrderedDict, deque
+from collections.abc import Callable
+from typing import Any
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+def array_nbytes(values: Any) -> int:
+    """Get the memory held by array values, or 0 for memory-mapped and lazy arrays."""
+    if isinstance(values, np.memmap) or not isinstance(values, np.ndarray):
+        return 0
+    return values.nbytes
+
+
+def _func_ref(func: Callable) -> Callable[[], Callable | None]:
+    """Reference `func` weakly, so that a function referring to its owner does not keep the owner alive."""
+    try:
+        return weakref.ref(func)
+    except TypeError:
+        return lambda: func
+
+
+class _Entry:
+    __slots__ = ('ref', 'func_ref', 'values', 'nbytes', 'finalizer')
+
+    def __init__(self, ref, func_ref, values, nbytes, finalizer) -> None:
+        self.ref = ref
+        self.func_ref = func_ref
+        self.values = values
+        self.nbytes = nbytes
+        self.finalizer = finalizer
+
+
+class ArrayCache:
+    """An LRU cache of array values with a byte budget.
+
+    The values are cached per owner object, and recomputed if the function
+    computing them has been replaced. The cache is thread-safe, but the same
+    values may be loaded concurrently by two threads on a miss.
+
+    The entries of garbage collected owners are queued by their finalizers, and
+    removed on the next call that takes the lock. The finalizers never take the
+    lock themselves, since the garbage collector may run them while it is held.
+
+    Arguments:
+        max_bytes: The max total size of the cached arrays. Arrays larger than
+            this are not cached. If None, the size is unlimited.
+    """
+    def __init__(self, max_bytes: int | None = DEFAULT_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._released: deque[tuple[int, weakref.ref]] = deque()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, owner: object, func: Callable[[], Any]) -> Any:
+        """Get the cached values of `owner`, or compute them with `func`.
+
+        Arguments:
+            owner: The object whose values are cached, e.g. a `SampleArray`.
+            func: The function computing the values.
+
+        Returns:
+            The values.
+        """
+        key = id(owner)
+        with self._lock:
+            self._drain()
+            entry = self._entries.get(key)
+            if entry is not None and entry.ref() is owner and entry.func_ref() is func:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.values
+            self.misses += 1
+
+        values = func()
+        nbytes = array_nbytes(values)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            with self._lock:
+                self._remove(key)
+            return values
+
+        # Remove the entry when the owner is garbage collected so that the id is not reused.
+        # The finalizer is created outside the lock since creating it may run the garbage collector.
+        ref = weakref.ref(owner)
+        finalizer = weakref.finalize(owner, self._released.append, (key, ref))
+        finalizer.atexit = False
+        entry = _Entry(ref, _func_ref(func), values, nbytes, finalizer)
+
+        with self._lock:
+            self._drain()
+            self._remove(key)
+            self._entries[key] = entry
+            self._nbytes += nbytes
+            self._evict()
+
+        return values
+
+    def _remove(self, key: int) -> _Entry | None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry.nbytes
+            entry.finalizer.detach()
+        return entry
+
+    def _drain(self) -> None:
+        """Remove the entries of the garbage collected owners."""
+        while len(self._released) > 0:
+            key, ref = self._released.popleft()
+            entry = self._entries.get(key)
+            # The id may have been reused by a new owner before draining
+            if entry is not None and entry.ref is ref:
+                self._remove(key)
+
+    def _evict(self) -> None:
+        """Evict the least recently used arrays until the cache fits in the budget."""
+        if self.max_bytes is None:
+            return
+        while self._nbytes > self.max_bytes and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def release(self, owner: object) -> bool:
+        """Remove the cached values of `owner`.
+
+        Returns:
+            True if the values were cached.
+        """
+        with self._lock:
+            self._drain()
+            entry = self._entries.get(id(owner))
+            if entry is None or entry.ref() is not owner:
+                return False
+            self._remove(id(owner))
+            return True
+
+    def clear(self) -> None:
+        """Remove all cached values."""
+        with self._lock:
+            self._released.clear()
+            for key in list(self._entries.keys()):
+                self._remove(key)
+
+    def resize(self, max_bytes: int | None) -> None:
+        """Change the byte budget, and evict arrays if needed."""
+        with self._lock:
+            self._drain()
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict[str, int | None]:
+        """Get the hit, miss and eviction counts, and the current size of the cache."""
+        with self._lock:
+            self._drain()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'n_arrays': len(self._entries),
+                'nbytes': self._nbytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    @property
+    def nbytes(self) -> int:
+        """The total size of the cached arrays."""
+        with self._lock:
+            self._drain()
+            return self._nbytes
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._drain()
+            return len(self._entries)
+
+
+# The cache used by `SampleArray.values`
+array_cache = ArrayCache()
+
+
+def configure_array_cache(max_bytes: int | None) -> ArrayCache:
+    """Set the byte budget of the process-wide array cache.
+
+    Arguments:
+        max_bytes: The max total size of the cached arrays, 0 to disable
+            caching, or None for an unlimited cache.
+
+    Returns:
+        The process-wide array cache.
+    """
+    array_cache.resize(max_bytes)
+    return array_cache
@@ -0,0 +1,260 @@
+"""Zarr codec pipelines for sample arrays.
+
+A codec config is a dict of numcodecs configs, e.g.
+`{'filters': [{'id': 'delta', 'dtype': '<i2'}], 'compressor': {'id': 'zstd', 'level': 9}}`.
+
+Instead of a fixed pipeline, the codecs can be selected automatically
+by trial-compressing a sample of each array. Use `'auto'` to select the
+pipeline with the best compression ratio, or `{'goal': 'speed', 'min_ratio': 3.0}`
+to select the pipeline with the fastest decoding among those reaching `min_ratio`.
+
+Use `chunk_access_report` to choose the zarr chunk duration for an access pattern.
+"""
+import fnmatch
+import logging
+import numcodecs
+import numpy as np
+import pandas as pd
+import time
+
+from collections.abc import Iterable
+from numcodecs.abc import Codec
+from numcodecs.compat import ensure_bytes
+from typing import Any
+
+
+logger = logging.getLogger(__name__)
+
+
+AUTO = 'auto'
+GOALS = ('size', 'speed')
+
+CodecConfig = dict[str, Any] | str
+
+
+def candidate_pipelines(
+        dtype: np.dtype,
+        compression_level: int = 9) -> dict[str, dict[str, Any]]:
+    """Get the codec pipelines tried in automatic selection for an array dtype.
+
+    Delta filters are only tried for integer arrays, since the cumulative sum
+    of float deltas does not exactly reproduce the original values.
+
+    Arguments:
+        dtype: The dtype of the array.
+        compression_level: The compression level of the Zstandard compressors.
+
+    Returns:
+        The codec configs by pipeline name.
+    """
+    dtype = np.dtype(dtype)
+    zstd = {'id': 'zstd', 'level': compression_level}
+    shuffle = {'id': 'shuffle', 'elementsize': dtype.itemsize}
+    blosc_lz4 = {'id': 'blosc', 'cname': 'lz4', 'clevel': 5, 'shuffle': numcodecs.Blosc.SHUFFLE}
+
+    pipelines = {
+        'zstd': {'filters': None, 'compressor': zstd},
+        'shuffle-zstd': {'filters': [shuffle], 'compressor': zstd},
+        'blosc-zstd-bitshuffle': {
+            'filters': None,
+            'compressor': {'id': 'blosc', 'cname': 'zstd', 'clevel': compression_level,
+                           'shuffle': numcodecs.Blosc.BITSHUFFLE}},
+        'blosc-lz4-shuffle': {'filters': None, 'compressor': blosc_lz4},
+    }
+
+    if dtype.kind in 'iu':
+        delta = {'id': 'delta', 'dtype': dtype.str}
+        pipelines['delta-zstd'] = {'filters': [delta], 'compressor': zstd}
+        pipelines['delta-shuffle-zstd'] = {'filters': [delta, shuffle], 'compressor': zstd}
+        pipelines['delta-blosc-lz4-shuffle'] = {'filters': [delta], 'compressor': blosc_lz4}
+
+    return pipelines
+
+
+def get_codecs(config: dict[str, Any]) -> tuple[list[Codec] | None, Codec | None]:
+    """Create the filters and the compressor from a codec config."""
+    assert set(config.keys()) <= {'filters', 'compressor'}, f'Invalid codec config: {config}'
+    filters = config.get('filters')
+    if filters is not None:
+        filters = [numcodecs.get_codec(dict(f)) for f in filters]
+
+    compressor = config.get('compressor')
+    if compressor is not None:
+        compressor = numcodecs.get_codec(dict(compressor))
+
+    return filters, compressor
+
+
+def resolve_name_config(name: str, configs: dict[str, Any] | None) -> Any:
+    """Find the config of an array by name, e.g. a codec config or a quantization error.
+
+    An exact name match is preferred, after which the keys are matched
+    as glob patterns in order.
+    """
+    if configs is None:
+        return None
+    if name in configs:
+        return configs[name]
+    for pattern, config in configs.items():
+        if fnmatch.fnmatchcase(name, pattern):
+            return config
+    return None
+
+
+def is_auto(config: CodecConfig) -> bool:
+    return config == AUTO or (isinstance(config, dict) and 'goal' in config)
+
+
+def _sample(arr: np.ndarray, sample_size: int, n_blocks: int = 4) -> np.ndarray:
+    """Take evenly spaced blocks of the array so that the sample covers the whole recording."""
+    if len(arr) <= sample_size:
+        return np.ascontiguousarray(arr)
+
+    block_size = sample_size // n_blocks
+    starts = np.linspace(0, len(arr) - block_size, n_blocks).astype(int)
+    return np.ascontiguousarray(np.concatenate([arr[s:s + block_size] for s in starts]))
+
+
+def _trial(
+        sample: np.ndarray,
+        filters: list[Codec] | None,
+        compressor: Codec | None,
+        n_repeats: int = 3) -> tuple[float, float] | None:
+    """Compress the sample and return the compression ratio and the decode time.
+
+    Returns None if the pipeline does not reproduce the sample exactly.
+    """
+    buf = sample
+    for f in filters or []:
+        buf = f.encode(buf)
+    encoded = compressor.encode(buf) if compressor is not None else ensure_bytes(buf)
+
+    decode_time = float('inf')
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        buf = compressor.decode(encoded) if compressor is not None else encoded
+        for f in reversed(filters or []):
+            buf = f.decode(buf)
+        decode_time = min(decode_time, time.perf_counter() - t0)
+
+    if ensure_bytes(buf) != sample.tobytes():
+        return None
+
+    return sample.nbytes / max(len(ensure_bytes(encoded)), 1), decode_time
+
+
+def select_codec(
+        arr: np.ndarray,
+        goal: str = 'size',
+        min_ratio: float = 1.0,
+        compression_level: int = 9,
+        sample_size: int = 2**18) -> dict[str, Any]:
+    """Select the codec pipeline for an array by trial-compressing a sample.
+
+    Arguments:
+        arr: The array, or the first chunk of a streamed array.
+        goal: `size` to select the pipeline with the highest compression ratio,
+            or `speed` to select the pipeline with the fastest decoding among
+            those whose ratio is at least `min_ratio`.
+        min_ratio: The minimum compression ratio if `goal='speed'`. If no pipeline
+            reaches it, the pipeline with the highest ratio is selected.
+        compression_level: The compression level of the Zstandard compressors.
+        sample_size: The number of samples to trial-compress.
+
+    Returns:
+        The selected codec config.
+    """
+    assert goal in GOALS, f'Unsupported codec selection goal: {goal}'
+    arr = np.asarray(arr)
+    sample = _sample(arr, sample_size)
+
+    results = {}
+    pipelines = candidate_pipelines(arr.dtype, compression_level=compression_level)
+    for pipeline_name, config in pipelines.items():
+        res = _trial(sample, *get_codecs(config))
+        if res is not None:
+            results[pipeline_name] = res
+
+    best = max(results, key=lambda k: results[k][0])
+    if goal == 'speed':
+        fast_enough = [k for k, (ratio, _) in results.items() if ratio >= min_ratio]
+        if len(fast_enough) > 0:
+            best = min(fast_enough, key=lambda k: results[k][1])
+
+    ratio, decode_time = results[best]
+    logger.debug(f'Selected codec pipeline {best} for goal {goal}, '
+                 f'ratio {ratio:.2f}, decode time {1e3 * decode_time:.2f} ms')
+    return pipelines[best]
+
+
+def codecs_for_array(
+        arr: np.ndarray,
+        config: CodecConfig | None,
+        compression_level: int = 9) -> tuple[list[Codec] | None, Codec | None]:
+    """Get the filters and the compressor for an array from a codec config.
+
+    Arguments:
+        arr: The array, or the first chunk of a streamed array. Only used with automatic selection.
+        config: The codec config, `'auto'`, or a dict of `select_codec` arguments
+            with the key `goal`. If None, Zstandard compression without filters is used.
+        compression_level: The Zstandard compression level for the default
+            and automatically selected pipelines.
+
+    Returns:
+        The filters and the compressor.
+    """
+    if config is None:
+        return None, numcodecs.Zstd(level=compression_level)
+
+    if is_auto(config):
+        kwargs = {} if config == AUTO else config
+        config = select_codec(arr, compression_level=compression_level, **kwargs)
+
+    return get_codecs(config)
+
+
+def chunk_access_report(
+        windows: Iterable[tuple[float, float]],
+        sampling_rate: float,
+        chunk_secs: Iterable[float],
+        itemsize: int = 4,
+        n_channels: int = 1) -> pd.DataFrame:
+    """Estimate the data decompressed when reading windows with different zarr chunk durations.
+
+    A whole chunk is decompressed to read any sample in it, so windows which
+    are not aligned with the chunks decompress more than they read.
+
+    Arguments:
+        windows: The (start_sec, duration) of the windows read by the data loader,
+            e.g. logged from `SampleArray.read_window` calls or the scoring epochs.
+        sampling_rate: The sampling rate of the array.
+        chunk_secs: The chunk durations in seconds to compare.
+        itemsize: The size of a sample in bytes.
+        n_channels: The number of channels per chunk, e.g. for packed arrays.
+
+    Returns:
+        A DataFrame with a row per chunk duration and the columns `chunk_bytes`,
+        `chunks_per_window` and `decoded_bytes_per_window` as means over the windows,
+        and `read_amplification` as the ratio of decoded to requested bytes.
+    """
+    windows = np.asarray(list(windows), dtype=np.float64).reshape(-1, 2)
+    assert len(windows) > 0, 'at least one window is needed'
+
+    starts = np.round(windows[:, 0] * sampling_rate).astype(np.int64)
+    stops = np.maximum(starts + np.round(windows[:, 1] * sampling_rate).astype(np.int64), starts + 1)
+    sample_bytes = itemsize * n_channels
+
+    rows = []
+    for chunk_sec in chunk_secs:
+        chunk_len = max(round(chunk_sec * sampling_rate), 1)
+        n_chunks = (stops - 1) // chunk_len - starts // chunk_len + 1
+        decoded = n_chunks * chunk_len * sample_bytes
+        rows.append({
+            'chunk_sec': chunk_sec,
+            'chunk_bytes': chunk_len * sample_bytes,
+            'chunks_per_window': n_chunks.mean(),
+            'decoded_bytes_per_window': decoded.mean(),
+            'read_amplification': decoded.sum() / ((stops - starts).sum() * sample_bytes)
+        })
+
+    return pd.DataFrame(rows).set_index('chunk_sec')
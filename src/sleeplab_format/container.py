@@ -0,0 +1,243 @@
+"""Single-file series containers.
+
+A container stores a whole series folder in one uncompressed zip archive
+`<series_name>.slf.zip` next to the other series of the dataset. This avoids
+the thousands of small files of the folder layout when copying or listing
+datasets on network and object storage file systems.
+
+The archive holds the files of the series folder under their relative paths,
+and an index of the subject catalog entries in `index.json`. Since the members
+are stored without compression, numpy arrays are memory-mapped and parquet
+files are read directly at their offsets in the archive. Zarr arrays are read
+through `zarr.ZipStore`.
+"""
+import functools
+import logging
+import numpy as np
+import os
+import pyarrow as pa
+import struct
+import threading
+import zarr
+import zipfile
+
+from collections.abc import Iterator, MutableMapping
+from pathlib import Path
+from pydantic import TypeAdapter
+from sleeplab_format.models import SubjectEntry, validation_context
+
+
+logger = logging.getLogger(__name__)
+
+
+CONTAINER_SUFFIX = '.slf.zip'
+INDEX_FILENAME = 'index.json'
+
+# The size of the fixed part of a zip local file header
+_LOCAL_HEADER_SIZE = 30
+
+_index_adapter = TypeAdapter(dict[str, SubjectEntry])
+
+
+def container_path(series_dir: Path) -> Path:
+    """Get the container path of a series folder path."""
+    return series_dir.parent / f'{series_dir.name}{CONTAINER_SUFFIX}'
+
+
+def pack_series(
+        series_dir: Path,
+        subject_entries: dict[str, SubjectEntry],
+        dst_path: Path,
+        keep_hidden: list[str] | None = None) -> None:
+    """Pack a series folder into a container.
+
+    The container is first written to a temporary file, and then moved to
+    `dst_path` so that a partially written container is never read.
+
+    Arguments:
+        series_dir: The series root folder.
+        subject_entries: The catalog entries of the subjects, e.g. from
+            `sleeplab_format.reader.scan_series`.
+        dst_path: The path of the container.
+        keep_hidden: The names of the hidden files of the subjects to pack,
+            e.g. the resume markers of the writer. Other hidden files are skipped.
+    """
+    keep_hidden = set(keep_hidden or [])
+    logger.info(f'Packing {series_dir} to {dst_path}...')
+    tmp_path = dst_path.with_name(f'.{dst_path.name}.{os.getpid()}.tmp')
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        zf.writestr(INDEX_FILENAME, _index_adapter.dump_json(subject_entries, exclude_none=True))
+        for sid in subject_entries.keys():
+            for p in sorted((series_dir / sid).rglob('*')):
+                rel_path = p.relative_to(series_dir)
+                # Skip the hidden files of the subject, but not the metadata files inside zarr arrays
+                hidden = rel_path.parts[1].startswith('.') and rel_path.parts[1] not in keep_hidden
+                if p.is_file() and not hidden:
+                    zf.write(p, rel_path.as_posix())
+
+    os.replace(tmp_path, dst_path)
+
+
+def unpack_series(src_path: Path, series_dir: Path) -> None:
+    """Extract the files of a container to a series folder.
+
+    Arguments:
+        src_path: The path of the container.
+        series_dir: The series root folder to extract the subjects to.
+    """
+    logger.info(f'Unpacking {src_path} to {series_dir}...')
+    with zipfile.ZipFile(src_path, 'r') as zf:
+        members = [name for name in zf.namelist() if name != INDEX_FILENAME]
+        zf.extractall(series_dir, members=members)
+
+
+class _ContainerStore(MutableMapping):
+    """A read-only zarr store which reads through the `ZipStore` of a container.
+
+    The store of the container is looked up on each access, so that the zarr
+    arrays opened from a container keep working after `SeriesContainer.close`.
+    """
+    def __init__(self, container: 'SeriesContainer') -> None:
+        self.container = container
+
+    def __getitem__(self, key: str) -> bytes:
+        with self.container._lock:
+            return self.container._store[key]
+
+    def __contains__(self, key: object) -> bool:
+        with self.container._lock:
+            return key in self.container._store
+
+    def __iter__(self) -> Iterator[str]:
+        with self.container._lock:
+            return iter(list(self.container._store.keys()))
+
+    def __len__(self) -> int:
+        with self.container._lock:
+            return len(self.container._store)
+
+    def __setitem__(self, key: str, value: bytes) -> None:
+        raise PermissionError('series containers are read-only')
+
+    def __delitem__(self, key: str) -> None:
+        raise PermissionError('series containers are read-only')
+
+
+class SeriesContainer:
+    """Read access to the files of a series container.
+
+    The files are addressed by their paths in the unpacked series folder,
+    so that the reader can use the same paths for both layouts.
+
+    The archive is opened on first use. `close` releases the file handles,
+    and they are reopened if the container is used again, also by the arrays
+    which were opened before closing. The container can be used as a context manager.
+
+    Arguments:
+        path: The path of the `.slf.zip` file.
+        validate: The validation level of the index, see `sleeplab_format.reader.read_dataset`.
+    """
+    def __init__(self, path: Path, validate: str = 'full') -> None:
+        self.path = Path(path)
+        self.validate = validate
+        self.series_dir = self.path.with_name(self.path.name.removesuffix(CONTAINER_SUFFIX))
+        self._lock = threading.RLock()
+        self._zip_file = None
+        self._zip_store = None
+
+    def __enter__(self) -> 'SeriesContainer':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __reduce__(self):
+        # Reopen the archive when unpickled, e.g. in a worker process
+        return (SeriesContainer, (self.path, self.validate))
+
+    def member(self, path: Path) -> str:
+        """Get the archive member name of a path in the unpacked series folder."""
+        return Path(path).relative_to(self.series_dir).as_posix()
+
+    @property
+    def _zip(self) -> zipfile.ZipFile:
+        with self._lock:
+            if self._zip_file is None:
+                self._zip_file = zipfile.ZipFile(self.path, 'r')
+            return self._zip_file
+
+    @functools.cached_property
+    def subject_entries(self) -> dict[str, SubjectEntry]:
+        """The catalog entries of the subjects from the container index."""
+        return _index_adapter.validate_json(
+            self._zip.read(INDEX_FILENAME), context=validation_context(self.validate))
+
+    def read_bytes(self, path: Path) -> bytes:
+        # ZipFile reads are serialized by the lock of the shared file handle
+        return self._zip.read(self.member(path))
+
+    def _data_offset(self, path: Path) -> tuple[int, int]:
+        """Get the offset and size of the stored data of a member."""
+        info = self._zip.getinfo(self.member(path))
+        assert info.compress_type == zipfile.ZIP_STORED, f'{info.filename} is compressed'
+
+        with open(self.path, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(_LOCAL_HEADER_SIZE)
+        name_len, extra_len = struct.unpack('<26xHH', header)
+        return info.header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len, info.file_size
+
+    def _buffer(self, path: Path) -> pa.Buffer:
+        """Get a zero-copy buffer of a memory-mapped member."""
+        offset, size = self._data_offset(path)
+        with pa.memory_map(str(self.path), 'r') as mm:
+            return mm.read_at(size, offset)
+
+    def load_npy(self, path: Path) -> np.memmap:
+        """Memory map a numpy array member like `np.load(..., mmap_mode='r')`."""
+        offset, _ = self._data_offset(path)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            data_offset = f.tell()
+
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=data_offset,
+                         shape=shape, order='F' if fortran_order else 'C')
+
+    def parquet_source(self, path: Path) -> pa.BufferReader:
+        """Open a parquet member for `pyarrow.parquet` without copying."""
+        return pa.BufferReader(self._buffer(path))
+
+    @property
+    def _store(self) -> zarr.ZipStore:
+        with self._lock:
+            if self._zip_store is None:
+                self._zip_store = zarr.ZipStore(str(self.path), mode='r')
+            return self._zip_store
+
+    def open_zarr(self, path: Path) -> zarr.Array:
+        """Open a zarr array member as a read-only `zarr.Array`."""
+        return zarr.open_array(store=_ContainerStore(self), path=self.member(path), mode='r')
+
+    def close(self) -> None:
+        """Close the open file handles of the archive."""
+        with self._lock:
+            if self._zip_file is not None:
+                self._zip_file.close()
+                self._zip_file = None
+            if self._zip_store is not None:
+                self._zip_store.close()
+                self._zip_store = None
+
+
+def open_container(series_dir: Path, validate: str = 'full') -> SeriesContainer | None:
+    """Open the container of a series if the series is stored as a container."""
+    path = container_path(series_dir)
+    if path.exists():
+        return SeriesContainer(path, validate=validate)
+    return None
+
@@ -37,7 +37,10 @@ def extract(src_dir: Path, dst_dir: Path, cfg: config.DatasetConfig) -> None:
 
     logger.info(f'Applying preprocessing and writing dataset to {dst_dir}')
     writer.write_dataset(
-        ds, dst_dir, annotation_format=cfg.annotation_format, array_format=cfg.array_format)
+        ds, dst_dir, annotation_format=cfg.annotation_format, array_format=cfg.array_format,
+        zarr_codecs=cfg.zarr_codecs, zarr_chunk_sec=cfg.zarr_chunk_sec, quantize=cfg.quantize,
+        layout=cfg.layout, statistics=cfg.statistics,
+        hypnogram_epoch_sec=cfg.hypnogram_epoch_sec)
 
     if series_skipped != {}:
         skipped_path = Path(dst_dir) / ds.name / '.extractor_skipped_subjects.json'
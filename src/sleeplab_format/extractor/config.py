@@ -44,6 +44,24 @@ class DatasetConfig(BaseModel, extra='forbid'):
     annotation_format: str = 'json'
     array_format: str = 'numpy'
 
+    # Zarr codec configs by array name or glob pattern, see sleeplab_format.compression
+    zarr_codecs: dict[str, str | dict[str, Any]] | None = None
+
+    # The zarr chunk duration in seconds, e.g. a multiple of the scoring epoch
+    zarr_chunk_sec: float | None = None
+
+    # The maximum quantization errors, or "auto", by array name or glob pattern
+    quantize: dict[str, float | str] | None = None
+
+    # "directory", or "container" to write each series to a single file
+    layout: str = 'directory'
+
+    # Whether to compute the array statistics while writing
+    statistics: bool = False
+
+    # If given, also write the hypnograms as uint8 epoch labels with this epoch duration
+    hypnogram_epoch_sec: float | None = None
+
 
 def parse_config(config_path: Path) -> DatasetConfig:
     with open(config_path, 'r') as f:
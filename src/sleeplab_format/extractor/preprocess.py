@@ -67,11 +67,29 @@ def process_array(
                 arr.attributes,
                 action,
                 ref_func)
+            # The window_func of the reader and the chunks_func would return the unprocessed array
+            _window_func = None
+            _chunks_func = None
         else:
             _values_func = arr.values_func
+            _window_func = arr.window_func
+            _chunks_func = arr.chunks_func
 
         _attributes = arr.attributes.model_copy(update=action.updated_attributes)
-        arr = arr.model_copy(update={'attributes': _attributes, 'values_func': _values_func})
+        if action.method is not None:
+            # The processed values are no longer quantized, and the statistics are stale
+            _attributes = _attributes.model_copy(
+                update={'scale': None, 'offset': None, 'statistics': None})
+            _raw_values_func = None
+        else:
+            _raw_values_func = arr.raw_values_func
+
+        arr = arr.model_copy(update={
+            'attributes': _attributes,
+            'values_func': _values_func,
+            'chunks_func': _chunks_func,
+            'window_func': _window_func,
+            'raw_values_func': _raw_values_func})
 
     return arr
 
@@ -242,20 +260,40 @@ def lowpass(
 def z_score_norm(
         s: np.array,
         attributes: ArrayAttributes,
-        dtype=np.float32) -> np.array:
-    return ((s - np.mean(s)) / np.std(s)).astype(dtype)
+        dtype=np.float32,
+        use_statistics: bool = False) -> np.array:
+    """Z-score standardization for the signal.
+
+    If `use_statistics`, the mean and std are taken from `attributes.statistics`
+    computed by the writer instead of a pass over the signal. Enable it in an
+    extractor config with `kwargs: {"use_statistics": true}`.
+    """
+    if use_statistics and attributes.statistics is not None:
+        mean, std = attributes.statistics.mean, attributes.statistics.std
+    else:
+        mean, std = np.mean(s), np.std(s)
+    return ((s - mean) / std).astype(dtype)
 
 def iqr_norm(
-	s: np.array, attributes: 
-	ArrayAttributes, 
-	dtype=np.float32) -> np.array:
-    """Interquartile range standardization for the signal."""
-    q75, q25 = np.percentile(s, [75 ,25])
+        s: np.array,
+        attributes: ArrayAttributes,
+        dtype=np.float32,
+        use_statistics: bool = False) -> np.array:
+    """Interquartile range standardization for the signal.
+
+    If `use_statistics`, the median and the quartiles are taken from `attributes.statistics`.
+    They are estimated from a sample of the values for long signals.
+    """
+    if use_statistics and attributes.statistics is not None:
+        q75, q25, median = attributes.statistics.q75, attributes.statistics.q25, attributes.statistics.median
+    else:
+        q75, q25 = np.percentile(s, [75 ,25])
+        median = np.median(s)
     iqr = q75 - q25
     if iqr == 0: 
         return np.zeros(s.shape, dtype=dtype)
     else:
-        return ((s - np.median(s)) / iqr).astype(dtype)
+        return ((s - median) / iqr).astype(dtype)
 
 def sub_ref(
         s: np.array,
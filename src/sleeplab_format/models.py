@@ -1,15 +1,20 @@
 """Data type definitions for the sleeplab format."""
+import functools
 import numpy as np
+import operator
+import pyarrow as pa
+import pyarrow.compute as pc
 import zarr
 
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Iterator, Mapping
 from datetime import datetime
 from enum import Enum
 from functools import cached_property
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, InstanceOf, ValidationInfo, model_validator
 from pydantic.functional_validators import AfterValidator
 from typing import Any, Generic, Literal, Optional, TypeVar
 from typing_extensions import Annotated
+from .cache import array_cache
 from .version import __version__
 
 
@@ -17,12 +22,38 @@ SLEEPLAB_FORMAT_VERSION = __version__
 
 
 def unset_tzinfo(v: datetime):
+    # Avoid copying the naive datetimes, which are the majority when reading
+    if v.tzinfo is None:
+        return v
     return v.replace(tzinfo=None)
 
 
 NaiveDatetime = Annotated[datetime, AfterValidator(unset_tzinfo)]
 
 
+# The validation levels of the reader. With `full`, the files are validated
+# with all checks. With `light`, the files are parsed and type-checked by
+# pydantic, but the consistency checks of the model validators are skipped.
+# With `none`, also the annotation tables are trusted to have the schema
+# written by `sleeplab_format.writer`.
+VALIDATION_LEVELS = ['full', 'light', 'none']
+
+
+def validation_context(validate: str) -> dict[str, str]:
+    """Create the pydantic validation context of a validation level.
+
+    Pass the context to e.g. `model_validate_json(..., context=...)`.
+    """
+    assert validate in VALIDATION_LEVELS, f'validate should be one of {VALIDATION_LEVELS}'
+    return {'validate': validate}
+
+
+def _validation_level(info: ValidationInfo) -> str:
+    if info.context is None:
+        return 'full'
+    return info.context.get('validate', 'full')
+
+
 class Sex(str, Enum):
     FEMALE = 'FEMALE'
     MALE = 'MALE'
@@ -118,6 +149,30 @@ class SubjectMetadata(BaseModel, extra='forbid'):
     additional_info: Optional[dict[str, Any]] = None
     
 
+class ArrayStatistics(BaseModel, extra='forbid'):
+    """Summary statistics of the physical values of an array.
+
+    The mean, std, min and max are exact. The quartiles are computed from
+    a uniform random sample of `sample_size` values if the array is longer.
+    NaN values are excluded from all statistics except `nan_count`.
+    """
+    count: int
+    nan_count: int = 0
+    mean: Optional[float] = None
+    std: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    q25: Optional[float] = None
+    median: Optional[float] = None
+    q75: Optional[float] = None
+
+    # The number of values equal to the min or the max, e.g. a saturated amplifier
+    clip_count: int = 0
+
+    # The number of values the quartiles were computed from
+    sample_size: Optional[int] = None
+
+
 class ArrayAttributes(BaseModel, extra='forbid'):
     name: str
     start_ts: NaiveDatetime
@@ -132,8 +187,19 @@ class ArrayAttributes(BaseModel, extra='forbid'):
     # e.g.  {0: 'off', 1: 'on'}
     value_map: Optional[dict[int, str | int]] = None
 
+    # If scale is given, the array is stored as integers which are converted
+    # to physical values as `stored * scale + offset`
+    scale: Optional[float] = None
+    offset: Optional[float] = None
+
+    # Summary statistics computed by the writer, see `StatisticsAccumulator`
+    statistics: Optional[ArrayStatistics] = None
+
     @model_validator(mode='after')
-    def require_rate_or_interval(self):
+    def require_rate_or_interval(self, info: ValidationInfo):
+        if _validation_level(info) != 'full':
+            return self
+
         if self.sampling_interval is None:
             _msg = 'either sampling_rate or sampling_interval needs to be defined'
             assert self.sampling_rate is not None, _msg
@@ -141,9 +207,168 @@ class ArrayAttributes(BaseModel, extra='forbid'):
             _msg = 'cannot define both sampling_rate and sampling_interval'
             assert self.sampling_rate is None, _msg
 
+        if self.offset is not None:
+            assert self.scale is not None, 'offset requires scale to be defined'
+
         return self
 
 
+def _concatenate_chunks(chunks_func: Callable[[], Iterable[np.ndarray]]) -> np.ndarray:
+    return np.concatenate(list(chunks_func()))
+
+
+def quantize_values(
+        values: np.ndarray,
+        max_error: float | str = 'auto') -> tuple[np.ndarray, float, float]:
+    """Quantize an array to integers so that `values ~ stored * scale + offset`.
+
+    Arguments:
+        values: The array to quantize.
+        max_error: The maximum absolute quantization error. The array is stored
+            as int16 if the range fits, otherwise int32. If `auto`, the array
+            is stored as int16 using the full range, so the error is derived
+            from the range of the data.
+
+    Returns:
+        A tuple (stored, scale, offset).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    assert np.isfinite(values).all(), 'cannot quantize arrays with NaN or infinite values'
+
+    if values.size > 0:
+        vmin, vmax = float(values.min()), float(values.max())
+    else:
+        vmin, vmax = 0.0, 0.0
+    offset = (vmin + vmax) / 2
+    half_range = (vmax - vmin) / 2
+
+    int16_max = np.iinfo(np.int16).max
+    if max_error == 'auto':
+        dtype = np.int16
+        scale = half_range / int16_max if half_range > 0 else 1.0
+    else:
+        assert max_error > 0, 'max_error needs to be positive'
+        scale = 2 * max_error
+        n_levels = half_range / scale
+        _msg = f'the range of the array is too large for int32 with max_error {max_error}'
+        assert n_levels <= np.iinfo(np.int32).max, _msg
+        dtype = np.int16 if n_levels <= int16_max else np.int32
+
+    info = np.iinfo(dtype)
+    stored = np.clip(np.round((values - offset) / scale), info.min, info.max).astype(dtype)
+    return stored, scale, offset
+
+
+def dequantize_values(stored: np.ndarray, attributes: ArrayAttributes) -> np.ndarray:
+    """Convert stored integers to float32 values using `attributes.scale` and `attributes.offset`."""
+    values = np.asarray(stored).astype(np.float32)
+    values *= np.float32(attributes.scale)
+    if attributes.offset is not None:
+        values += np.float32(attributes.offset)
+    return values
+
+
+class StatisticsAccumulator:
+    """Compute `ArrayStatistics` over the chunks of an array in a single pass.
+
+    The mean and the variance of the chunks are merged with the parallel
+    algorithm of Chan et al., which is exact and numerically stable. The
+    quartiles are computed from a reservoir sample of the values.
+
+    Arguments:
+        sample_size: The size of the reservoir sample for the quartiles.
+        seed: The seed of the reservoir sampling for reproducible statistics.
+    """
+    def __init__(self, sample_size: int = 2**16, seed: int = 0) -> None:
+        self.sample_size = sample_size
+        self._rng = np.random.default_rng(seed)
+        self._reservoir = np.empty(0, dtype=np.float64)
+        self.count = 0
+        self.nan_count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = None
+        self._max = None
+        self._n_min = 0
+        self._n_max = 0
+
+    def update(self, chunk: np.ndarray) -> None:
+        """Add the values of a chunk."""
+        x = np.asarray(chunk, dtype=np.float64).ravel()
+        nan_mask = np.isnan(x)
+        self.nan_count += int(nan_mask.sum())
+        x = x[~nan_mask]
+        if len(x) == 0:
+            return
+
+        n_a, n_b = self.count, len(x)
+        n = n_a + n_b
+        mean_b = float(x.mean())
+        m2_b = float(np.square(x - mean_b).sum())
+        delta = mean_b - self._mean
+        self._mean += delta * n_b / n
+        self._m2 += m2_b + delta**2 * n_a * n_b / n
+
+        x_min, x_max = float(x.min()), float(x.max())
+        if self._min is None or x_min < self._min:
+            self._min, self._n_min = x_min, 0
+        if x_min == self._min:
+            self._n_min += int((x == x_min).sum())
+        if self._max is None or x_max > self._max:
+            self._max, self._n_max = x_max, 0
+        if x_max == self._max:
+            self._n_max += int((x == x_max).sum())
+
+        self._update_reservoir(x)
+        self.count = n
+
+    def _update_reservoir(self, x: np.ndarray) -> None:
+        """Vectorized reservoir sampling, i.e. Algorithm R over the chunk."""
+        n_fill = min(self.sample_size - len(self._reservoir), len(x))
+        if n_fill > 0:
+            self._reservoir = np.concatenate([self._reservoir, x[:n_fill]])
+        x = x[n_fill:]
+        if len(x) == 0:
+            return
+
+        # The i-th value overall replaces a random slot with probability sample_size / (i + 1)
+        i = self.count + n_fill + np.arange(len(x))
+        slots = (self._rng.random(len(x)) * (i + 1)).astype(np.int64)
+        accept = slots < self.sample_size
+        # With repeated slots, the later values overwrite the earlier ones as in sequential order
+        self._reservoir[slots[accept]] = x[accept]
+
+    def result(self) -> ArrayStatistics:
+        """Get the statistics of the values added so far."""
+        if self.count == 0:
+            return ArrayStatistics(count=0, nan_count=self.nan_count)
+
+        q25, median, q75 = np.quantile(self._reservoir, [0.25, 0.5, 0.75])
+        clip_count = self._n_min + self._n_max if self._max > self._min else self._n_min
+        return ArrayStatistics(
+            count=self.count,
+            nan_count=self.nan_count,
+            mean=self._mean,
+            std=float(np.sqrt(self._m2 / self.count)),
+            min=self._min,
+            max=self._max,
+            q25=float(q25),
+            median=float(median),
+            q75=float(q75),
+            clip_count=clip_count,
+            sample_size=len(self._reservoir))
+
+
+def compute_statistics(values: np.ndarray | Iterable[np.ndarray], sample_size: int = 2**16) -> ArrayStatistics:
+    """Compute the summary statistics of an array or an iterable of chunks."""
+    accumulator = StatisticsAccumulator(sample_size=sample_size)
+    if isinstance(values, np.ndarray):
+        values = [values]
+    for chunk in values:
+        accumulator.update(chunk)
+    return accumulator.result()
+
+
 class SampleArray(
         BaseModel,
         extra='forbid',
@@ -151,20 +376,97 @@ class SampleArray(
     """A pydantic model representing a numerical array with attributes.
 
     When writing data to sleeplab format, use `values_func` to access the array
-    to avoid caching.
+    to avoid caching. For arrays too large to fit in memory, define `chunks_func`
+    which returns an iterable of consecutive chunks along the first axis.
+    The writer then streams the chunks to disk. If only `chunks_func` is given,
+    `values_func` concatenates the chunks.
 
     When reading data in sleeplab format, use `values` since the `values_func`
     returned by the reader should return `np.memmap` instead of the full array.
+    Zarr arrays are returned as read-only `zarr.Array` if read with `zarr_mode='open'`.
+
+    The values are kept in the process-wide `sleeplab_format.cache.array_cache`,
+    which evicts the least recently used arrays when its byte budget is exceeded.
+    Use `release` to drop the values of an array explicitly.
+
+    Arrays stored as quantized integers, i.e. with `attributes.scale`, are
+    dequantized to float32 when `values` or a window is accessed.
+    `raw_values_func` returns the stored integers without scaling.
     """
     attributes: ArrayAttributes
-    values_func: Callable[[], np.ndarray]
+    values_func: Optional[Callable[[], np.ndarray]] = None
+
+    # An optional function that returns the array as an iterable of chunks so
+    # that the writer does not need to hold the whole array in memory.
+    chunks_func: Optional[Callable[[], Iterable[np.ndarray]]] = None
+
+    # An optional function that reads the samples [start, stop) without
+    # reading the whole array. The reader sets this based on the file format.
+    window_func: Optional[Callable[[int, int], np.ndarray]] = None
+
+    # For quantized arrays, an optional function that returns the stored integers.
+    # The reader sets this to the memory-mapped array for numpy.
+    raw_values_func: Optional[Callable[[], np.ndarray]] = None
+
+    @model_validator(mode='after')
+    def require_values_or_chunks(self):
+        if self.values_func is None:
+            _msg = 'either values_func or chunks_func needs to be defined'
+            assert self.chunks_func is not None, _msg
+            self.values_func = functools.partial(_concatenate_chunks, self.chunks_func)
+
+        return self
     
-    @cached_property
+    @property
     def values(self) -> np.ndarray | zarr.Array:
-        """Use @cached_property so that values_func gets evaluated once
-        when values is accessed first time.
+        """The array values, evaluated with `values_func` on first access
+        and cached in `sleeplab_format.cache.array_cache`.
         """
-        return self.values_func()
+        return array_cache.get(self, self.values_func)
+
+    def release(self) -> bool:
+        """Remove the values from the array cache.
+
+        Returns:
+            True if the values were cached.
+        """
+        return array_cache.release(self)
+
+    def read_window(
+            self,
+            start_sec: float,
+            duration: float,
+            ref_ts: datetime | None = None) -> np.ndarray:
+        """Read a time window of the array.
+
+        Only the data needed for the window is read if `window_func` is defined.
+
+        Arguments:
+            start_sec: The start of the window in seconds from `ref_ts`.
+            duration: The duration of the window in seconds.
+            ref_ts: The reference time for `start_sec`, e.g. the recording start time.
+                Defaults to `attributes.start_ts`.
+
+        Returns:
+            The samples in the window. The window is clipped to the bounds of the array.
+        """
+        if self.attributes.sampling_rate is not None:
+            fs = self.attributes.sampling_rate
+        else:
+            fs = 1.0 / self.attributes.sampling_interval
+
+        if ref_ts is not None:
+            start_sec += (ref_ts - self.attributes.start_ts).total_seconds()
+
+        # Compute stop from the duration so that the window length does not depend on start
+        start = round(start_sec * fs)
+        stop = start + round(duration * fs)
+        start = max(start, 0)
+        stop = max(stop, start)
+
+        if self.window_func is not None:
+            return self.window_func(start, stop)
+        return self.values[start:stop]
 
 
 AnnotationT = TypeVar('AnnotationT', bound=str)
@@ -191,24 +493,305 @@ class Annotation(BaseModel, Generic[AnnotationT], extra='forbid'):
     extra_attributes: Optional[dict[str, Any]] = None
 
 
-class BaseAnnotations(BaseModel):
+class IntervalIndex:
+    """An index for time range queries over annotations.
+
+    The intervals are sorted by start, so the candidates of a query are found
+    with binary search. The intervals are bucketed by duration in powers of two,
+    and since an interval can start at most the maximum duration of its bucket
+    before the query, the scan of each bucket is bounded to the starts within
+    [query start - max duration of the bucket, query end]. A few long annotations,
+    such as a lights off period among scored events, then only add the scan of
+    their own bucket instead of making the queries scan all the intervals.
+
+    An interval [start_sec, start_sec + duration) overlaps a query window
+    [start_sec, end_sec) if they share any time. Zero-duration annotations
+    overlap the windows they are in.
+
+    The queries return indices to the original annotations in start order.
+    The batched queries return a pair (window_indices, annotation_indices).
+
+    Arguments:
+        start_sec: The start times of the intervals in seconds.
+        duration: The durations of the intervals in seconds.
+    """
+    def __init__(self, start_sec: np.ndarray, duration: np.ndarray) -> None:
+        start_sec = np.asarray(start_sec, dtype=np.float64)
+        duration = np.asarray(duration, dtype=np.float64)
+        self.order = np.argsort(start_sec, kind='stable')
+        self.starts = start_sec[self.order]
+        duration = duration[self.order]
+        self.ends = self.starts + duration
+
+        # The buckets of (positions, starts, max duration), with zero durations in their own bucket
+        classes = np.full(len(duration), np.iinfo(np.int64).min)
+        positive = duration > 0
+        classes[positive] = np.floor(np.log2(duration[positive]))
+        self.buckets = []
+        for c in np.unique(classes):
+            pos = np.flatnonzero(classes == c)
+            self.buckets.append((pos, self.starts[pos], float(duration[pos].max())))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _expand(
+            self,
+            lo: np.ndarray,
+            hi: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Expand the candidate ranges [lo, hi) of the windows to (window, position) pairs."""
+        lengths = np.maximum(hi - lo, 0)
+        windows = np.repeat(np.arange(len(lo)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return windows, np.repeat(lo, lengths) + offsets
+
+    def _candidates(
+            self,
+            start_sec: np.ndarray,
+            end_sec: np.ndarray,
+            side: str) -> tuple[np.ndarray, np.ndarray]:
+        """Find the (window, position) pairs of the intervals which may overlap the windows, in start order."""
+        windows, pos = [], []
+        for bucket_pos, bucket_starts, max_duration in self.buckets:
+            lo = np.searchsorted(bucket_starts, start_sec - max_duration, side='left')
+            hi = np.searchsorted(bucket_starts, end_sec, side=side)
+            w, p = self._expand(lo, hi)
+            windows.append(w)
+            pos.append(bucket_pos[p])
+
+        if len(windows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        windows, pos = np.concatenate(windows), np.concatenate(pos)
+        if len(self.buckets) > 1:
+            sort = np.lexsort((pos, windows))
+            windows, pos = windows[sort], pos[sort]
+        return windows, pos
+
+    def overlapping_batch(
+            self,
+            start_sec: np.ndarray,
+            end_sec: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Find the intervals overlapping each window [start_sec, end_sec)."""
+        start_sec = np.atleast_1d(np.asarray(start_sec, dtype=np.float64))
+        end_sec = np.atleast_1d(np.asarray(end_sec, dtype=np.float64))
+        windows, pos = self._candidates(start_sec, end_sec, side='left')
+        keep = (self.ends[pos] > start_sec[windows]) | (self.starts[pos] >= start_sec[windows])
+        return windows[keep], self.order[pos[keep]]
+
+    def contained_batch(
+            self,
+            start_sec: np.ndarray,
+            end_sec: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Find the intervals fully inside each window [start_sec, end_sec]."""
+        start_sec = np.atleast_1d(np.asarray(start_sec, dtype=np.float64))
+        end_sec = np.atleast_1d(np.asarray(end_sec, dtype=np.float64))
+        lo = np.searchsorted(self.starts, start_sec, side='left')
+        hi = np.searchsorted(self.starts, end_sec, side='right')
+        windows, pos = self._expand(lo, hi)
+        keep = self.ends[pos] <= end_sec[windows]
+        return windows[keep], self.order[pos[keep]]
+
+    def at_batch(self, t: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Find the intervals containing each time point, i.e. start_sec <= t < end."""
+        t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+        windows, pos = self._candidates(t, t, side='right')
+        keep = (self.ends[pos] > t[windows]) | (self.starts[pos] == t[windows])
+        return windows[keep], self.order[pos[keep]]
+
+    def overlapping(self, start_sec: float, end_sec: float) -> np.ndarray:
+        """Find the intervals overlapping the window [start_sec, end_sec)."""
+        return self.overlapping_batch(start_sec, end_sec)[1]
+
+    def contained(self, start_sec: float, end_sec: float) -> np.ndarray:
+        """Find the intervals fully inside the window [start_sec, end_sec]."""
+        return self.contained_batch(start_sec, end_sec)[1]
+
+    def at(self, t: float) -> np.ndarray:
+        """Find the intervals containing the time point `t`."""
+        return self.at_batch(t)[1]
+
+
+class _AnnotationList(list):
+    """A list which counts its modifications, so that the values derived from it can be recomputed."""
+    version = 0
+
+
+def _counts_modifications(name: str) -> Callable:
+    method = getattr(list, name)
+
+    @functools.wraps(method)
+    def _method(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+
+    return _method
+
+
+for _name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend',
+              'insert', 'pop', 'remove', 'clear', 'sort', 'reverse']:
+    setattr(_AnnotationList, _name, _counts_modifications(_name))
+
+
+class BaseAnnotations(BaseModel, ignored_types=(cached_property,)):
+    """The base class of annotations in a list.
+
+    The derived values such as `interval_index` are cached, and recomputed when
+    `annotations` is replaced or modified in place. On first use of the cache, a plain
+    list in `annotations` is replaced by a list which tracks its modifications. After
+    modifying the `Annotation` objects themselves, call `clear_cache`.
+    """
     scorer: str
     type: str
     annotations: list[Annotation]
 
+    @cached_property
+    def _cache(self) -> dict[str, tuple]:
+        """The derived values by name, with the list, version and args they were computed for."""
+        return {}
+
+    def _cached(self, name: str, args: tuple, func: Callable[[], Any]) -> Any:
+        """Get a derived value, and recompute it if `annotations` has been replaced or modified."""
+        annotations = self.annotations
+        if not isinstance(annotations, _AnnotationList):
+            annotations = _AnnotationList(annotations)
+            self.__dict__['annotations'] = annotations
+
+        cached = self._cache.get(name)
+        if (cached is None or cached[0] is not annotations
+                or cached[1] != annotations.version or cached[2] != args):
+            cached = (annotations, annotations.version, args, func())
+            self._cache[name] = cached
+        return cached[3]
+
+    def clear_cache(self) -> None:
+        """Clear the cached derived values, e.g. after modifying the annotations in place."""
+        self._cache.clear()
+
+    @property
+    def interval_index(self) -> IntervalIndex:
+        """The `IntervalIndex` of the annotations, built on first access and cached."""
+        return self._cached('interval_index', (), lambda: IntervalIndex(
+            np.array([a.start_sec for a in self.annotations], dtype=np.float64),
+            np.array([a.duration for a in self.annotations], dtype=np.float64)))
+
+    def overlapping(self, start_sec: float, end_sec: float) -> list[Annotation]:
+        """Get the annotations overlapping the window [start_sec, end_sec) in start order."""
+        return [self.annotations[i] for i in self.interval_index.overlapping(start_sec, end_sec)]
+
 
 class Annotations(BaseAnnotations):
     type: Literal['annotations'] = 'annotations'
     annotations: list[Annotation[str]]
 
 
-class Hypnogram(BaseAnnotations):
+def _epoch_array(
+        names: np.ndarray,
+        start_sec: np.ndarray,
+        duration: np.ndarray,
+        epoch_sec: float,
+        value_map: dict[str, int],
+        default: int,
+        start: float,
+        n_epochs: int | None) -> np.ndarray:
+    """Map annotations to the epochs whose midpoint they cover.
+
+    Epochs not covered by any annotation get `default`. If annotations
+    overlap, the one starting later wins.
+    """
+    assert epoch_sec > 0, 'epoch_sec needs to be positive'
+    values = [default, *value_map.values()]
+    assert all(0 <= v <= 255 for v in values), 'the epoch values need to fit in uint8'
+
+    order = np.argsort(start_sec, kind='stable')
+    names, start_sec, duration = names[order], start_sec[order], duration[order]
+    end_sec = start_sec + duration
+
+    if n_epochs is None:
+        n_epochs = int(np.ceil((end_sec.max() - start) / epoch_sec)) if len(end_sec) > 0 else 0
+
+    uniques, inverse = np.unique(names, return_inverse=True)
+    labels = np.array([value_map.get(name, default) for name in uniques], dtype=np.uint8)[inverse]
+
+    # The epochs whose midpoints (i + 0.5) * epoch_sec are in [start_sec, end_sec)
+    first = np.clip(np.ceil((start_sec - start) / epoch_sec - 0.5), 0, n_epochs).astype(np.int64)
+    last = np.clip(np.ceil((end_sec - start) / epoch_sec - 0.5), 0, n_epochs).astype(np.int64)
+    lengths = np.maximum(last - first, 0)
+
+    # Expand the annotations to epoch indices, and assign in start order
+    # so that the later annotations overwrite the earlier ones
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    idx = np.repeat(first, lengths) + offsets
+
+    epochs = np.full(n_epochs, default, dtype=np.uint8)
+    epochs[idx] = np.repeat(labels, lengths)
+    return epochs
+
+
+def _default_value_map(annotation_type: str) -> dict[str, int]:
+    """Map the names of an annotation type to their index in the name enum."""
+    return {name.value: i for i, name in enumerate(ANNOTATION_NAME_TYPES[annotation_type])}
+
+
+class EpochAnnotations(BaseAnnotations):
+    """Base class for annotations scored in epochs, such as hypnograms.
+
+    `to_epoch_array` converts the annotations to one label per epoch.
+    The result of the last call is cached, and recomputed with other arguments
+    or when `annotations` is replaced or modified in place, e.g. by appending or
+    replacing an annotation. After modifying the `Annotation` objects themselves,
+    call `clear_cache`.
+    """
+    def to_epoch_array(
+            self,
+            epoch_sec: float = 30.0,
+            value_map: dict[str, int] | None = None,
+            default: int = 255,
+            start_sec: float = 0.0,
+            n_epochs: int | None = None) -> np.ndarray:
+        """Get a label per epoch as a read-only uint8 array.
+
+        Each epoch is labeled by the annotation covering its midpoint. If annotations
+        overlap, the one starting later wins. Gaps between the annotations are `default`.
+
+        Arguments:
+            epoch_sec: The epoch duration in seconds.
+            value_map: The label of each annotation name, e.g. `{'W': 0, 'N1': 1, ...}`.
+                Names missing from the map are labeled `default`. If None, the index
+                of the name in the name enum is used, e.g. `AASMSleepStage`.
+            default: The label of gaps and unmapped names.
+            start_sec: The start of the first epoch in seconds from the start of the recording.
+            n_epochs: The number of epochs. If None, the epochs end with the last annotation.
+
+        Returns:
+            The epoch labels.
+        """
+        def _compute() -> np.ndarray:
+            names = np.array([a.name.value if isinstance(a.name, Enum) else a.name
+                              for a in self.annotations], dtype=object)
+            epochs = _epoch_array(
+                names,
+                np.array([a.start_sec for a in self.annotations], dtype=np.float64),
+                np.array([a.duration for a in self.annotations], dtype=np.float64),
+                epoch_sec,
+                _default_value_map(self.type) if value_map is None else value_map,
+                default,
+                start_sec,
+                n_epochs)
+            epochs.flags.writeable = False
+            return epochs
+
+        args = (epoch_sec, None if value_map is None else tuple(value_map.items()),
+                default, start_sec, n_epochs)
+        return self._cached('epoch_array', args, _compute)
+
+
+class Hypnogram(EpochAnnotations):
     """A hypnogram is Annotations consisting of sleep stages."""
     type: Literal['hypnogram'] = 'hypnogram'
     annotations: list[Annotation[AASMSleepStage]]
 
 
-class RKHypnogram(BaseAnnotations):
+class RKHypnogram(EpochAnnotations):
     """Hypnogram scored with R&K rules."""
     type: Literal['rkhypnogram'] = 'rkhypnogram'
     annotations: list[Annotation[RKSleepStage]]
@@ -224,18 +807,442 @@ class Logs(BaseAnnotations):
     annotations: list[Annotation[str]]
 
 
+# The annotation name types of the BaseAnnotations subclasses
+ANNOTATION_NAME_TYPES = {
+    'hypnogram': AASMSleepStage,
+    'rkhypnogram': RKSleepStage,
+    'aasmevents': AASMEvent,
+}
+
+
+class ColumnarAnnotations(
+        BaseModel,
+        extra='forbid',
+        arbitrary_types_allowed=True,
+        ignored_types=(cached_property,)):
+    """Annotations stored as columns of an Arrow table instead of a list of `Annotation`s.
+
+    The table has the columns `name` (dictionary encoded), `start_ts`, `start_sec`,
+    `duration`, `input_channel`, and optionally `extra_attributes` as a struct column.
+    The columns are validated as a whole, and `Annotation` objects are created only
+    on demand by indexing or iterating.
+
+    Create the columns from numpy arrays with `from_arrays`, from parsed JSON with
+    `from_records`, or from `Annotation` objects with `from_annotations`.
+    `to_annotations` converts back to e.g. `Hypnogram` or `AASMEvents`.
+    """
+    scorer: str
+    type: str
+    table: pa.Table = Field(repr=False)
+
+    @model_validator(mode='after')
+    def validate_columns(self, info: ValidationInfo):
+        columns = self.table.column_names
+        for col in ['name', 'start_ts', 'start_sec']:
+            assert col in columns, f'missing required column {col}'
+            assert self.table[col].null_count == 0, f'column {col} cannot contain nulls'
+
+        n = self.table.num_rows
+        duration = self.table['duration'] if 'duration' in columns else pa.nulls(n)
+        input_channel = self.table['input_channel'] if 'input_channel' in columns else pa.nulls(n)
+
+        start_ts = self.table['start_ts']
+        if pa.types.is_timestamp(start_ts.type) and start_ts.type.tz is not None:
+            # Keep the local time similarly to NaiveDatetime
+            start_ts = pc.local_timestamp(start_ts)
+
+        arrays = [
+            self.table['name'].cast(pa.string()).dictionary_encode(),
+            start_ts.cast(pa.timestamp('us')),
+            self.table['start_sec'].cast(pa.float64()),
+            pc.fill_null(duration.cast(pa.float64()), 0.0),
+            input_channel.cast(pa.string()),
+        ]
+        names = ['name', 'start_ts', 'start_sec', 'duration', 'input_channel']
+        if 'extra_attributes' in columns:
+            arrays.append(self.table['extra_attributes'])
+            names.append('extra_attributes')
+
+        self.table = pa.Table.from_arrays(arrays, names=names)
+
+        if info.context is None:
+            # Check the names of the annotations created in code, but not of the files
+            # which are read or converted, see `check_annotation_names`
+            check_annotation_names(self)
+
+        return self
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(self, i: int) -> Annotation:
+        row = _annotation_rows(self.table.slice(operator.index(i) % len(self), 1))[0]
+        return self._annotation_type().model_validate(row)
+
+    def __iter__(self) -> Iterator[Annotation]:
+        annotation_type = self._annotation_type()
+        for row in _annotation_rows(self.table):
+            yield annotation_type.model_validate(row)
+
+    def _annotation_type(self) -> type[Annotation]:
+        return Annotation[ANNOTATION_NAME_TYPES.get(self.type, str)]
+
+    @property
+    def name_codes(self) -> np.ndarray:
+        """The annotation names as integer codes to `categories`."""
+        return self.names.indices.to_numpy(zero_copy_only=False)
+
+    @property
+    def categories(self) -> list[str]:
+        """The distinct annotation names in the order of `name_codes`."""
+        return self.names.dictionary.to_pylist()
+
+    @property
+    def names(self) -> pa.DictionaryArray:
+        """The annotation names as a dictionary encoded array."""
+        return self.table['name'].combine_chunks()
+
+    @property
+    def start_sec(self) -> np.ndarray:
+        return self.table['start_sec'].to_numpy()
+
+    @property
+    def duration(self) -> np.ndarray:
+        return self.table['duration'].to_numpy()
+
+    @cached_property
+    def _interval_index(self) -> tuple[pa.Table, IntervalIndex]:
+        # Keep the table so that the identity check is not fooled by a reused id
+        return self.table, IntervalIndex(self.start_sec, self.duration)
+
+    @property
+    def interval_index(self) -> IntervalIndex:
+        """The `IntervalIndex` of the annotations, built on first access and cached."""
+        table, index = self._interval_index
+        if table is not self.table:
+            # The table has been replaced
+            del self.__dict__['_interval_index']
+            table, index = self._interval_index
+        return index
+
+    def to_epoch_array(
+            self,
+            epoch_sec: float = 30.0,
+            value_map: dict[str, int] | None = None,
+            default: int = 255,
+            start_sec: float = 0.0,
+            n_epochs: int | None = None) -> np.ndarray:
+        """Get a label per epoch as a uint8 array, see `EpochAnnotations.to_epoch_array`."""
+        if value_map is None:
+            value_map = _default_value_map(self.type)
+        return _epoch_array(
+            np.asarray(self.categories, dtype=object)[self.name_codes],
+            self.start_sec,
+            self.duration,
+            epoch_sec,
+            value_map,
+            default,
+            start_sec,
+            n_epochs)
+
+    @property
+    def extra_attributes(self) -> pa.ChunkedArray | None:
+        """The extra attributes as a struct column, or None if no annotation has them."""
+        if 'extra_attributes' not in self.table.column_names:
+            return None
+        return self.table['extra_attributes']
+
+    @classmethod
+    def from_arrays(
+            cls,
+            scorer: str,
+            type: str,
+            start_sec: np.ndarray,
+            names: Iterable[str] | None = None,
+            name_codes: np.ndarray | None = None,
+            categories: list[str] | None = None,
+            duration: np.ndarray | None = None,
+            start_ts: np.ndarray | None = None,
+            recording_start_ts: datetime | None = None,
+            input_channel: Iterable[str | None] | None = None,
+            extra_attributes: pa.Array | list[dict | None] | None = None) -> 'ColumnarAnnotations':
+        """Create annotations from parallel arrays.
+
+        Arguments:
+            scorer: The scorer of the annotations.
+            type: The type of the annotations, e.g. `hypnogram`.
+            start_sec: The start times in seconds from the start of the recording.
+            names: The annotation names. Alternatively give `name_codes` and `categories`.
+            name_codes: The annotation names as indices to `categories`.
+            categories: The distinct annotation names if `name_codes` is given.
+            duration: The durations in seconds. Defaults to zeros.
+            start_ts: The start timestamps. If None, computed from `recording_start_ts`.
+            recording_start_ts: The start of the recording if `start_ts` is not given.
+            input_channel: The input channel names.
+            extra_attributes: The extra attributes as a struct array, or a list of dicts.
+
+        Returns:
+            The columnar annotations.
+        """
+        if name_codes is not None:
+            assert names is None and categories is not None, 'give either names, or name_codes and categories'
+            name_array = pa.DictionaryArray.from_arrays(
+                pa.array(np.asarray(name_codes, dtype=np.int32)), pa.array(categories, type=pa.string()))
+        else:
+            assert names is not None, 'either names or name_codes needs to be given'
+            name_array = pa.array(names.tolist() if isinstance(names, np.ndarray) else list(names),
+                                  type=pa.string())
+
+        start_sec = np.asarray(start_sec, dtype=np.float64)
+        if start_ts is None:
+            assert recording_start_ts is not None, 'either start_ts or recording_start_ts needs to be given'
+            start_ts = (np.datetime64(recording_start_ts, 'us')
+                        + np.round(start_sec * 1e6).astype('timedelta64[us]'))
+
+        columns = {
+            'name': name_array,
+            'start_ts': pa.array(start_ts, type=pa.timestamp('us')),
+            'start_sec': pa.array(start_sec),
+            'duration': pa.array(np.zeros(len(start_sec)) if duration is None else np.asarray(duration, dtype=np.float64)),
+            'input_channel': pa.array(
+                [None] * len(start_sec) if input_channel is None else list(input_channel), type=pa.string()),
+        }
+        if extra_attributes is not None:
+            columns['extra_attributes'] = pa.array(extra_attributes)
+
+        return cls(scorer=scorer, type=type, table=pa.table(columns))
+
+    @classmethod
+    def from_records(
+            cls,
+            scorer: str,
+            type: str,
+            records: list[dict[str, Any]],
+            validate: str = 'full') -> 'ColumnarAnnotations':
+        """Create annotations from annotation dicts, e.g. parsed from an annotation JSON file.
+
+        The timestamps can be datetimes or ISO 8601 strings without a UTC offset.
+        `validate` is the validation level, see `validation_context`.
+        """
+        def _column(key: str) -> list:
+            return [r.get(key) for r in records]
+
+        start_ts = _column('start_ts')
+        if any(isinstance(ts, str) for ts in start_ts):
+            start_ts = pa.array(start_ts, type=pa.string()).cast(pa.timestamp('us'))
+        else:
+            start_ts = pa.array(start_ts, type=pa.timestamp('us'))
+
+        columns = {
+            'name': pa.array(_column('name'), type=pa.string()),
+            'start_ts': start_ts,
+            'start_sec': pa.array(_column('start_sec'), type=pa.float64()),
+            'duration': pa.array(_column('duration'), type=pa.float64()),
+            'input_channel': pa.array(_column('input_channel'), type=pa.string()),
+        }
+        extra_attributes = _column('extra_attributes')
+        if any(e is not None for e in extra_attributes):
+            columns['extra_attributes'] = pa.array(extra_attributes)
+
+        return cls.model_validate(
+            {'scorer': scorer, 'type': type, 'table': pa.table(columns)},
+            context=validation_context(validate))
+
+    @classmethod
+    def from_annotations(cls, annotations: BaseAnnotations) -> 'ColumnarAnnotations':
+        """Convert `Annotation` objects to columns.
+
+        The `extra_attributes` are stored as a struct column whose fields are
+        the union of the keys in all annotations. The column is left out if no
+        annotation has extra attributes.
+        """
+        anns = annotations.annotations
+        columns = {
+            'name': pa.array([a.name.value if isinstance(a.name, Enum) else a.name for a in anns],
+                             type=pa.string()).dictionary_encode(),
+            'start_ts': pa.array([a.start_ts for a in anns], type=pa.timestamp('us')),
+            'start_sec': pa.array([a.start_sec for a in anns], type=pa.float64()),
+            'duration': pa.array([a.duration for a in anns], type=pa.float64()),
+            'input_channel': pa.array([a.input_channel for a in anns], type=pa.string()),
+        }
+        extra_attributes = [a.extra_attributes for a in anns]
+        if any(e is not None for e in extra_attributes):
+            columns['extra_attributes'] = pa.array(extra_attributes)
+
+        return cls.model_validate(
+            {'scorer': annotations.scorer, 'type': annotations.type, 'table': pa.table(columns)},
+            context=validation_context('full'))
+
+    def to_annotations(
+            self,
+            model: type[BaseAnnotations] = BaseAnnotations,
+            validate: str = 'full') -> BaseAnnotations:
+        """Create `Annotation` objects for all rows.
+
+        Arguments:
+            model: The annotations model to create, e.g. `Hypnogram` or `AASMEvents`
+                to validate the names as enums.
+            validate: The validation level, see `validation_context`. The rows are
+                parsed to `Annotation` objects also with `none`, since the table
+                does not hold them.
+
+        Returns:
+            The annotations.
+        """
+        return model.model_validate({
+            'scorer': self.scorer,
+            'type': self.type,
+            'annotations': _annotation_rows(self.table)
+        }, context=validation_context(validate))
+
+
+def check_annotation_names(annotations: BaseAnnotations | ColumnarAnnotations) -> None:
+    """Check that the names of a known annotation type are members of its enum.
+
+    The names are not checked when reading, since annotations read as `BaseAnnotations`
+    may have other names, but only by `sleeplab_format.reader.validate_dataset` and
+    when creating `ColumnarAnnotations` directly or with `from_arrays`.
+
+    Raises:
+        ValueError: If some names are not members of the enum of `annotations.type`.
+    """
+    if annotations.type not in ANNOTATION_NAME_TYPES:
+        return
+
+    if isinstance(annotations, ColumnarAnnotations):
+        categories = annotations.categories
+        names = {categories[i] for i in np.unique(annotations.name_codes)}
+    else:
+        names = {a.name.value if isinstance(a.name, Enum) else a.name for a in annotations.annotations}
+
+    invalid = names - {v.value for v in ANNOTATION_NAME_TYPES[annotations.type]}
+    if len(invalid) > 0:
+        raise ValueError(f'invalid annotation names for type {annotations.type}: {sorted(invalid)}')
+
+
+def _annotation_rows(table: pa.Table) -> list[dict[str, Any]]:
+    """Convert the table rows to annotation dicts.
+
+    The struct column has the keys of all annotations, so the missing
+    extra attributes of each annotation are removed.
+    """
+    rows = table.to_pylist()
+    if 'extra_attributes' in table.column_names:
+        for row in rows:
+            if row['extra_attributes'] is not None:
+                row['extra_attributes'] = {k: v for k, v in row['extra_attributes'].items()
+                                           if v is not None}
+    return rows
+
+
 class Subject(BaseModel, extra='forbid'):
     metadata: SubjectMetadata
     sample_arrays: Optional[dict[str, SampleArray]] = Field(None, repr=False)
-    annotations: Optional[dict[str, BaseAnnotations]] = Field(None, repr=False)
+    annotations: Optional[dict[str, BaseAnnotations | ColumnarAnnotations]] = Field(None, repr=False)
+
+
+class LazySubjects(Mapping):
+    """A read-only mapping of subjects which reads each subject on first access.
+
+    Only the subject IDs are known up front. The subjects that have been read
+    are kept in an LRU cache, so that the memory usage depends on the number
+    of subjects actually used.
+
+    Arguments:
+        subject_ids: The subject IDs in the order of iteration.
+        read_func: A function that reads the subject given the subject ID.
+        cache_size: The max number of subjects kept in the cache,
+            or None for an unbounded cache.
+    """
+    def __init__(
+            self,
+            subject_ids: Iterable[str],
+            read_func: Callable[[str], Subject],
+            cache_size: int | None = 128) -> None:
+        self._subject_ids = list(subject_ids)
+        self._subject_id_set = set(self._subject_ids)
+        self._read = functools.lru_cache(maxsize=cache_size)(read_func)
+
+    def __getitem__(self, subject_id: str) -> Subject:
+        if subject_id not in self._subject_id_set:
+            raise KeyError(subject_id)
+        return self._read(subject_id)
+
+    def __contains__(self, subject_id: object) -> bool:
+        return subject_id in self._subject_id_set
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._subject_ids)
+
+    def __len__(self) -> int:
+        return len(self._subject_ids)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(n_subjects={len(self)}, {self._read.cache_info()})'
+
+    def cache_clear(self) -> None:
+        """Remove all read subjects from the cache."""
+        self._read.cache_clear()
 
 
 class Series(BaseModel, extra='forbid'):
     name: str
-    subjects: dict[str, Subject] = Field(repr=False)
+
+    # Check for LazySubjects first so that the subjects are not read during validation
+    subjects: InstanceOf[LazySubjects] | dict[str, Subject] = Field(
+        repr=False, union_mode='left_to_right')
 
 
 class Dataset(BaseModel, extra='forbid'):
     name: str
     version: str = SLEEPLAB_FORMAT_VERSION
     series: Optional[dict[str, Series]] = None
+
+
+class ArrayEntry(BaseModel, extra='forbid'):
+    """A catalog entry of a sample array in the dataset manifest.
+
+    The `path` is relative to the subject folder.
+    """
+    attributes: ArrayAttributes
+    format: Literal['numpy', 'parquet', 'zarr']
+    path: str
+
+    # For packed arrays, the row of the channel in the 2D array at `path`
+    row: Optional[int] = None
+
+    # The size of the data on disk, and the shape and dtype of the array.
+    # For packed arrays, nbytes is the size of the whole 2D array.
+    nbytes: Optional[int] = None
+    shape: Optional[list[int]] = None
+    dtype: Optional[str] = None
+
+
+class PackedChannels(BaseModel, extra='forbid'):
+    """The attributes of the channels of a packed 2D array in row order."""
+    channels: list[ArrayAttributes]
+
+
+class AnnotationEntry(BaseModel, extra='forbid'):
+    """A catalog entry of an annotation file in the dataset manifest.
+
+    The `path` is relative to the subject folder.
+    """
+    format: Literal['json', 'parquet']
+    path: str
+    nbytes: Optional[int] = None
+
+
+class SubjectEntry(BaseModel, extra='forbid'):
+    metadata: SubjectMetadata
+    sample_arrays: dict[str, ArrayEntry] = {}
+    annotations: dict[str, AnnotationEntry] = {}
+
+
+class DatasetManifest(BaseModel, extra='forbid'):
+    """A consolidated catalog of all series, subjects, arrays, and annotations
+    in a dataset, which allows reading the dataset without walking the folders.
+    """
+    name: str
+    version: str = SLEEPLAB_FORMAT_VERSION
+    series: dict[str, dict[str, SubjectEntry]] = {}
@@ -1,11 +1,24 @@
 """Read files into sleeplab format. The data will be validated while parsing.
 """
+import fnmatch
+import functools
+import hashlib
 import json
 import logging
+import operator
+import os
+import pickle
+import threading
+import weakref
 import pandas as pd
+import pyarrow as pa
 import pyarrow.parquet as pq
 import zarr
 
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from sleeplab_format.container import CONTAINER_SUFFIX, SeriesContainer, open_container
 from sleeplab_format.models import *
 from pathlib import Path
 
@@ -16,143 +29,1300 @@ logger = logging.getLogger(__name__)
 JSON_ANNOTATION_SUFFIX = '.a.json'
 PARQUET_ANNOTATION_SUFFIX = '.a.parquet'
 PARQUET_ANNOTATION_META_SUFFIX = '.a_meta.json'
+EPOCH_ARRAY_SUFFIX = '.epochs.npy'
+MANIFEST_FILENAME = 'manifest.json'
+CACHE_DIRNAME = '.slf_cache'
+CACHE_FILENAME = 'manifest.pkl'
 
+# Increment when the structure of the cached data changes
+CACHE_VERSION = 1
 
-def read_sample_arrays(subject_dir: Path) -> dict[str, SampleArray] | None:
-    """Read all subject's sample arrays.
+# The data file names of the sample array formats in the order they are searched for
+ARRAY_FILENAMES = {
+    'numpy': 'data.npy',
+    'parquet': 'data.parquet',
+    'zarr': 'data.zarr',
+}
+
+# Packed arrays are stored in _packed_<i> folders with the channel attributes in channels.json
+PACKED_DIR_PREFIX = '_packed_'
+PACKED_CHANNELS_FILENAME = 'channels.json'
+
+
+def _map(
+        func: Callable,
+        items: Iterable,
+        max_workers: int | None = None) -> list:
+    """Apply `func` to all `items`, optionally in a thread pool.
+
+    The results are always returned in the order of `items`.
+    """
+    if max_workers is None or max_workers <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
+
+
+def _match_names(name: str, patterns: list[str] | None) -> bool:
+    """Check if `name` matches any of the glob `patterns`. None matches all names."""
+    if patterns is None:
+        return True
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+class ChunkCachedArray:
+    """A read-only view of a `zarr.Array` that keeps decoded chunks in an LRU cache.
+
+    Repeated reads of nearby windows then decompress each chunk only once.
+    Indexing is supported along the first axis with integers and slices.
 
     Arguments:
-        subject_dir: The subject folder.
+        array: The opened zarr array.
+        cache_size: The max number of decoded chunks kept in the cache.
+    """
+    def __init__(self, array: zarr.Array, cache_size: int) -> None:
+        self.array = array
+        self._chunk_len = array.chunks[0]
+        self._read_chunk = functools.lru_cache(maxsize=cache_size)(self._decode_chunk)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.array.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.array.dtype
+
+    @property
+    def chunks(self) -> tuple[int, ...]:
+        return self.array.chunks
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        arr = self[:]
+        return arr if dtype is None else arr.astype(dtype)
+
+    def _decode_chunk(self, i: int) -> np.ndarray:
+        chunk = self.array[i*self._chunk_len:(i + 1)*self._chunk_len]
+        # Do not allow modifying the cached chunks through returned views
+        chunk.flags.writeable = False
+        return chunk
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = key[0], key[1:]
+
+        if isinstance(first, slice):
+            start, stop, step = first.indices(len(self))
+            if step < 0:
+                return np.asarray(self)[key]
+        else:
+            start = operator.index(first)
+            if start < 0:
+                start += len(self)
+            if not 0 <= start < len(self):
+                raise IndexError(f'index {first} is out of bounds for length {len(self)}')
+            stop, step = start + 1, 1
+
+        if stop <= start:
+            return self.array[start:start][(slice(None),) + rest]
+
+        first_chunk = start // self._chunk_len
+        last_chunk = (stop - 1) // self._chunk_len
+        chunks = [self._read_chunk(i) for i in range(first_chunk, last_chunk + 1)]
+        data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+        offset = first_chunk * self._chunk_len
+        data = data[start - offset:stop - offset:step]
+        if not isinstance(first, slice):
+            return data[(0,) + rest]
+        return data[(slice(None),) + rest]
+
+
+def _chunked_to_numpy(arr: pa.ChunkedArray) -> np.ndarray:
+    """Convert to numpy without copying if the data is in a single chunk.
+
+    Zero-copy views of Arrow data are read-only.
+    """
+    if arr.num_chunks == 1:
+        return arr.chunk(0).to_numpy(zero_copy_only=False)
+    return arr.to_numpy()
+
+
+def _read_parquet(data_path: Path, memory_map: bool = False) -> np.ndarray:
+    table = pq.read_table(data_path, columns=['data'], memory_map=memory_map)
+    if memory_map:
+        return _chunked_to_numpy(table['data'])
+    return table['data'].to_numpy()
+
+
+def _read_parquet_window(
+        data_path: Path,
+        start: int,
+        stop: int,
+        memory_map: bool = False) -> np.ndarray:
+    """Read samples [start, stop) from the row groups that overlap the window."""
+    pq_file = pq.ParquetFile(data_path, memory_map=memory_map)
+    row_group_sizes = [pq_file.metadata.row_group(i).num_rows
+                       for i in range(pq_file.metadata.num_row_groups)]
+    offsets = np.cumsum([0] + row_group_sizes)
+
+    stop = min(stop, offsets[-1])
+    if start >= stop:
+        dtype = pq_file.schema_arrow.field('data').type.to_pandas_dtype()
+        return np.empty(0, dtype=dtype)
+
+    first = np.searchsorted(offsets, start, side='right') - 1
+    last = np.searchsorted(offsets, stop, side='left')
+    table = pq_file.read_row_groups(range(first, last), columns=['data'])
+
+    if memory_map:
+        arr = _chunked_to_numpy(table['data'])
+    else:
+        arr = table['data'].to_numpy()
+    return arr[start - offsets[first]:stop - offsets[first]]
+
+
+def _load_npy(data_path: Path) -> np.memmap:
+    return np.load(data_path, mmap_mode='r', allow_pickle=False)
+
+
+def _read_container_parquet(
+        container: SeriesContainer,
+        data_path: Path,
+        memory_map: bool = False) -> np.ndarray:
+    return _read_parquet(container.parquet_source(data_path), memory_map=memory_map)
+
+
+def _load_container_zarr(container: SeriesContainer, data_path: Path) -> np.ndarray:
+    return container.open_zarr(data_path)[:]
+
+
+class _OpenOnce:
+    """Call `open_func` on the first call and return the same array on every call.
+
+    Unlike `functools.cache`, this can be pickled, e.g. to send the sample arrays
+    to the worker processes of `sleeplab_format.writer.write_series`. The opened
+    array is not pickled.
+    """
+    def __init__(self, open_func: Callable) -> None:
+        self.open_func = open_func
+        self._lock = threading.Lock()
+        self._array = None
+
+    def __call__(self):
+        with self._lock:
+            if self._array is None:
+                self._array = self.open_func()
+            return self._array
+
+    def __getstate__(self) -> dict:
+        return {'open_func': self.open_func}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['open_func'])
+
+
+def _open_zarr(
+        data_path: Path,
+        chunk_cache_size: int | None = None,
+        container: SeriesContainer | None = None) -> zarr.Array | ChunkCachedArray:
+    if container is not None:
+        z = container.open_zarr(data_path)
+    else:
+        z = zarr.open_array(str(data_path), mode='r')
+    if chunk_cache_size is not None:
+        return ChunkCachedArray(z, chunk_cache_size)
+    return z
+
+
+def _array_funcs(
+        data_path: Path,
+        array_format: str,
+        zarr_mode: str = 'load',
+        zarr_chunk_cache_size: int | None = None,
+        parquet_mode: str = 'read',
+        container: SeriesContainer | None = None) -> tuple[Callable, Callable]:
+    """Create the functions that read the whole array and the samples
+    [start, stop) of the array in `data_path`.
+
+    If `container` is given, `data_path` is the path of the array in the
+    unpacked series folder, and the array is read from the container.
+
+    The values_func can be pickled, except with `zarr_mode='open'`.
 
     Returns:
-        All sample arrays in a dictionary.
+        A tuple (values_func, window_func).
     """
-    sarrs = {}
-    for p in subject_dir.iterdir():
-        if p.is_dir() and not p.name.startswith('.'):
-            with open(p / 'attributes.json', 'rb') as f:
-                raw_data = f.read().decode('utf-8')
-                attributes = ArrayAttributes.model_validate_json(raw_data)
-
-            if (p / 'data.npy').exists():
-                # Return a function that returns a memmapped numpy array
-                values_func = lambda _p=p / 'data.npy': np.load(
-                    _p, mmap_mode='r', allow_pickle=False)
-            elif (p / 'data.parquet').exists():
-                values_func = lambda _p=p / 'data.parquet': pq.read_table(
-                    _p)['data'].to_numpy()
-            elif (p / 'data.zarr').exists():
-                values_func = lambda _p=p / 'data.zarr': zarr.load(_p)
+    if array_format == 'numpy':
+        # Return a function that returns a memmapped numpy array
+        if container is not None:
+            values_func = functools.partial(container.load_npy, data_path)
+        else:
+            values_func = functools.partial(_load_npy, data_path)
+        window_func = lambda start, stop: values_func()[start:stop]
+    elif array_format == 'parquet':
+        if parquet_mode not in ['read', 'mmap']:
+            raise AttributeError(f'Unsupported parquet_mode: {parquet_mode}')
+        memory_map = parquet_mode == 'mmap'
+        if container is not None:
+            source = lambda: container.parquet_source(data_path)
+            values_func = functools.partial(
+                _read_container_parquet, container, data_path, memory_map=memory_map)
+        else:
+            source = lambda: data_path
+            values_func = functools.partial(_read_parquet, data_path, memory_map=memory_map)
+        window_func = lambda start, stop: _read_parquet_window(
+            source(), start, stop, memory_map=memory_map)
+    elif array_format == 'zarr':
+        if zarr_mode == 'load':
+            if container is not None:
+                values_func = functools.partial(_load_container_zarr, container, data_path)
             else:
-                raise FileNotFoundError(f'No data.npy, data.zarr, or data.parquet in {p}')
+                values_func = functools.partial(zarr.load, data_path)
+            # Only the chunks overlapping the window are decompressed
+            window_func = lambda start, stop: _open_zarr(data_path, container=container)[start:stop]
+        elif zarr_mode == 'open':
+            # Share the opened array, and the chunk cache, between values and windows
+            values_func = functools.cache(
+                lambda: _open_zarr(data_path, chunk_cache_size=zarr_chunk_cache_size, container=container))
+            window_func = lambda start, stop: values_func()[start:stop]
+        else:
+            raise AttributeError(f'Unsupported zarr_mode: {zarr_mode}')
+    else:
+        raise AttributeError(f'Unsupported sample array format: {array_format}')
 
-            assert p.name == attributes.name
-            sarrs[p.name] = SampleArray(
-                attributes=attributes, values_func=values_func)
-    return sarrs
+    return values_func, window_func
 
 
-def read_annotations(subject_dir: Path) -> dict[str, list[Annotation]] | None:
-    """Read all subject's annotations.
+def _nbytes(path: Path) -> int:
+    """Get the size of a file, or the total size of files in a folder."""
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return path.stat().st_size
+
+
+def _array_shape_and_dtype(
+        data_path: Path,
+        array_format: str) -> tuple[list[int], str]:
+    """Read the shape and dtype of an array without reading the data."""
+    if array_format == 'numpy':
+        arr = np.load(data_path, mmap_mode='r', allow_pickle=False)
+        return list(arr.shape), arr.dtype.str
+    elif array_format == 'parquet':
+        pq_file = pq.ParquetFile(data_path)
+        dtype = np.dtype(pq_file.schema_arrow.field('data').type.to_pandas_dtype())
+        return [pq_file.metadata.num_rows], dtype.str
+    else:
+        z = zarr.open_array(str(data_path), mode='r')
+        return list(z.shape), z.dtype.str
+
+
+def scan_sample_array(
+        array_dir: Path,
+        include_details: bool = False,
+        validate: str = 'full') -> ArrayEntry:
+    """Read the attributes and find the data file of a sample array.
+
+    Arguments:
+        array_dir: The sample array folder.
+        include_details: Whether to include the size, shape and dtype of the data.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        The catalog entry of the sample array.
+    """
+    with open(array_dir / 'attributes.json', 'rb') as f:
+        raw_data = f.read().decode('utf-8')
+        attributes = ArrayAttributes.model_validate_json(
+            raw_data, context=validation_context(validate))
+
+    for array_format, fname in ARRAY_FILENAMES.items():
+        if (array_dir / fname).exists():
+            break
+    else:
+        raise FileNotFoundError(f'No data.npy, data.zarr, or data.parquet in {array_dir}')
+
+    assert array_dir.name == attributes.name
+    # Model validators also run on validated instances, so pass the validation level
+    entry = ArrayEntry.model_validate({
+        'attributes': attributes,
+        'format': array_format,
+        'path': f'{array_dir.name}/{fname}'},
+        context=validation_context(validate))
+
+    if include_details:
+        data_path = array_dir / fname
+        entry.nbytes = _nbytes(data_path)
+        entry.shape, entry.dtype = _array_shape_and_dtype(data_path, array_format)
+
+    return entry
+
+
+def scan_packed_arrays(
+        group_dir: Path,
+        include_details: bool = False,
+        validate: str = 'full') -> dict[str, ArrayEntry]:
+    """Read the channel attributes and find the data file of a packed 2D array.
+
+    Arguments:
+        group_dir: The `_packed_<i>` folder.
+        include_details: Whether to include the size, shape and dtype of the data.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        The catalog entries of the channels by array name.
+    """
+    with open(group_dir / PACKED_CHANNELS_FILENAME, 'rb') as f:
+        raw_data = f.read().decode('utf-8')
+        channels = PackedChannels.model_validate_json(
+            raw_data, context=validation_context(validate)).channels
+
+    for array_format in ['numpy', 'zarr']:
+        fname = ARRAY_FILENAMES[array_format]
+        if (group_dir / fname).exists():
+            break
+    else:
+        raise FileNotFoundError(f'No data.npy or data.zarr in {group_dir}')
+
+    entries = {attributes.name: ArrayEntry.model_validate({
+            'attributes': attributes,
+            'format': array_format,
+            'path': f'{group_dir.name}/{fname}',
+            'row': row},
+            context=validation_context(validate))
+        for row, attributes in enumerate(channels)}
+
+    if include_details:
+        data_path = group_dir / fname
+        nbytes = _nbytes(data_path)
+        shape, dtype = _array_shape_and_dtype(data_path, array_format)
+        for entry in entries.values():
+            entry.nbytes = nbytes
+            entry.shape, entry.dtype = shape[1:], dtype
+
+    return entries
+
+
+def scan_subject(
+        subject_dir: Path,
+        include_details: bool = False,
+        max_workers: int | None = None,
+        array_names: list[str] | None = None,
+        annotation_names: list[str] | None = None,
+        validate: str = 'full') -> SubjectEntry:
+    """Read the metadata and find the sample arrays and annotations of a subject.
 
     Arguments:
         subject_dir: The subject folder.
+        include_details: Whether to include the file sizes, and the shapes and dtypes of the arrays.
+        max_workers: If given, read the array attributes using a thread pool of this size.
+        array_names: If given, only include the sample arrays matching these glob patterns.
+        annotation_names: If given, only include the annotations matching these glob patterns.
+        validate: The validation level, see `read_dataset`.
 
     Returns:
-        All annotations in a dictionary.
+        The catalog entry of the subject.
     """
+    metadata = read_subject_metadata(subject_dir, validate=validate)
+
+    array_dirs = []
+    group_dirs = []
     annotations = {}
     for p in subject_dir.iterdir():
-
-        if p.name.endswith(JSON_ANNOTATION_SUFFIX):            
+        if p.is_dir() and not p.name.startswith('.'):
+            if (p / PACKED_CHANNELS_FILENAME).exists():
+                group_dirs.append(p)
+            elif _match_names(p.name, array_names):
+                array_dirs.append(p)
+        elif p.name.endswith(JSON_ANNOTATION_SUFFIX):
             annotation_name = p.name.removesuffix(JSON_ANNOTATION_SUFFIX)
-            with open(p, 'rb') as f:
-                raw_data = f.read().decode('utf-8')
-                annotations[annotation_name] = BaseAnnotations.model_validate_json(raw_data)
+            if _match_names(annotation_name, annotation_names):
+                annotations[annotation_name] = AnnotationEntry(format='json', path=p.name)
         elif p.name.endswith(PARQUET_ANNOTATION_SUFFIX):
             annotation_name = p.name.removesuffix(PARQUET_ANNOTATION_SUFFIX)
-            annotation_meta_path = subject_dir / f'{annotation_name}{PARQUET_ANNOTATION_META_SUFFIX}'
+            if _match_names(annotation_name, annotation_names):
+                annotations[annotation_name] = AnnotationEntry(format='parquet', path=p.name)
+
+    if include_details:
+        for entry in annotations.values():
+            entry.nbytes = _nbytes(subject_dir / entry.path)
+
+    sarr_entries = _map(
+        lambda array_dir: scan_sample_array(
+            array_dir, include_details=include_details, validate=validate),
+        array_dirs,
+        max_workers=max_workers)
+
+    sample_arrays = {p.name: entry for p, entry in zip(array_dirs, sarr_entries)}
+    for group_dir in group_dirs:
+        entries = scan_packed_arrays(group_dir, include_details=include_details, validate=validate)
+        sample_arrays.update({name: entry for name, entry in entries.items()
+                              if _match_names(name, array_names)})
+
+    return SubjectEntry(
+        metadata=metadata,
+        sample_arrays=sample_arrays,
+        annotations=annotations)
+
+
+def scan_series(
+        series_dir: Path,
+        include_details: bool = False,
+        max_workers: int | None = None,
+        validate: str = 'full') -> dict[str, SubjectEntry]:
+    """Scan all subjects in a series folder.
+
+    Arguments:
+        series_dir: The series root folder.
+        include_details: Whether to include the file sizes, and the shapes and dtypes of the arrays.
+        max_workers: If given, scan the subjects concurrently using a thread pool of this size.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        The catalog entries of the subjects.
+    """
+    subject_dirs = [series_dir / sid for sid in _list_subjects(series_dir)]
+    entries = _map(
+        lambda subject_dir: scan_subject(
+            subject_dir, include_details=include_details, validate=validate),
+        subject_dirs,
+        max_workers=max_workers)
+
+    return {subject_dir.name: entry for subject_dir, entry in zip(subject_dirs, entries)}
+
+
+def scan_dataset(
+        ds_dir: Path,
+        include_details: bool = False,
+        max_workers: int | None = None,
+        validate: str = 'full') -> DatasetManifest:
+    """Walk through a dataset folder and catalog its contents.
+
+    Arguments:
+        ds_dir: The dataset root folder.
+        include_details: Whether to include the file sizes, and the shapes and dtypes of the arrays.
+        max_workers: If given, scan the subjects concurrently using a thread pool of this size.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        The dataset manifest.
+    """
+    with open(ds_dir / 'metadata.json', 'r', encoding='utf-8') as f:
+        ds_meta = json.load(f)
+
+    series = {}
+    for series_name in _list_series(ds_dir):
+        container = open_container(ds_dir / series_name, validate=validate)
+        if container is not None:
+            with container:
+                series[series_name] = container.subject_entries
+        else:
+            series[series_name] = scan_series(
+                ds_dir / series_name,
+                include_details=include_details,
+                max_workers=max_workers,
+                validate=validate)
+
+    return DatasetManifest(series=series, **ds_meta)
 
-            with open(annotation_meta_path, 'r', encoding='utf-8') as f:
-                ann_dict = json.load(f)
 
-            ann_df = pd.read_parquet(p)
-            ann_dict['annotations'] = ann_df.to_dict('records')
+def _list_series(ds_dir: Path) -> list[str]:
+    """List the series folders and containers of a dataset."""
+    series_names = []
+    for p in ds_dir.iterdir():
+        if p.name.startswith('.'):  # Ignore hidden folders.
+            continue
+        if p.is_dir():
+            series_names.append(p.name)
+        elif p.name.endswith(CONTAINER_SUFFIX):
+            series_names.append(p.name.removesuffix(CONTAINER_SUFFIX))
 
-            annotations[annotation_name] = BaseAnnotations.model_validate(ann_dict)
+    return list(dict.fromkeys(series_names))
 
-    if len(annotations) == 0:
+
+def read_subject_metadata(subject_dir: Path, validate: str = 'full') -> SubjectMetadata:
+    """Read the metadata of a single subject.
+
+    Arguments:
+        subject_dir: The subject folder.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        The subject metadata.
+    """
+    with open(subject_dir / 'metadata.json', 'rb') as f:
+        raw_data = f.read().decode('utf-8')
+        return SubjectMetadata.model_validate_json(raw_data, context=validation_context(validate))
+
+
+def _read_series_metadata(
+        series_dir: Path,
+        subject_entries: dict[str, SubjectEntry | None],
+        max_workers: int | None = None,
+        validate: str = 'full') -> dict[str, SubjectMetadata]:
+    """Get the subject metadata from the catalog entries, or read the missing ones."""
+    missing = [sid for sid, entry in subject_entries.items() if entry is None]
+    read_metadata = dict(zip(missing, _map(
+        lambda sid: read_subject_metadata(series_dir / sid, validate=validate),
+        missing,
+        max_workers=max_workers)))
+
+    return {sid: entry.metadata if entry is not None else read_metadata[sid]
+            for sid, entry in subject_entries.items()}
+
+
+def _metadata_table(metadata: dict[str, SubjectMetadata]) -> pd.DataFrame:
+    records = [{k: v.value if isinstance(v, Enum) else v for k, v in m.model_dump().items()}
+               for m in metadata.values()]
+    return pd.DataFrame.from_records(
+        records,
+        index=pd.Index(list(metadata.keys()), name='subject_dir'),
+        columns=list(SubjectMetadata.model_fields.keys()))
+
+
+def read_metadata_table(
+        series_dir: Path,
+        subject_entries: dict[str, SubjectEntry] | None = None,
+        max_workers: int | None = None,
+        validate: str = 'full') -> pd.DataFrame:
+    """Read the metadata of all subjects in a series to a table.
+
+    Arguments:
+        series_dir: The series root folder.
+        subject_entries: The catalog entries of the subjects, e.g. from the
+            dataset manifest. If None, the metadata files are read.
+        max_workers: If given, read the metadata files using a thread pool of this size.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        A DataFrame with a row per subject, indexed by the subject folder name.
+    """
+    container = open_container(series_dir, validate=validate)
+    if subject_entries is None and container is not None:
+        with container:
+            subject_entries = container.subject_entries
+    elif subject_entries is None:
+        subject_entries = {sid: None for sid in _list_subjects(series_dir)}
+
+    return _metadata_table(_read_series_metadata(
+        series_dir, subject_entries, max_workers=max_workers, validate=validate))
+
+
+def _filter_subjects(
+        series_dir: Path,
+        subject_entries: dict[str, SubjectEntry | None],
+        subject_filter: Callable[[SubjectMetadata], bool] | str,
+        max_workers: int | None = None,
+        validate: str = 'full') -> dict[str, SubjectEntry | None]:
+    """Keep only the subjects whose metadata passes `subject_filter`."""
+    metadata = _read_series_metadata(
+        series_dir, subject_entries, max_workers=max_workers, validate=validate)
+
+    if isinstance(subject_filter, str):
+        if len(metadata) == 0:
+            return {}
+        # Use the python engine to allow expressions such as `lights_off.notna()`
+        keep = set(_metadata_table(metadata).query(subject_filter, engine='python').index)
+    else:
+        keep = {sid for sid, m in metadata.items() if subject_filter(m)}
+
+    return {sid: entry for sid, entry in subject_entries.items() if sid in keep}
+
+
+def _list_subjects(series_dir: Path) -> list[str]:
+    return [subject_dir.name for subject_dir in series_dir.iterdir()
+            if not subject_dir.name.startswith('.')]  # Ignore hidden folders.
+
+
+def read_manifest(ds_dir: Path, validate: str = 'full') -> DatasetManifest | None:
+    """Read the dataset manifest if it exists.
+
+    Arguments:
+        ds_dir: The dataset root folder.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        The dataset manifest, or None if the dataset does not have a manifest.
+    """
+    manifest_path = ds_dir / MANIFEST_FILENAME
+    if not manifest_path.exists():
         return None
+
+    with open(manifest_path, 'rb') as f:
+        raw_data = f.read().decode('utf-8')
+        return DatasetManifest.model_validate_json(raw_data, context=validation_context(validate))
+
+
+def _dequantized(values_func: Callable, attributes: ArrayAttributes) -> np.ndarray:
+    return dequantize_values(values_func(), attributes)
+
+
+def _sample_array(
+        attributes: ArrayAttributes,
+        values_func: Callable,
+        window_func: Callable) -> SampleArray:
+    """Create a sample array, and dequantize the values lazily if the array is quantized."""
+    # Model validators also run on validated instances, so skip the checks
+    # of the attributes which were validated when read
+    if attributes.scale is None:
+        return SampleArray.model_validate({
+            'attributes': attributes,
+            'values_func': values_func,
+            'window_func': window_func},
+            context=validation_context('light'))
+
+    return SampleArray.model_validate({
+        'attributes': attributes,
+        'values_func': functools.partial(_dequantized, values_func, attributes),
+        'window_func': lambda start, stop: dequantize_values(window_func(start, stop), attributes),
+        'raw_values_func': values_func},
+        context=validation_context('light'))
+
+
+def _create_sample_array(
+        subject_dir: Path,
+        entry: ArrayEntry,
+        zarr_mode: str = 'load',
+        zarr_chunk_cache_size: int | None = None,
+        parquet_mode: str = 'read',
+        container: SeriesContainer | None = None) -> SampleArray:
+    values_func, window_func = _array_funcs(
+        subject_dir / entry.path,
+        entry.format,
+        zarr_mode=zarr_mode,
+        zarr_chunk_cache_size=zarr_chunk_cache_size,
+        parquet_mode=parquet_mode,
+        container=container)
+
+    return _sample_array(entry.attributes, values_func, window_func)
+
+
+def _packed_open_func(
+        data_path: Path,
+        array_format: str,
+        container: SeriesContainer | None = None) -> Callable:
+    """Create a function that opens a packed 2D array once and returns the same array on every call."""
+    if container is not None:
+        if array_format == 'numpy':
+            return _OpenOnce(functools.partial(container.load_npy, data_path))
+        return _OpenOnce(functools.partial(container.open_zarr, data_path))
+
+    if array_format == 'numpy':
+        return _OpenOnce(functools.partial(_load_npy, data_path))
+    return _OpenOnce(functools.partial(_open_zarr, data_path))
+
+
+def _row(open_func: Callable, row: int) -> np.ndarray:
+    return open_func()[row]
+
+
+def _row_funcs(open_func: Callable, row: int) -> tuple[Callable, Callable]:
+    """Create the values_func and window_func of a channel of a packed array.
+
+    For memory-mapped numpy arrays, the values are a zero-copy view of the row.
+    """
+    values_func = functools.partial(_row, open_func, row)
+    window_func = lambda start, stop: open_func()[row, start:stop]
+    return values_func, window_func
+
+
+def _create_sample_arrays(
+        subject_dir: Path,
+        entries: dict[str, ArrayEntry],
+        zarr_mode: str = 'load',
+        zarr_chunk_cache_size: int | None = None,
+        parquet_mode: str = 'read',
+        container: SeriesContainer | None = None) -> dict[str, SampleArray]:
+    """Create the sample arrays of a subject.
+
+    The channels of a packed array share the opened array.
+    """
+    open_funcs = {}
+    sample_arrays = {}
+    for name, entry in entries.items():
+        if entry.row is None:
+            sample_arrays[name] = _create_sample_array(
+                subject_dir,
+                entry,
+                zarr_mode=zarr_mode,
+                zarr_chunk_cache_size=zarr_chunk_cache_size,
+                parquet_mode=parquet_mode,
+                container=container)
+            continue
+
+        if entry.path not in open_funcs:
+            open_funcs[entry.path] = _packed_open_func(
+                subject_dir / entry.path, entry.format, container=container)
+        values_func, window_func = _row_funcs(open_funcs[entry.path], entry.row)
+        sample_arrays[name] = _sample_array(entry.attributes, values_func, window_func)
+
+    return sample_arrays
+
+
+def _dataset_fingerprint(ds_dir: Path, use_manifest: bool = True) -> str:
+    """Hash the paths, sizes and modification times of the dataset files.
+
+    If the dataset has a manifest, only the manifest is checked. Otherwise all
+    files are checked except hidden files and the chunks inside zarr arrays.
+    """
+    h = hashlib.sha256(f'{CACHE_VERSION}:{SLEEPLAB_FORMAT_VERSION}\n'.encode())
+
+    manifest_path = ds_dir / MANIFEST_FILENAME
+    if use_manifest and manifest_path.exists():
+        st = manifest_path.stat()
+        h.update(f'{MANIFEST_FILENAME}:{st.st_size}:{st.st_mtime_ns}\n'.encode())
+        return h.hexdigest()
+
+    def _walk(dir_path: str, rel_dir: str) -> None:
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for e in entries:
+            if e.name.startswith('.'):
+                continue
+            st = e.stat()
+            rel_path = f'{rel_dir}/{e.name}'
+            h.update(f'{rel_path}:{st.st_size}:{st.st_mtime_ns}\n'.encode())
+            if e.is_dir() and not e.name.endswith('.zarr'):
+                _walk(e.path, rel_path)
+
+    _walk(str(ds_dir), '')
+    return h.hexdigest()
+
+
+def read_cached_manifest(
+        ds_dir: Path,
+        cache_dir: Path | None = None,
+        use_manifest: bool = True,
+        max_workers: int | None = None) -> DatasetManifest:
+    """Read the validated dataset structure from an on-disk cache.
+
+    The cache is a pickled `DatasetManifest` that includes the subject metadata,
+    array attributes and the annotation files. It is invalidated when the
+    file sizes or modification times in the dataset change, or the manifest
+    changes if the dataset has one. On a cache miss, the manifest is read or
+    the dataset is scanned, and the result is written to the cache.
+
+    The cache is unpickled, so only use cache folders writable by trusted users.
+
+    Arguments:
+        ds_dir: The dataset root folder.
+        cache_dir: The cache folder. Defaults to `.slf_cache` in the dataset root.
+        use_manifest: Whether to use the dataset manifest if it exists.
+        max_workers: If given, scan the subjects concurrently using a thread pool of this size.
+
+    Returns:
+        The dataset manifest.
+    """
+    if cache_dir is None:
+        cache_dir = ds_dir / CACHE_DIRNAME
+    cache_path = Path(cache_dir) / CACHE_FILENAME
+
+    fingerprint = _dataset_fingerprint(ds_dir, use_manifest=use_manifest)
+    if cache_path.exists():
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['fingerprint'] == fingerprint:
+            return cached['manifest']
+        logger.info(f'Dataset {ds_dir} has changed, updating cache {cache_path}')
+
+    manifest = read_manifest(ds_dir) if use_manifest else None
+    if manifest is None:
+        manifest = scan_dataset(ds_dir, max_workers=max_workers)
+
+    # Write to a temporary file first so that concurrent readers never see a partial file
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'fingerprint': fingerprint, 'manifest': manifest}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+    return manifest
+
+
+def read_sample_array(
+        array_dir: Path,
+        zarr_mode: str = 'load',
+        zarr_chunk_cache_size: int | None = None,
+        parquet_mode: str = 'read',
+        validate: str = 'full') -> SampleArray:
+    """Read a single sample array.
+
+    Arguments:
+        array_dir: The sample array folder.
+        zarr_mode: `load` to decompress zarr arrays fully to memory when accessing
+            the values, or `open` to return a read-only `zarr.Array` which
+            decompresses the chunks on access.
+        zarr_chunk_cache_size: If given with `zarr_mode='open'`, keep this many
+            decoded chunks per array in an LRU cache.
+        parquet_mode: `read` to read parquet arrays to writable numpy arrays, or
+            `mmap` to memory map the files and return read-only zero-copy views
+            of the row groups.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        The sample array whose `values_func` reads the data lazily.
+    """
+    entry = scan_sample_array(array_dir, validate=validate)
+    return _create_sample_array(
+        array_dir.parent,
+        entry,
+        zarr_mode=zarr_mode,
+        zarr_chunk_cache_size=zarr_chunk_cache_size,
+        parquet_mode=parquet_mode)
+
+
+def read_sample_arrays(
+        subject_dir: Path,
+        max_workers: int | None = None,
+        zarr_mode: str = 'load',
+        zarr_chunk_cache_size: int | None = None,
+        parquet_mode: str = 'read',
+        array_names: list[str] | None = None,
+        validate: str = 'full') -> dict[str, SampleArray] | None:
+    """Read all subject's sample arrays.
+
+    The channels of a packed array share a single opened 2D array. With numpy,
+    their values are zero-copy views of the rows of the memory-mapped array.
+    With zarr, the values are decompressed from the 2D array on each access,
+    and `zarr_mode` and `zarr_chunk_cache_size` do not apply.
+
+    Arguments:
+        subject_dir: The subject folder.
+        max_workers: If given, read the attributes using a thread pool of this size.
+        zarr_mode: `load` or `open`, see `read_sample_array`.
+        zarr_chunk_cache_size: The number of decoded chunks cached per array if `zarr_mode='open'`.
+        parquet_mode: `read` or `mmap`, see `read_sample_array`.
+        array_names: If given, only read the sample arrays matching these glob patterns.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        All sample arrays in a dictionary.
+    """
+    array_dirs = []
+    entries = {}
+    for p in subject_dir.iterdir():
+        if not p.is_dir() or p.name.startswith('.'):
+            continue
+        if (p / PACKED_CHANNELS_FILENAME).exists():
+            entries.update({name: entry for name, entry in scan_packed_arrays(p, validate=validate).items()
+                            if _match_names(name, array_names)})
+        elif _match_names(p.name, array_names):
+            array_dirs.append(p)
+
+    sarrs = _map(
+        lambda array_dir: read_sample_array(
+            array_dir,
+            zarr_mode=zarr_mode,
+            zarr_chunk_cache_size=zarr_chunk_cache_size,
+            parquet_mode=parquet_mode,
+            validate=validate),
+        array_dirs,
+        max_workers=max_workers)
+    sample_arrays = {p.name: sarr for p, sarr in zip(array_dirs, sarrs)}
+    sample_arrays.update(_create_sample_arrays(
+        subject_dir,
+        entries,
+        zarr_mode=zarr_mode,
+        zarr_chunk_cache_size=zarr_chunk_cache_size,
+        parquet_mode=parquet_mode))
+    return sample_arrays
+
+
+def read_annotation(
+        annotation_path: Path,
+        columnar_annotations: bool = False,
+        container: SeriesContainer | None = None,
+        validate: str = 'full',
+        check_names: bool = False) -> BaseAnnotations | ColumnarAnnotations:
+    """Read a single annotation file.
+
+    Arguments:
+        annotation_path: Path to a `.a.json` or `.a.parquet` file.
+        columnar_annotations: If True, read the annotations to
+            `sleeplab_format.models.ColumnarAnnotations` without creating
+            an `Annotation` object per row.
+        container: If given, read the file from this series container.
+            `annotation_path` is then the path in the unpacked series folder.
+        validate: The validation level, see `read_dataset`.
+        check_names: If True, check that the names of the known annotation types
+            are members of their enums, see `sleeplab_format.models.check_annotation_names`.
+
+    Returns:
+        The annotations.
+    """
+    if container is not None:
+        read_bytes = container.read_bytes
+    else:
+        read_bytes = lambda path: path.read_bytes()
+
+    if annotation_path.name.endswith(JSON_ANNOTATION_SUFFIX):
+        raw_data = read_bytes(annotation_path).decode('utf-8')
+        if columnar_annotations:
+            ann_dict = json.loads(raw_data)
+            annotations = ColumnarAnnotations.from_records(
+                ann_dict['scorer'], ann_dict['type'], ann_dict['annotations'], validate=validate)
+        else:
+            annotations = BaseAnnotations.model_validate_json(raw_data, context=validation_context(validate))
+    else:
+        annotation_name = annotation_path.name.removesuffix(PARQUET_ANNOTATION_SUFFIX)
+        annotation_meta_path = annotation_path.parent / f'{annotation_name}{PARQUET_ANNOTATION_META_SUFFIX}'
+        ann_dict = json.loads(read_bytes(annotation_meta_path).decode('utf-8'))
+
+        if container is not None:
+            table = pq.read_table(container.parquet_source(annotation_path))
+        else:
+            table = pq.read_table(annotation_path)
+
+        if validate == 'none':
+            # Trust that the table has the schema written by `write_annotations`
+            annotations = ColumnarAnnotations.model_construct(table=table, **ann_dict)
+        else:
+            # The columns are normalized to the annotation schema, so files written
+            # through pandas by older versions are read similarly
+            annotations = ColumnarAnnotations.model_validate(
+                {'table': table, **ann_dict}, context=validation_context(validate))
+        if not columnar_annotations:
+            annotations = annotations.to_annotations(validate=validate)
+
+    if check_names:
+        check_annotation_names(annotations)
     return annotations
 
 
+def read_epoch_array(
+        subject_dir: Path,
+        annotation_key: str,
+        container: SeriesContainer | None = None) -> np.ndarray | None:
+    """Read the epoch labels of a hypnogram written with `hypnogram_epoch_sec`.
+
+    See `sleeplab_format.writer.write_annotations`.
+
+    Arguments:
+        subject_dir: The subject folder.
+        annotation_key: The annotation key, e.g. `scorer_1_hypnogram`.
+        container: If given, read the labels from this series container.
+
+    Returns:
+        The memory-mapped uint8 epoch labels, or None if the sidecar does not exist.
+    """
+    epochs_path = subject_dir / f'{annotation_key}{EPOCH_ARRAY_SUFFIX}'
+    if container is not None:
+        try:
+            return container.load_npy(epochs_path)
+        except KeyError:
+            return None
+
+    if not epochs_path.exists():
+        return None
+    return np.load(epochs_path, mmap_mode='r', allow_pickle=False)
+
+
+def read_annotations(
+        subject_dir: Path,
+        max_workers: int | None = None,
+        columnar_annotations: bool = False,
+        annotation_names: list[str] | None = None,
+        validate: str = 'full') -> dict[str, list[Annotation]] | None:
+    """Read all subject's annotations.
+
+    Arguments:
+        subject_dir: The subject folder.
+        max_workers: If given, read the annotation files using a thread pool of this size.
+        columnar_annotations: Whether to read the annotations to `ColumnarAnnotations`.
+        annotation_names: If given, only read the annotations matching these glob patterns.
+        validate: The validation level, see `read_dataset`.
+
+    Returns:
+        All annotations in a dictionary.
+    """
+    annotation_paths = {}
+    for p in subject_dir.iterdir():
+        if p.name.endswith(JSON_ANNOTATION_SUFFIX):
+            annotation_paths[p.name.removesuffix(JSON_ANNOTATION_SUFFIX)] = p
+        elif p.name.endswith(PARQUET_ANNOTATION_SUFFIX):
+            annotation_paths[p.name.removesuffix(PARQUET_ANNOTATION_SUFFIX)] = p
+
+    annotation_paths = {k: v for k, v in annotation_paths.items()
+                        if _match_names(k, annotation_names)}
+
+    if len(annotation_paths) == 0:
+        return None
+
+    annotations = _map(
+        lambda p: read_annotation(p, columnar_annotations=columnar_annotations, validate=validate),
+        annotation_paths.values(),
+        max_workers=max_workers)
+    return dict(zip(annotation_paths.keys(), annotations))
+
+
 def read_subject(
         subject_dir: Path,
-        include_annotations: bool = True) -> Subject:
+        include_annotations: bool = True,
+        max_workers: int | None = None,
+        entry: SubjectEntry | None = None,
+        zarr_mode: str = 'load',
+        zarr_chunk_cache_size: int | None = None,
+        parquet_mode: str = 'read',
+        columnar_annotations: bool = False,
+        array_names: list[str] | None = None,
+        annotation_names: list[str] | None = None,
+        container: SeriesContainer | None = None,
+        validate: str = 'full') -> Subject:
     """Read a single subject to `sleeplab_format.models.Subject`.
 
     Arguments:
         subject_dir: The subject folder.
         include_annotations: Whether to include the annotations.
+        max_workers: If given, parse the metadata, array attributes and
+            annotation files concurrently using a thread pool of this size.
+        entry: The catalog entry of the subject, e.g. from the dataset manifest.
+            If None, the subject folder is scanned.
+        zarr_mode: `load` or `open`, see `read_sample_array`.
+        zarr_chunk_cache_size: The number of decoded chunks cached per array if `zarr_mode='open'`.
+        parquet_mode: `read` or `mmap`, see `read_sample_array`.
+        columnar_annotations: Whether to read the annotations to `ColumnarAnnotations`.
+        array_names: If given, only read the sample arrays matching these glob patterns.
+        annotation_names: If given, only read the annotations matching these glob patterns.
+        container: If given, read the subject from this series container.
+            `subject_dir` is then the path of the subject in the unpacked series folder.
+        validate: The validation level, see `read_dataset`.
 
     Returns:
         The resulting subject.
     """
-    with open(subject_dir / 'metadata.json', 'rb') as f:
-        raw_data = f.read().decode('utf-8')
-        metadata = SubjectMetadata.model_validate_json(raw_data)
-    
-    sample_arrays = read_sample_arrays(subject_dir)
+    if entry is None and container is not None:
+        entry = container.subject_entries[subject_dir.name]
+    elif entry is None:
+        entry = scan_subject(
+            subject_dir,
+            max_workers=max_workers,
+            array_names=array_names,
+            annotation_names=annotation_names,
+            validate=validate)
 
-    if include_annotations:
-        annotations = read_annotations(subject_dir)
+    sample_arrays = _create_sample_arrays(
+        subject_dir,
+        {name: sarr_entry for name, sarr_entry in entry.sample_arrays.items()
+         if _match_names(name, array_names)},
+        zarr_mode=zarr_mode,
+        zarr_chunk_cache_size=zarr_chunk_cache_size,
+        parquet_mode=parquet_mode,
+        container=container)
+
+    annotation_entries = {name: ann_entry
+        for name, ann_entry in entry.annotations.items()
+        if _match_names(name, annotation_names)}
+
+    if include_annotations and len(annotation_entries) > 0:
+        annotations = _map(
+            lambda p: read_annotation(
+                p, columnar_annotations=columnar_annotations, container=container, validate=validate),
+            [subject_dir / ann_entry.path for ann_entry in annotation_entries.values()],
+            max_workers=max_workers)
+        annotations = dict(zip(annotation_entries.keys(), annotations))
     else:
         annotations = None
 
-    return Subject(
-        metadata=metadata,
-        sample_arrays=sample_arrays,
-        annotations=annotations,
-    )
+    # Skip the checks of the annotations which were validated when read
+    return Subject.model_validate({
+        'metadata': entry.metadata,
+        'sample_arrays': sample_arrays,
+        'annotations': annotations},
+        context=validation_context('light'))
+
+
+def _with_container(series: Series, container: SeriesContainer | None) -> Series:
+    """Close the file handles of the series container when the series is garbage collected.
+
+    The handles are reopened if the subjects are still used after that.
+    """
+    if container is not None:
+        weakref.finalize(series, container.close)
+    return series
 
 
 def read_series(
         series_dir: Path,
-        include_annotations: bool = True) -> Series:
+        include_annotations: bool = True,
+        max_workers: int | None = None,
+        subject_entries: dict[str, SubjectEntry] | None = None,
+        lazy: bool = False,
+        subject_cache_size: int | None = 128,
+        zarr_mode: str = 'load',
+        zarr_chunk_cache_size: int | None = None,
+        parquet_mode: str = 'read',
+        columnar_annotations: bool = False,
+        array_names: list[str] | None = None,
+        annotation_names: list[str] | None = None,
+        subject_filter: Callable[[SubjectMetadata], bool] | str | None = None,
+        validate: str = 'full') -> Series:
     """Read a single series to `sleeplab_format.models.Series`.
 
     Arguments:
         series_dir: The series root folder.
         include_annotations: Whether to include the annotations.
+        max_workers: If given, read the subjects concurrently using
+            a thread pool of this size. If `lazy`, the files of each
+            subject are read concurrently instead.
+        subject_entries: The catalog entries of the subjects, e.g. from the
+            dataset manifest. If None, the series folder is scanned, or the
+            index of the series container is used.
+        lazy: If True, only find the subject IDs, and read each subject
+            on first access. The subjects will be `sleeplab_format.models.LazySubjects`.
+        subject_cache_size: The max number of read subjects cached if `lazy`.
+        zarr_mode: `load` or `open`, see `read_sample_array`.
+        zarr_chunk_cache_size: The number of decoded chunks cached per array if `zarr_mode='open'`.
+        parquet_mode: `read` or `mmap`, see `read_sample_array`.
+        columnar_annotations: Whether to read the annotations to `ColumnarAnnotations`.
+        array_names: If given, only read the sample arrays matching these glob patterns.
+        annotation_names: If given, only read the annotations matching these glob patterns.
+        subject_filter: If given, only read the subjects whose metadata passes the filter.
+            See `read_dataset`.
+        validate: The validation level, see `read_dataset`.
 
     Returns:
         The resulting series.
     """
-    return Series(
+    # A series written with layout='container' is read from `<series_dir>.slf.zip`
+    container = open_container(series_dir, validate=validate)
+    if subject_entries is None and container is not None:
+        subject_entries = container.subject_entries
+    elif subject_entries is None:
+        subject_entries = {sid: None for sid in _list_subjects(series_dir)}
+
+    if subject_filter is not None:
+        subject_entries = _filter_subjects(
+            series_dir, subject_entries, subject_filter, max_workers=max_workers, validate=validate)
+
+    if lazy:
+        subjects = LazySubjects(
+            subject_entries.keys(),
+            lambda sid: read_subject(
+                series_dir / sid,
+                include_annotations=include_annotations,
+                max_workers=max_workers,
+                entry=subject_entries[sid],
+                zarr_mode=zarr_mode,
+                zarr_chunk_cache_size=zarr_chunk_cache_size,
+                parquet_mode=parquet_mode,
+                columnar_annotations=columnar_annotations,
+                array_names=array_names,
+                annotation_names=annotation_names,
+                container=container,
+                validate=validate),
+            cache_size=subject_cache_size)
+        return _with_container(Series(name=series_dir.name, subjects=subjects), container)
+
+    # Subjects are read in parallel, so each subject's files are read sequentially
+    subjects = _map(
+        lambda item: read_subject(
+            series_dir / item[0],
+            include_annotations=include_annotations,
+            entry=item[1],
+            zarr_mode=zarr_mode,
+            zarr_chunk_cache_size=zarr_chunk_cache_size,
+            parquet_mode=parquet_mode,
+            columnar_annotations=columnar_annotations,
+            array_names=array_names,
+            annotation_names=annotation_names,
+            container=container,
+            validate=validate),
+        subject_entries.items(),
+        max_workers=max_workers)
+
+    return _with_container(Series(
         name=series_dir.name,
-        subjects={subject_dir.name: read_subject(
-                subject_dir, include_annotations=include_annotations)
-            for subject_dir in series_dir.iterdir()
-            if not subject_dir.name.startswith('.')}  # Ignore hidden folders.
-    )
+        subjects=dict(zip(subject_entries.keys(), subjects))
+    ), container)
 
 
 def read_dataset(
         ds_dir: Path,
         series_names: list[str] | None = None,
-        include_annotations: bool = True) -> Dataset:
+        include_annotations: bool = True,
+        max_workers: int | None = None,
+        use_manifest: bool = True,
+        lazy: bool = False,
+        subject_cache_size: int | None = 128,
+        zarr_mode: str = 'load',
+        zarr_chunk_cache_size: int | None = None,
+        parquet_mode: str = 'read',
+        columnar_annotations: bool = False,
+        array_names: list[str] | None = None,
+        annotation_names: list[str] | None = None,
+        subject_filter: Callable[[SubjectMetadata], bool] | str | None = None,
+        use_cache: bool = False,
+        cache_dir: Path | None = None,
+        validate: str = 'full') -> Dataset:
     """Read a dataset stored in sleeplab-format.
 
+    If the dataset has a manifest written by `sleeplab_format.writer.write_manifest`,
+    the dataset structure is read from the manifest instead of walking the folders.
+
     Arguments:
         ds_dir: The dataset root folder.
         series_names: The series included in the resulting dataset.
         include_annotations: Whether to include annotations or only read the sample arrays.
+        max_workers: If given, read the subjects concurrently using
+            a thread pool of this size. Useful especially on network file systems.
+        use_manifest: Whether to use the dataset manifest if it exists.
+        lazy: If True, only find the subject IDs, and read each subject
+            on first access.
+        subject_cache_size: The max number of read subjects cached per series if `lazy`.
+        zarr_mode: `load` to decompress zarr arrays fully to memory when accessing
+            the values, or `open` to return a read-only `zarr.Array` which
+            decompresses the chunks on access.
+        zarr_chunk_cache_size: If given with `zarr_mode='open'`, keep this many
+            decoded chunks per array in an LRU cache.
+        parquet_mode: `read` to read parquet arrays to writable numpy arrays, or
+            `mmap` to memory map the files and return read-only zero-copy views
+            of the row groups.
+        columnar_annotations: If True, read the annotation files to
+            `sleeplab_format.models.ColumnarAnnotations` without creating
+            an `Annotation` object per row.
+        array_names: If given, only read the sample arrays matching these glob patterns,
+            e.g. `['C4_M1', 'E1_*']`. The other arrays are never opened.
+        annotation_names: If given, only read the annotations matching these glob patterns,
+            e.g. `['*_hypnogram']`.
+        subject_filter: If given, only read the subjects whose metadata passes the filter.
+            Either a function that takes `SubjectMetadata` and returns a bool, or
+            a `pandas.DataFrame.query` expression evaluated on the metadata table
+            from `read_metadata_table`, e.g. `"age >= 40 and lights_off.notna() and sex == 'FEMALE'"`.
+            The filter is evaluated before reading any sample arrays or annotations.
+            With a manifest, the subject folders are not opened for filtering.
+        use_cache: If True, read the dataset structure from an on-disk cache of the
+            parsed and validated metadata. See `read_cached_manifest`.
+        cache_dir: The cache folder if `use_cache`. Defaults to `.slf_cache` in the dataset root.
+        validate: `full` to validate the files with all checks, `light` to only parse and
+            type-check the files with pydantic and skip the consistency checks, such as
+            the sampling rate of the array attributes, or `none` to also trust the annotation
+            tables to have the schema written by `sleeplab_format.writer`. JSON annotation
+            files are parsed in the same way with `none` as with `light`. Use `light` or
+            `none` only for datasets written by this library, and validate them
+            separately with `validate_dataset`.
 
     Returns:
         The resulting dataset.
     """
-    with open(ds_dir / 'metadata.json', 'r', encoding='utf-8') as f:
-        ds_meta = json.load(f)
+    assert validate in VALIDATION_LEVELS, f'validate should be one of {VALIDATION_LEVELS}'
+
+    if use_cache:
+        manifest = read_cached_manifest(
+            ds_dir, cache_dir=cache_dir, use_manifest=use_manifest, max_workers=max_workers)
+    else:
+        manifest = read_manifest(ds_dir, validate=validate) if use_manifest else None
+
+    if manifest is not None:
+        ds_meta = {'name': manifest.name, 'version': manifest.version}
+    else:
+        with open(ds_dir / 'metadata.json', 'r', encoding='utf-8') as f:
+            ds_meta = json.load(f)
 
     assert ds_meta['name'] == ds_dir.name
     if ds_meta['version'] != SLEEPLAB_FORMAT_VERSION:
@@ -160,16 +1330,127 @@ def read_dataset(
             f'Reading dataset version {ds_meta["version"]} with sleeplab-format version {SLEEPLAB_FORMAT_VERSION}')
 
     if series_names is None:
-        series = {series_dir.name: read_series(
-                series_dir, include_annotations=include_annotations)
-            for series_dir in ds_dir.iterdir()
-            if series_dir.is_dir() and not series_dir.name.startswith('.')}  # Ignore hidden folders.
-    else:
-        series = {series_name: read_series(
-                ds_dir / series_name, include_annotations=include_annotations)
-            for series_name in series_names}
+        if manifest is not None:
+            series_names = list(manifest.series.keys())
+        else:
+            series_names = _list_series(ds_dir)
+
+    series = {series_name: read_series(
+            ds_dir / series_name,
+            include_annotations=include_annotations,
+            max_workers=max_workers,
+            subject_entries=manifest.series[series_name] if manifest is not None else None,
+            lazy=lazy,
+            subject_cache_size=subject_cache_size,
+            zarr_mode=zarr_mode,
+            zarr_chunk_cache_size=zarr_chunk_cache_size,
+            parquet_mode=parquet_mode,
+            columnar_annotations=columnar_annotations,
+            array_names=array_names,
+            annotation_names=annotation_names,
+            subject_filter=subject_filter,
+            validate=validate)
+        for series_name in series_names}
     
     return Dataset(
         series=series,
         **ds_meta
     )
+
+
+def _validate_subject(
+        subject_dir: Path,
+        check: Callable[[Path, Callable], dict[str, str]],
+        entry: SubjectEntry | None = None,
+        container: SeriesContainer | None = None) -> dict[str, str]:
+    """Validate the files of a subject, or only the annotations if the catalog entry is given."""
+    errors = {}
+    if entry is not None:
+        n_arrays = len(entry.sample_arrays)
+        annotation_paths = [subject_dir / ann_entry.path for ann_entry in entry.annotations.values()]
+    else:
+        errors.update(check(subject_dir / 'metadata.json', lambda: read_subject_metadata(subject_dir)))
+        n_arrays = 0
+        annotation_paths = []
+        for p in sorted(subject_dir.iterdir()):
+            if p.is_dir() and not p.name.startswith('.'):
+                n_arrays += 1
+                if (p / PACKED_CHANNELS_FILENAME).exists():
+                    errors.update(check(p / PACKED_CHANNELS_FILENAME, lambda: scan_packed_arrays(p)))
+                else:
+                    errors.update(check(p / 'attributes.json', lambda: scan_sample_array(p)))
+            elif p.name.endswith(JSON_ANNOTATION_SUFFIX) or p.name.endswith(PARQUET_ANNOTATION_SUFFIX):
+                annotation_paths.append(p)
+
+    # A subject without arrays is e.g. left by a failed write
+    def _require_arrays() -> None:
+        assert n_arrays > 0, 'the subject has no sample arrays'
+    errors.update(check(subject_dir, _require_arrays))
+
+    for p in annotation_paths:
+        errors.update(check(p, lambda: read_annotation(
+            p, container=container, validate='full', check_names=True)))
+
+    return errors
+
+
+def validate_dataset(
+        ds_dir: Path,
+        max_workers: int | None = None) -> dict[str, str]:
+    """Validate all metadata, array attribute and annotation files of a dataset with all checks.
+
+    Use this as a separate batch job for datasets read with `validate='light'`
+    or `validate='none'`. Unlike when reading, the errors are collected instead
+    of raised. For series containers, the index and the annotation files are validated.
+    Subjects without sample arrays are also reported, since they are e.g. left
+    by an interrupted write, and so are the annotation names which are not members
+    of the enum of their annotation type, which reading does not check.
+
+    Arguments:
+        ds_dir: The dataset root folder.
+        max_workers: If given, validate the subjects concurrently using a thread pool of this size.
+
+    Returns:
+        The error messages by the file path relative to `ds_dir`. Empty if the dataset is valid.
+    """
+    def _check(path: Path, func: Callable) -> dict[str, str]:
+        try:
+            func()
+        except Exception as e:
+            return {path.relative_to(ds_dir).as_posix(): f'{type(e).__name__}: {e}'}
+        return {}
+
+    def _check_dataset_metadata() -> None:
+        with open(ds_dir / 'metadata.json', 'rb') as f:
+            ds = Dataset.model_validate_json(f.read().decode('utf-8'))
+        assert ds.name == ds_dir.name, f'dataset name {ds.name} does not match the folder name'
+
+    errors = _check(ds_dir / 'metadata.json', _check_dataset_metadata)
+    if (ds_dir / MANIFEST_FILENAME).exists():
+        errors.update(_check(ds_dir / MANIFEST_FILENAME, lambda: read_manifest(ds_dir)))
+
+    for series_name in _list_series(ds_dir):
+        series_dir = ds_dir / series_name
+        container = open_container(series_dir)
+        if container is None:
+            subject_errors = _map(
+                lambda sid: _validate_subject(series_dir / sid, _check),
+                _list_subjects(series_dir),
+                max_workers=max_workers)
+        else:
+            with container:
+                index_errors = _check(container.path, lambda: container.subject_entries)
+                errors.update(index_errors)
+                if len(index_errors) > 0:
+                    continue
+
+                subject_errors = _map(
+                    lambda item: _validate_subject(
+                        series_dir / item[0], _check, entry=item[1], container=container),
+                    container.subject_entries.items(),
+                    max_workers=max_workers)
+
+        for e in subject_errors:
+            errors.update(e)
+
+    return errors
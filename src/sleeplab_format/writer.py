@@ -3,20 +3,37 @@
 The data needs to conform to the types specified in
 `sleeplab_format.models`.
 """
+import functools
+import hashlib
+import io
+import itertools
 import json
 import logging
-import numcodecs
 import numpy as np
-import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
+import shutil
+import struct
+import traceback
 import zarr
 
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from sleeplab_format import compression
+from sleeplab_format.container import container_path, open_container, pack_series, unpack_series
 from sleeplab_format.models import *
 from sleeplab_format.reader import (
+    ARRAY_FILENAMES,
+    EPOCH_ARRAY_SUFFIX,
     JSON_ANNOTATION_SUFFIX,
+    MANIFEST_FILENAME,
+    PACKED_CHANNELS_FILENAME,
+    PACKED_DIR_PREFIX,
     PARQUET_ANNOTATION_SUFFIX,
-    PARQUET_ANNOTATION_META_SUFFIX
+    PARQUET_ANNOTATION_META_SUFFIX,
+    scan_dataset,
+    scan_series,
+    scan_subject
 )
 from pathlib import Path
 
@@ -25,6 +42,10 @@ logger = logging.getLogger(__name__)
 
 
 JSON_INDENT = 2
+WRITE_REPORT_FILENAME = '.write_report.json'
+COMPLETE_MARKER_FILENAME = '.slf_complete.json'
+
+LAYOUTS = ['directory', 'container']
 
 
 def write_subject_metadata(
@@ -43,13 +64,329 @@ def write_subject_metadata(
     )
 
 
+def _sampling_rate(attributes: ArrayAttributes) -> float:
+    if attributes.sampling_rate is not None:
+        return attributes.sampling_rate
+    return 1.0 / attributes.sampling_interval
+
+
+def _peek(chunks: Iterable[np.ndarray]) -> tuple[np.ndarray, Iterator[np.ndarray]]:
+    """Get the first chunk and an iterator over all chunks."""
+    it = iter(chunks)
+    first = next(it, None)
+    assert first is not None, 'chunks_func did not return any chunks'
+    first = np.asarray(first)
+    return first, itertools.chain([first], it)
+
+
+def _rechunk(chunks: Iterable[np.ndarray], size: int) -> Iterator[np.ndarray]:
+    """Split and merge chunks into chunks of `size` samples, except the last one."""
+    assert size > 0, f'chunk size needs to be positive, got {size}'
+    buffer = []
+    n = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        while len(chunk) > 0:
+            take = min(size - n, len(chunk))
+            buffer.append(chunk[:take])
+            chunk = chunk[take:]
+            n += take
+            if n == size:
+                yield buffer[0] if len(buffer) == 1 else np.concatenate(buffer)
+                buffer = []
+                n = 0
+
+    if n > 0:
+        yield buffer[0] if len(buffer) == 1 else np.concatenate(buffer)
+
+
+def _npy_header(dtype: np.dtype, shape: tuple[int, ...], version: tuple[int, int]) -> bytes:
+    """Create a .npy header with `np.lib.format`."""
+    header = {
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': shape
+    }
+    buffer = io.BytesIO()
+    if version == (1, 0):
+        np.lib.format.write_array_header_1_0(buffer, header)
+    else:
+        np.lib.format.write_array_header_2_0(buffer, header)
+    return buffer.getvalue()
+
+
+def _padded_npy_header(
+        dtype: np.dtype,
+        shape: tuple[int, ...],
+        version: tuple[int, int],
+        size: int) -> bytes:
+    """Create a .npy header padded to `size` bytes.
+
+    The header text is padded with spaces before its terminating newline,
+    similarly to the alignment padding of `np.lib.format`.
+    """
+    header = _npy_header(dtype, shape, version)
+    if len(header) > size:
+        raise ValueError(f'the .npy header of shape {shape} does not fit in {size} bytes')
+
+    # The magic string with the version is followed by the length of the header text
+    magic_len = len(np.lib.format.magic(*version))
+    len_format = '<H' if version == (1, 0) else '<I'
+    text = header[magic_len + struct.calcsize(len_format):-1] + b' ' * (size - len(header)) + b'\n'
+    return header[:magic_len] + struct.pack(len_format, len(text)) + text
+
+
+def _write_npy_chunks(path: Path, chunks: Iterable[np.ndarray]) -> None:
+    """Write chunks to a .npy file, and write the header when the shape is known.
+
+    The space for the header is reserved for the largest possible length of the
+    first axis, so that the final header fits in front of the data.
+    """
+    first, chunks = _peek(chunks)
+    dtype = first.dtype
+    trailing_shape = first.shape[1:]
+    max_shape = (np.iinfo(np.int64).max, *trailing_shape)
+    try:
+        version = (1, 0)
+        header_size = len(_npy_header(dtype, max_shape, version))
+    except ValueError:
+        # The header of e.g. a structured dtype with many fields is too long for version 1.0
+        version = (2, 0)
+        header_size = len(_npy_header(dtype, max_shape, version))
+
+    n = 0
+    with open(path, 'wb') as f:
+        f.seek(header_size)
+        for chunk in chunks:
+            chunk = np.ascontiguousarray(chunk, dtype=dtype)
+            if chunk.shape[1:] != trailing_shape:
+                raise ValueError(
+                    f'the chunks need to have equal trailing dimensions, got {chunk.shape[1:]} '
+                    f'and {trailing_shape}')
+            f.write(chunk.data)
+            n += len(chunk)
+
+        f.seek(0)
+        f.write(_padded_npy_header(dtype, (n, *trailing_shape), version, header_size))
+
+
+def _write_zarr_chunks(
+        path: Path,
+        chunks: Iterable[np.ndarray],
+        chunksize: int | None,
+        codec_config: compression.CodecConfig | None,
+        compression_level: int,
+        chunk_len: int | None = None) -> None:
+    """Append chunks to a zarr array aligned to the zarr chunks.
+
+    The zarr chunk length is `chunk_len` samples if given, otherwise computed
+    from `chunksize` in bytes.
+    """
+    first, chunks = _peek(chunks)
+    dtype = first.dtype
+
+    # Automatic codec selection uses the first chunk as the sample
+    filters, compressor = compression.codecs_for_array(
+        first, codec_config, compression_level=compression_level)
+
+    if chunk_len is None and chunksize is not None:
+        # Chunk size from bytes to samples
+        chunk_len = int(chunksize // dtype.itemsize)
+    if chunk_len is not None:
+        chunks = _rechunk(chunks, chunk_len)
+
+    z = None
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=dtype)
+        if z is None:
+            z = zarr.open_array(
+                str(path), mode='w', shape=(0, *chunk.shape[1:]),
+                chunks=(chunk_len or len(chunk), *chunk.shape[1:]),
+                dtype=dtype, filters=filters, compressor=compressor)
+        z.append(chunk)
+
+
+def _write_parquet_chunks(
+        path: Path,
+        chunks: Iterable[np.ndarray],
+        row_group_size: int | None) -> None:
+    """Write chunks to a parquet file one row group at a time."""
+    first, chunks = _peek(chunks)
+    dtype = first.dtype
+    if row_group_size is not None:
+        chunks = _rechunk(chunks, row_group_size)
+
+    pq_writer = None
+    try:
+        for chunk in chunks:
+            # Utilize Arrow to write the data to Parquet file
+            arrow_table = pa.Table.from_arrays([np.asarray(chunk, dtype=dtype)], names=['data'])
+            if pq_writer is None:
+                # Parquet uses Snappy as compression algorithm by default
+                pq_writer = pq.ParquetWriter(path, arrow_table.schema)
+            pq_writer.write_table(arrow_table, row_group_size=row_group_size)
+    finally:
+        if pq_writer is not None:
+            pq_writer.close()
+
+
+def _require_integers(values_func: Callable[[], np.ndarray]) -> np.ndarray:
+    arr = np.asarray(values_func())
+    assert np.issubdtype(arr.dtype, np.integer), 'arrays with attributes.scale need to have integer values'
+    return arr
+
+
+def _quantize_error(name: str, sarr: SampleArray, quantize: dict[str, float | str] | None) -> float | str | None:
+    """Find the maximum quantization error of an array by name.
+
+    Arrays with a `value_map` hold categorical labels, so they are only matched
+    by an exact name, where quantizing them is an error.
+    """
+    max_error = compression.resolve_name_config(name, quantize)
+    if max_error is None or sarr.attributes.value_map is None:
+        return max_error
+
+    assert name not in quantize, f'cannot quantize the array {name} with a value_map'
+    return None
+
+
+def _quantized_array(
+        sarr: SampleArray,
+        max_error: float | str | None,
+        quantize_integers: bool = True) -> SampleArray:
+    """Get the array with the stored integers as values if the array is or will be quantized.
+
+    If not `quantize_integers`, arrays with integer values are stored as is.
+    """
+    if sarr.attributes.scale is not None:
+        # Already quantized, e.g. the digital values of an EDF or an array read from a quantized dataset
+        if sarr.raw_values_func is not None:
+            return sarr.model_copy(update={'values_func': sarr.raw_values_func, 'chunks_func': None})
+        if sarr.chunks_func is not None:
+            return sarr
+        return sarr.model_copy(update={
+            'values_func': functools.partial(_require_integers, sarr.values_func)})
+
+    if max_error is None:
+        return sarr
+
+    values = np.asarray(sarr.values_func())
+    if not quantize_integers and np.issubdtype(values.dtype, np.integer):
+        return sarr
+
+    stored, scale, offset = quantize_values(values, max_error=max_error)
+    return SampleArray(
+        attributes=sarr.attributes.model_copy(update={'scale': scale, 'offset': offset}),
+        values_func=lambda: stored)
+
+
+def _physical_values(stored: np.ndarray, attributes: ArrayAttributes) -> np.ndarray:
+    """Convert stored values to physical values in float64 for the statistics."""
+    if attributes.scale is None:
+        return stored
+    return np.asarray(stored, dtype=np.float64) * attributes.scale + (attributes.offset or 0.0)
+
+
+def _accumulate(
+        chunks: Iterable[np.ndarray],
+        accumulator: StatisticsAccumulator,
+        attributes: ArrayAttributes) -> Iterator[np.ndarray]:
+    """Pass the chunks through while adding them to the statistics."""
+    for chunk in chunks:
+        accumulator.update(_physical_values(chunk, attributes))
+        yield chunk
+
+
+def _packed_groups(sample_arrays: dict[str, SampleArray]) -> list[list[tuple[str, np.ndarray]]]:
+    """Group the arrays which share the sampling rate, start time, dtype and length."""
+    groups = {}
+    for name, sarr in sample_arrays.items():
+        attrs = sarr.attributes
+        key = (attrs.sampling_rate, attrs.sampling_interval, attrs.start_ts)
+        groups.setdefault(key, []).append(name)
+
+    packed_groups = []
+    for names in groups.values():
+        if len(names) < 2:
+            continue
+
+        arrs = {}
+        for name in names:
+            arr = np.asarray(sample_arrays[name].values_func())
+            if arr.ndim == 1:
+                arrs.setdefault((arr.dtype.str, arr.shape), []).append((name, arr))
+        packed_groups.extend(g for g in arrs.values() if len(g) > 1)
+
+    return packed_groups
+
+
+def _write_packed_group(
+        group_path: Path,
+        group: list[tuple[str, np.ndarray]],
+        sample_arrays: dict[str, SampleArray],
+        format: str,
+        zarr_chunksize: int | None,
+        zarr_compression_level: int,
+        zarr_codecs: dict[str, compression.CodecConfig] | None,
+        zarr_chunk_len: int | None,
+        statistics: bool = False) -> None:
+    """Write a group of equal length arrays as a 2D (channels x samples) array."""
+    group_path.mkdir(exist_ok=True)
+    channels = []
+    for name, arr in group:
+        attributes = sample_arrays[name].attributes
+        if statistics:
+            attributes = attributes.model_copy(update={
+                'statistics': compute_statistics(_physical_values(arr, attributes))})
+        channels.append(attributes)
+    channels = PackedChannels(channels=channels)
+    (group_path / PACKED_CHANNELS_FILENAME).write_text(
+        channels.model_dump_json(indent=JSON_INDENT, exclude_none=True), encoding='utf-8')
+
+    first_name, first = group[0]
+    if format == 'numpy':
+        # Store in Fortran order so that a window of all channels is contiguous on disk
+        packed = np.empty((len(group), len(first)), dtype=first.dtype, order='F')
+    else:
+        packed = np.empty((len(group), len(first)), dtype=first.dtype)
+    for i, (_, arr) in enumerate(group):
+        packed[i] = arr
+
+    if format == 'numpy':
+        np.save(group_path / ARRAY_FILENAMES['numpy'], packed, allow_pickle=False)
+    else:
+        codec_config = compression.resolve_name_config(first_name, zarr_codecs)
+        filters, compressor = compression.codecs_for_array(
+            first, codec_config, compression_level=zarr_compression_level)
+        if zarr_chunk_len is not None:
+            chunk_len = zarr_chunk_len
+        elif zarr_chunksize is not None:
+            chunk_len = int(zarr_chunksize // (packed.dtype.itemsize * len(group)))
+        else:
+            chunk_len = len(first)
+        z = zarr.open_array(
+            str(group_path / ARRAY_FILENAMES['zarr']), mode='w', shape=packed.shape,
+            chunks=(len(group), chunk_len), dtype=packed.dtype,
+            filters=filters, compressor=compressor)
+        z[:] = packed
+
+
 def write_sample_arrays(
         subject: Subject,
         subject_path: Path,
         format: str = 'numpy',
-        zarr_chunksize: int | None = 5e6,
-        zarr_compression_level: int = 9) -> None:
+        zarr_chunksize: int | None = 5_000_000,
+        zarr_compression_level: int = 9,
+        parquet_row_group_sec: float | None = None,
+        zarr_codecs: dict[str, compression.CodecConfig] | None = None,
+        packed: bool = False,
+        zarr_chunk_sec: float | None = None,
+        quantize: dict[str, float | str] | None = None,
+        statistics: bool = False) -> None:
     """Write all sample arrays of the subject.
+
+    If a sample array defines `chunks_func`, the chunks are streamed to disk
+    so that the whole array is never held in memory.
     
     Arguments:
         subject: The sleeplab.models.Subject instance.
@@ -57,67 +394,148 @@ def write_sample_arrays(
         format: The save format for the numerical arrays; `numpy`, `parquet` or `zarr`.
         zarr_chunksize: The chunk size in bytes if `format='zarr'`.
         zarr_compression_level: The compression level used with the Zstandard compression.
+        parquet_row_group_sec: If given with `format='parquet'`, the duration
+            of each row group in seconds so that time windows map to row groups.
+        zarr_codecs: If given with `format='zarr'`, the codec configs by array name
+            or glob pattern. See `sleeplab_format.compression`. Arrays without
+            a config are compressed with Zstandard.
+        packed: If True with `format='numpy'` or `format='zarr'`, the 1D arrays
+            with the same sampling rate, start time, dtype and length are
+            stored together as a 2D (channels x samples) array in a `_packed_<i>`
+            folder. The channel attributes are listed in `channels.json` in row order.
+            The arrays of a group are held in memory while writing.
+        zarr_chunk_sec: If given with `format='zarr'`, the duration of the zarr chunks
+            in seconds instead of `zarr_chunksize`. Use a multiple of the scoring epoch
+            so that the chunk boundaries align with the epochs in all arrays.
+        quantize: If given, store the arrays matching these names or glob patterns as
+            int16 or int32 with `scale` and `offset` in the attributes. The values are
+            the maximum absolute errors, or `auto` to use the full int16 range.
+            See `sleeplab_format.models.quantize_values`. Arrays which already have
+            `attributes.scale` are stored as is, and their values need to be integers.
+            Arrays with integer values or a `value_map` are not matched by glob
+            patterns, and arrays with a `value_map` cannot be quantized.
+        statistics: If True, compute `sleeplab_format.models.ArrayStatistics` of the
+            physical values while writing each array, and store them in `attributes.statistics`.
+            The statistics are computed from the streamed chunks without reading
+            the array again.
     """
-    for name, sarr in subject.sample_arrays.items():
+    def _chunk_len(attributes: ArrayAttributes) -> int | None:
+        if zarr_chunk_sec is None:
+            return None
+        # Low sampling rates may round to zero samples per chunk
+        return max(round(zarr_chunk_sec * _sampling_rate(attributes)), 1)
+
+    sample_arrays = subject.sample_arrays
+    packed_names = set()
+    if packed:
+        assert format in ['numpy', 'zarr'], 'packed arrays are only supported with numpy and zarr'
+        sample_arrays = {
+            name: _quantized_array(sarr, _quantize_error(name, sarr, quantize),
+                                   quantize_integers=name in (quantize or {}))
+            for name, sarr in sample_arrays.items()}
+        for i, group in enumerate(_packed_groups(sample_arrays)):
+            _write_packed_group(
+                subject_path / f'{PACKED_DIR_PREFIX}{i}',
+                group,
+                sample_arrays,
+                format,
+                zarr_chunksize,
+                zarr_compression_level,
+                zarr_codecs,
+                _chunk_len(sample_arrays[group[0][0]].attributes),
+                statistics=statistics)
+            packed_names.update(name for name, _ in group)
+
+    for name, sarr in sample_arrays.items():
         assert name == sarr.attributes.name
+        if name in packed_names:
+            continue
+        if not packed:
+            # Quantize one array at a time to avoid holding all arrays in memory
+            sarr = _quantized_array(sarr, _quantize_error(name, sarr, quantize),
+                                    quantize_integers=name in (quantize or {}))
+
         sarr_path = subject_path / f'{sarr.attributes.name}'
         sarr_path.mkdir(exist_ok=True)
-        
-        # Write the attributes
-        attr_path = sarr_path / 'attributes.json'
-        attr_path.write_text(
-            sarr.attributes.model_dump_json(indent=JSON_INDENT, exclude_none=True), encoding='utf-8')
 
-        arr = sarr.values_func()
+        if sarr.chunks_func is not None:
+            chunks = sarr.chunks_func()
+        else:
+            # Lazily read arrays such as zarr.Array are converted to numpy
+            chunks = [np.asarray(sarr.values_func())]
+
+        if statistics:
+            accumulator = StatisticsAccumulator()
+            chunks = _accumulate(chunks, accumulator, sarr.attributes)
+
         if format == 'numpy':
             # Write the array
-            arr_fname = 'data.npy'
-            np.save(sarr_path / arr_fname, arr, allow_pickle=False)
+            arr_fname = ARRAY_FILENAMES['numpy']
+            if sarr.chunks_func is not None:
+                _write_npy_chunks(sarr_path / arr_fname, chunks)
+            else:
+                np.save(sarr_path / arr_fname, next(iter(chunks)), allow_pickle=False)
         elif format == 'zarr':
-            arr_fname = 'data.zarr'
-            #shuffler = numcodecs.Shuffle(elementsize=4)
-            #delta = numcodecs.Delta(dtype='i2')
-            #compressor = numcodecs.Blosc(cname='zstd', clevel=5, shuffle=numcodecs.Blosc.NOSHUFFLE)
-            #compressor = numcodecs.Blosc(cname='zstd', clevel=9, shuffle=numcodecs.Blosc.NOSHUFFLE)
-            #compressor = numcodecs.Blosc(cname='lz4', clevel=5, shuffle=numcodecs.Blosc.NOSHUFFLE)
-            #compressor = numcodecs.ZFPY(mode=4, tolerance=1e-3)
-            #zarr.save_array(sarr_path / arr_fname, arr, filters=[shuffler, delta], compressor=compressor)
-            if zarr_chunksize is not None:
-                # Chunk size from bytes to samples
-                chunks = (zarr_chunksize // arr.dtype.itemsize,)
-                z = zarr.array(arr, chunks=chunks)
-
-            #compressor = numcodecs.Blosc(cname='zstd', clevel=zarr_compression_level, shuffle=numcodecs.Blosc.NOSHUFFLE)
-            compressor = numcodecs.Zstd(level=zarr_compression_level)
-            zarr.save_array(sarr_path / arr_fname, z, compressor=compressor)
+            arr_fname = ARRAY_FILENAMES['zarr']
+            codec_config = compression.resolve_name_config(name, zarr_codecs)
+            _write_zarr_chunks(
+                sarr_path / arr_fname, chunks, zarr_chunksize, codec_config, zarr_compression_level,
+                chunk_len=_chunk_len(sarr.attributes))
         elif format == 'parquet':
-            arr_fname = 'data.parquet'
+            arr_fname = ARRAY_FILENAMES['parquet']
 
-            # Utilize Arrow to write the data to Parquet file
-            arrow_table = pa.Table.from_arrays([arr], names=['data'])
+            if parquet_row_group_sec is not None:
+                row_group_size = max(round(parquet_row_group_sec * _sampling_rate(sarr.attributes)), 1)
+            else:
+                row_group_size = None
 
-            # Parquet uses Snappy as compression algorithm by default
-            pq.write_table(arrow_table, sarr_path / arr_fname)
+            _write_parquet_chunks(sarr_path / arr_fname, chunks, row_group_size)
         else:
             raise AttributeError(f'Unsupported sample array format: {format}')
 
+        # Write the attributes after the data so that the statistics are complete
+        attributes = sarr.attributes
+        if statistics:
+            attributes = attributes.model_copy(update={'statistics': accumulator.result()})
+        attr_path = sarr_path / 'attributes.json'
+        attr_path.write_text(
+            attributes.model_dump_json(indent=JSON_INDENT, exclude_none=True), encoding='utf-8')
+
 
 def write_annotations(
         subject: Subject,
         subject_path: Path,
-        format: str = 'json') -> None:
+        format: str = 'json',
+        hypnogram_epoch_sec: float | None = None) -> None:
     """Write SLF annotations to disk.
     
     Arguments:
         subject: A sleeplab_format.models.Subject whose annotations will be written.
         subject_path: The path to the subject folder.
         format: The format of annotation files.
+        hypnogram_epoch_sec: If given, also write the epoch labels of the hypnograms
+            with this epoch duration to `<key>.epochs.npy`. The labels are the indices
+            of the stages in the stage enum, e.g. `AASMSleepStage`, and 255 for gaps.
+            See `sleeplab_format.models.EpochAnnotations.to_epoch_array` and
+            `sleeplab_format.reader.read_epoch_array`.
     """
     for k, v in subject.annotations.items():
         _msg = f'Annotation key should equal to "{v.scorer}_{v.type}", got "{k}"'
         assert k == f'{v.scorer}_{v.type}', _msg
+
+        if hypnogram_epoch_sec is not None and v.type in ['hypnogram', 'rkhypnogram']:
+            # The reader returns BaseAnnotations, which are converted to use the stage enum
+            epoch_annotations = v
+            if not isinstance(v, (EpochAnnotations, ColumnarAnnotations)):
+                epoch_annotations = ColumnarAnnotations.from_annotations(v)
+            np.save(subject_path / f'{k}{EPOCH_ARRAY_SUFFIX}',
+                    epoch_annotations.to_epoch_array(epoch_sec=hypnogram_epoch_sec),
+                    allow_pickle=False)
         
         if format == 'json':
+            if isinstance(v, ColumnarAnnotations):
+                v = v.to_annotations()
+
             json_path = subject_path / f'{k}{JSON_ANNOTATION_SUFFIX}'
             json_path.write_text(
                 v.model_dump_json(exclude_none=True, indent=JSON_INDENT),
@@ -127,14 +545,15 @@ def write_annotations(
             # Write the actual annotations in parquet, metadata in json
             metadata_path = subject_path / f'{k}{PARQUET_ANNOTATION_META_SUFFIX}'
             pq_path = subject_path / f'{k}{PARQUET_ANNOTATION_SUFFIX}'
-            
-            ann_dict = v.model_dump()
-            ann_list = ann_dict.pop('annotations')
+
+            if not isinstance(v, ColumnarAnnotations):
+                v = ColumnarAnnotations.from_annotations(v)
             
             with open(metadata_path, 'w') as f:
-                json.dump(ann_dict, f)
+                json.dump({'scorer': v.scorer, 'type': v.type}, f)
             
-            pd.DataFrame(ann_list).to_parquet(pq_path)
+            # The table has a fixed schema with dictionary encoded names
+            pq.write_table(v.table, pq_path)
 
 
 def write_subject(
@@ -142,7 +561,14 @@ def write_subject(
         subject_path: Path,
         annotation_format: str = 'json',
         array_format: str = 'numpy',
-        compression_level: int = 9) -> None:
+        compression_level: int = 9,
+        parquet_row_group_sec: float | None = None,
+        zarr_codecs: dict[str, compression.CodecConfig] | None = None,
+        packed: bool = False,
+        zarr_chunk_sec: float | None = None,
+        quantize: dict[str, float | str] | None = None,
+        statistics: bool = False,
+        hypnogram_epoch_sec: float | None = None) -> None:
     """Write a single Subject to disk.
     
     Arguments:
@@ -151,16 +577,176 @@ def write_subject(
         annotation_format: The format of annotation files.
         array_format: The format of the sample array data files.
         compression_level: The zstd compression level if `array_format` is `zarr`.
+        parquet_row_group_sec: The row group duration in seconds if `array_format` is `parquet`.
+        zarr_codecs: The codec configs by array name if `array_format` is `zarr`.
+        packed: Whether to store the arrays sharing a sampling rate together.
+        zarr_chunk_sec: The zarr chunk duration in seconds if `array_format` is `zarr`.
+        quantize: The maximum quantization errors by array name, see `write_sample_arrays`.
+        statistics: Whether to compute the array statistics while writing, see `write_sample_arrays`.
+        hypnogram_epoch_sec: The epoch duration of the hypnogram epoch labels, see `write_annotations`.
     """
     subject_path.mkdir(exist_ok=True)
     write_subject_metadata(subject, subject_path)
     
     if subject.sample_arrays is not None:
         write_sample_arrays(subject, subject_path, format=array_format,
-                            zarr_compression_level=compression_level)
+                            zarr_compression_level=compression_level,
+                            parquet_row_group_sec=parquet_row_group_sec,
+                            zarr_codecs=zarr_codecs,
+                            packed=packed,
+                            zarr_chunk_sec=zarr_chunk_sec,
+                            quantize=quantize,
+                            statistics=statistics)
 
     if subject.annotations is not None:
-        write_annotations(subject, subject_path, format=annotation_format)
+        write_annotations(subject, subject_path, format=annotation_format,
+                          hypnogram_epoch_sec=hypnogram_epoch_sec)
+
+
+def _write_sample_arrays_task(
+        subject: Subject,
+        subject_path: Path,
+        kwargs: dict) -> str | None:
+    """Write the sample arrays in a worker process and return the traceback if it fails."""
+    try:
+        write_sample_arrays(subject, subject_path, **kwargs)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+def _future_error(future: Future) -> str | None:
+    exc = future.exception()
+    if exc is not None:
+        # The subject could not be sent to the worker, e.g. a values_func which cannot be pickled
+        return ''.join(traceback.format_exception(exc))
+    return future.result()
+
+
+def _subject_fingerprint(subject: Subject, options: dict) -> str:
+    """Hash the metadata, array attributes, annotations and write options of a subject."""
+    h = hashlib.sha256()
+    h.update(json.dumps({'version': SLEEPLAB_FORMAT_VERSION, **options}, sort_keys=True).encode())
+    h.update(subject.metadata.model_dump_json(exclude_none=True).encode())
+
+    if subject.sample_arrays is not None:
+        for name in sorted(subject.sample_arrays):
+            attributes = subject.sample_arrays[name].attributes
+            h.update(attributes.model_dump_json(exclude_none=True).encode())
+
+    if subject.annotations is not None:
+        for name in sorted(subject.annotations):
+            annotations = subject.annotations[name]
+            if isinstance(annotations, ColumnarAnnotations):
+                annotations = annotations.to_annotations()
+            h.update(annotations.model_dump_json(exclude_none=True).encode())
+
+    return h.hexdigest()
+
+
+def _array_details(subject_path: Path) -> dict[str, dict]:
+    entry = scan_subject(subject_path, include_details=True)
+    return {name: {'shape': e.shape, 'dtype': e.dtype}
+            for name, e in sorted(entry.sample_arrays.items())}
+
+
+def _is_complete(subject_path: Path, fingerprint: str) -> bool:
+    """Check if a subject has been completely written with the same fingerprint."""
+    marker_path = subject_path / COMPLETE_MARKER_FILENAME
+    if not marker_path.exists():
+        return False
+
+    marker = json.loads(marker_path.read_text(encoding='utf-8'))
+    if marker['fingerprint'] != fingerprint:
+        return False
+
+    # Check that the array files have not been removed or modified afterwards
+    try:
+        return _array_details(subject_path) == marker['sample_arrays']
+    except Exception:
+        return False
+
+
+def _finalize_subject(tmp_path: Path, subject_path: Path, fingerprint: str | None) -> None:
+    """Write the completion marker if resuming, and move a written subject to its final path."""
+    if fingerprint is not None:
+        marker = {
+            'fingerprint': fingerprint,
+            'sample_arrays': _array_details(tmp_path)
+        }
+        (tmp_path / COMPLETE_MARKER_FILENAME).write_text(
+            json.dumps(marker, indent=JSON_INDENT), encoding='utf-8')
+
+    if subject_path.exists():
+        shutil.rmtree(subject_path)
+    tmp_path.rename(subject_path)
+
+
+def _write_options(
+        annotation_format: str = 'json',
+        array_format: str = 'numpy',
+        compression_level: int = 9,
+        parquet_row_group_sec: float | None = None,
+        zarr_codecs: dict[str, compression.CodecConfig] | None = None,
+        packed: bool = False,
+        zarr_chunk_sec: float | None = None,
+        quantize: dict[str, float | str] | None = None,
+        statistics: bool = False,
+        hypnogram_epoch_sec: float | None = None) -> dict:
+    """Collect the options of `write_subject`, which are also part of the subject fingerprints."""
+    return dict(
+        annotation_format=annotation_format,
+        array_format=array_format,
+        compression_level=compression_level,
+        parquet_row_group_sec=parquet_row_group_sec,
+        zarr_codecs=zarr_codecs,
+        packed=packed,
+        zarr_chunk_sec=zarr_chunk_sec,
+        quantize=quantize,
+        statistics=statistics,
+        hypnogram_epoch_sec=hypnogram_epoch_sec)
+
+
+def _is_container_complete(series: Series, series_path: Path, options: dict) -> bool:
+    """Check if the container of a series has all subjects completely written with the same fingerprints."""
+    container = open_container(series_path)
+    if container is None:
+        return False
+
+    with container:
+        entries = container.subject_entries
+        if set(entries.keys()) != {s.metadata.subject_id for s in series.subjects.values()}:
+            return False
+
+        for subject in series.subjects.values():
+            sid = subject.metadata.subject_id
+            try:
+                marker = json.loads(container.read_bytes(series_path / sid / COMPLETE_MARKER_FILENAME))
+            except KeyError:
+                return False
+
+            details = {name: {'shape': e.shape, 'dtype': e.dtype}
+                       for name, e in sorted(entries[sid].sample_arrays.items())}
+            if marker['fingerprint'] != _subject_fingerprint(subject, options) or marker['sample_arrays'] != details:
+                return False
+
+    return True
+
+
+def _remove_failed_subject(write_path: Path) -> None:
+    """Remove the temporary folder of a partially written subject."""
+    if write_path.exists():
+        logger.info(f'Removing partially written subject {write_path}...')
+        shutil.rmtree(write_path, ignore_errors=True)
+
+
+def _worker_sample_arrays(sample_arrays: dict[str, SampleArray]) -> dict[str, SampleArray]:
+    """Remove the functions the writer does not use before sending the arrays to a worker.
+
+    The `window_func` of arrays from the reader cannot be pickled.
+    """
+    return {name: sarr.model_copy(update={'window_func': None})
+            for name, sarr in sample_arrays.items()}
 
 
 def write_series(
@@ -168,7 +754,16 @@ def write_series(
         series_path: Path,
         annotation_format: str = 'json',
         array_format: str = 'numpy',
-        compression_level: int = 9) -> None:
+        compression_level: int = 9,
+        parquet_row_group_sec: float | None = None,
+        num_workers: int | None = None,
+        resume: bool = False,
+        zarr_codecs: dict[str, compression.CodecConfig] | None = None,
+        packed: bool = False,
+        zarr_chunk_sec: float | None = None,
+        quantize: dict[str, float | str] | None = None,
+        statistics: bool = False,
+        hypnogram_epoch_sec: float | None = None) -> dict[str, str]:
     """Write a sleeplab_format.models.Series to disk.
     
     Arguments:
@@ -177,16 +772,213 @@ def write_series(
         annotation_format: The format of the annotation files.
         array_format: The format of the sample array data files.
         compression_level: The zstd compression level if `array_format` is `zarr`.
+        parquet_row_group_sec: The row group duration in seconds if `array_format` is `parquet`.
+        num_workers: If given, write the sample arrays in parallel using a process
+            pool of this size. The `values_func` of the sample arrays need to be
+            picklable, e.g. `functools.partial` of a module-level loader function
+            or the functions of the reader. Errors are collected per subject
+            instead of aborting the write. Each subject is written to a temporary
+            folder which replaces the subject folder on success, so a failed
+            subject keeps its previously written data.
+        resume: If True, skip the subjects which have already been completely
+            written with the same metadata, array attributes, annotations and
+            options. Each subject is written to a hidden temporary folder which
+            is renamed when complete, and temporary folders left by interrupted
+            writes are removed.
+        zarr_codecs: The codec configs by array name if `array_format` is `zarr`.
+        packed: Whether to store the arrays sharing a sampling rate together.
+        zarr_chunk_sec: The zarr chunk duration in seconds if `array_format` is `zarr`.
+        quantize: The maximum quantization errors by array name, see `write_sample_arrays`.
+        statistics: Whether to compute the array statistics while writing, see `write_sample_arrays`.
+        hypnogram_epoch_sec: The epoch duration of the hypnogram epoch labels, see `write_annotations`.
+
+    Returns:
+        The tracebacks of the subjects which failed to be written by subject ID.
+        Always empty if `num_workers` is None, since errors are then raised.
     """
-    for sid, subject in series.subjects.items():
-        logger.info(f'Writing subject ID {sid}...')
-        subject_path = series_path / subject.metadata.subject_id
-        write_subject(
-            subject,
-            subject_path,
-            annotation_format=annotation_format,
-            array_format=array_format,
-            compression_level=compression_level)
+    errors, _ = _write_series(
+        series,
+        series_path,
+        annotation_format=annotation_format,
+        array_format=array_format,
+        compression_level=compression_level,
+        parquet_row_group_sec=parquet_row_group_sec,
+        num_workers=num_workers,
+        resume=resume,
+        zarr_codecs=zarr_codecs,
+        packed=packed,
+        zarr_chunk_sec=zarr_chunk_sec,
+        quantize=quantize,
+        statistics=statistics,
+        hypnogram_epoch_sec=hypnogram_epoch_sec)
+    return errors
+
+
+def _write_series(
+        series: Series,
+        series_path: Path,
+        annotation_format: str = 'json',
+        array_format: str = 'numpy',
+        compression_level: int = 9,
+        parquet_row_group_sec: float | None = None,
+        num_workers: int | None = None,
+        resume: bool = False,
+        zarr_codecs: dict[str, compression.CodecConfig] | None = None,
+        packed: bool = False,
+        zarr_chunk_sec: float | None = None,
+        quantize: dict[str, float | str] | None = None,
+        statistics: bool = False,
+        hypnogram_epoch_sec: float | None = None) -> tuple[dict[str, str], int]:
+    """Write a series, and return the errors and the number of written subjects.
+
+    See `write_series`.
+    """
+    options = _write_options(
+        annotation_format=annotation_format,
+        array_format=array_format,
+        compression_level=compression_level,
+        parquet_row_group_sec=parquet_row_group_sec,
+        zarr_codecs=zarr_codecs,
+        packed=packed,
+        zarr_chunk_sec=zarr_chunk_sec,
+        quantize=quantize,
+        statistics=statistics,
+        hypnogram_epoch_sec=hypnogram_epoch_sec)
+
+    for tmp_path in series_path.glob('.*.tmp'):
+        logger.info(f'Removing incomplete subject {tmp_path}...')
+        shutil.rmtree(tmp_path)
+
+    def _write_path(subject_path: Path, fingerprint: str | None) -> Path | None:
+        """Get the path to write the subject to, or None if it can be skipped.
+
+        The subject is written to a temporary folder when resuming, and in parallel
+        so that a failed subject does not remove the previously written one.
+        """
+        if resume and _is_complete(subject_path, fingerprint):
+            logger.info(f'Skipping complete subject {subject_path}')
+            return None
+        if not resume and num_workers is None:
+            return subject_path
+        return subject_path.with_name(f'.{subject_path.name}.tmp')
+
+    if num_workers is None:
+        n_written = 0
+        for sid, subject in series.subjects.items():
+            subject_path = series_path / subject.metadata.subject_id
+            fingerprint = _subject_fingerprint(subject, options) if resume else None
+            if (write_path := _write_path(subject_path, fingerprint)) is None:
+                continue
+
+            logger.info(f'Writing subject ID {sid}...')
+            write_subject(subject, write_path, **options)
+            if write_path != subject_path:
+                _finalize_subject(write_path, subject_path, fingerprint)
+            n_written += 1
+        return {}, n_written
+
+    array_kwargs = dict(
+        format=array_format,
+        zarr_compression_level=compression_level,
+        parquet_row_group_sec=parquet_row_group_sec,
+        zarr_codecs=zarr_codecs,
+        packed=packed,
+        zarr_chunk_sec=zarr_chunk_sec,
+        quantize=quantize,
+        statistics=statistics)
+
+    errors = {}
+    n_written = 0
+
+    def _complete(sid: str, write_path: Path, subject_path: Path, fingerprint: str | None,
+                  error: str | None = None) -> None:
+        nonlocal n_written
+        if error is None:
+            try:
+                _finalize_subject(write_path, subject_path, fingerprint)
+            except Exception:
+                error = traceback.format_exc()
+        if error is not None:
+            errors[sid] = error
+            _remove_failed_subject(write_path)
+        else:
+            n_written += 1
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # Limit the number of pending subjects so that lazily read subjects
+        # are not all loaded in memory at once
+        pending = {}
+        for sid, subject in series.subjects.items():
+            if len(pending) >= 2 * num_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _complete(*pending.pop(future), error=_future_error(future))
+
+            subject_path = series_path / subject.metadata.subject_id
+            fingerprint = _subject_fingerprint(subject, options) if resume else None
+            if (write_path := _write_path(subject_path, fingerprint)) is None:
+                continue
+            logger.info(f'Writing subject ID {sid}...')
+
+            # The metadata and annotations are light to write, and the parametrized
+            # annotation models cannot be pickled, so write them in this process
+            try:
+                write_path.mkdir(exist_ok=True)
+                write_subject_metadata(subject, write_path)
+                if subject.annotations is not None:
+                    write_annotations(subject, write_path, format=annotation_format,
+                                      hypnogram_epoch_sec=hypnogram_epoch_sec)
+            except Exception:
+                _complete(sid, write_path, subject_path, fingerprint, error=traceback.format_exc())
+                continue
+
+            args = (sid, write_path, subject_path, fingerprint)
+            if subject.sample_arrays is not None:
+                array_subject = Subject.model_construct(
+                    metadata=subject.metadata,
+                    sample_arrays=_worker_sample_arrays(subject.sample_arrays))
+                future = executor.submit(
+                    _write_sample_arrays_task, array_subject, write_path, array_kwargs)
+                pending[future] = args
+            else:
+                _complete(*args)
+
+        for future in wait(pending).done:
+            _complete(*pending[future], error=_future_error(future))
+
+    for sid, error in errors.items():
+        logger.error(f'Failed to write subject ID {sid}:\n{error}')
+
+    return errors, n_written
+
+
+def write_manifest(
+        dataset_path: Path,
+        max_workers: int | None = None) -> DatasetManifest:
+    """Write a consolidated manifest of all files in the dataset.
+
+    The manifest lets `sleeplab_format.reader.read_dataset` read the dataset
+    structure from a single file instead of walking the folders. The manifest
+    needs to be rewritten if the dataset is modified after writing it.
+
+    Arguments:
+        dataset_path: The dataset root folder.
+        max_workers: If given, scan the subjects concurrently using a thread pool of this size.
+
+    Returns:
+        The written manifest.
+    """
+    logger.info(f'Writing manifest for {dataset_path}...')
+    manifest = scan_dataset(dataset_path, include_details=True, max_workers=max_workers)
+
+    # The manifest can be large, so do not indent it
+    manifest_path = dataset_path / MANIFEST_FILENAME
+    manifest_path.write_text(
+        manifest.model_dump_json(exclude_none=True),
+        encoding='utf-8'
+    )
+
+    return manifest
 
 
 def write_dataset(
@@ -194,7 +986,18 @@ def write_dataset(
         basedir: str,
         annotation_format: str = 'json',
         array_format: str = 'numpy',
-        compression_level: int = 9) -> None:
+        compression_level: int = 9,
+        parquet_row_group_sec: float | None = None,
+        manifest: bool = False,
+        num_workers: int | None = None,
+        resume: bool = False,
+        zarr_codecs: dict[str, compression.CodecConfig] | None = None,
+        packed: bool = False,
+        zarr_chunk_sec: float | None = None,
+        quantize: dict[str, float | str] | None = None,
+        layout: str = 'directory',
+        statistics: bool = False,
+        hypnogram_epoch_sec: float | None = None) -> dict[str, dict[str, str]]:
     """Write a SLF dataset to disk.
     
     Arguments:
@@ -203,9 +1006,49 @@ def write_dataset(
         annotation_format: The format of the annotation files.
         array_format: The format of the sample array data files.
         compression_level: The zstd compression level if `array_format` is `zarr`.
+        parquet_row_group_sec: If given with `array_format='parquet'`, the duration
+            of each row group in seconds so that time windows map to row groups.
+        manifest: Whether to write a consolidated manifest of the dataset
+            for faster reading.
+        num_workers: If given, write the subjects in parallel using a process pool
+            of this size. Subjects which fail are skipped, and a report of the
+            run is written to `.write_report.json` in the dataset folder.
+        resume: If True, skip the subjects which have already been completely
+            written with the same contents and options, e.g. when rerunning an
+            interrupted conversion. See `write_series`.
+        zarr_codecs: If given with `array_format='zarr'`, the zarr filter and compressor
+            configs by array name or glob pattern, e.g. `{'SpO2': 'auto'}`.
+            See `sleeplab_format.compression`.
+        packed: If True with `array_format='numpy'` or `array_format='zarr'`, store the
+            arrays sharing a sampling rate, start time, dtype and length together as a
+            2D (channels x samples) array. See `write_sample_arrays`.
+        zarr_chunk_sec: If given with `array_format='zarr'`, the duration of the zarr
+            chunks in seconds, e.g. 300 for ten 30-second epochs. See
+            `sleeplab_format.compression.chunk_access_report` for choosing the value.
+        quantize: If given, store the arrays matching these names or glob patterns as
+            int16 or int32 with a scale and offset. The values are the maximum absolute
+            errors, or `auto` to derive the error from the range of each array,
+            e.g. `{'SpO2': 0.05, 'EEG*': 'auto'}`. See `write_sample_arrays`.
+        layout: `directory` to write each series as a folder tree, or `container`
+            to pack each series into a single uncompressed zip file `<series_name>.slf.zip`
+            after writing it. See `sleeplab_format.container`. With `resume`, a series
+            whose container has all subjects complete is skipped, and otherwise the
+            container is unpacked so that only the incomplete subjects are written.
+            A series with failed subjects is left unpacked.
+        statistics: If True, compute the mean, std, min, max, quartiles, NaN count
+            and clip count of each array while writing it, and store them in
+            `attributes.statistics`. See `write_sample_arrays`.
+        hypnogram_epoch_sec: If given, also write the hypnograms as uint8 epoch labels
+            with this epoch duration, e.g. 30, for loading the labels with a single
+            memory map. See `write_annotations`.
+
+    Returns:
+        The tracebacks of the subjects which failed to be written by series
+        name and subject ID.
     """
     assert annotation_format in ['json', 'parquet']
     assert array_format in ['numpy', 'parquet', 'zarr']
+    assert layout in LAYOUTS, f'Unsupported layout: {layout}'
 
     # Create the folder
     dataset_path = Path(basedir) / dataset.name
@@ -220,16 +1063,93 @@ def write_dataset(
         encoding='utf-8'
     )
 
+    options = _write_options(
+        annotation_format=annotation_format,
+        array_format=array_format,
+        compression_level=compression_level,
+        parquet_row_group_sec=parquet_row_group_sec,
+        zarr_codecs=zarr_codecs,
+        packed=packed,
+        zarr_chunk_sec=zarr_chunk_sec,
+        quantize=quantize,
+        statistics=statistics,
+        hypnogram_epoch_sec=hypnogram_epoch_sec)
+
     # Write the series
+    errors = {}
+    n_subjects = 0
+    n_written = 0
     for name, series in dataset.series.items():
         assert name == series.name
-        logger.info(f'Writing data for series {series.name}...')
         series_path = dataset_path / series.name
+        series_container_path = container_path(series_path)
+        if layout == 'container' and resume and series_container_path.exists():
+            if _is_container_complete(series, series_path, options):
+                logger.info(f'Skipping complete series container {series_container_path}')
+                n_subjects += len(series.subjects)
+                continue
+
+            # Unpack the subjects with their resume markers, unless the packing was interrupted
+            if not series_path.exists() or not any(series_path.iterdir()):
+                unpack_series(series_container_path, series_path)
+
+        if series_container_path.exists():
+            # Remove the container of an overwritten series since it would be read instead
+            # of the folder, also if the series is left unpacked due to failed subjects
+            logger.info(f'Removing old series container {series_container_path}...')
+            series_container_path.unlink()
+
+        logger.info(f'Writing data for series {series.name}...')
         series_path.mkdir(exist_ok=True)
 
-        write_series(
+        series_errors, series_written = _write_series(
             series,
             series_path,
             annotation_format=annotation_format,
             array_format=array_format,
-            compression_level=compression_level)
+            compression_level=compression_level,
+            parquet_row_group_sec=parquet_row_group_sec,
+            num_workers=num_workers,
+            resume=resume,
+            zarr_codecs=zarr_codecs,
+            packed=packed,
+            zarr_chunk_sec=zarr_chunk_sec,
+            quantize=quantize,
+            statistics=statistics,
+            hypnogram_epoch_sec=hypnogram_epoch_sec)
+        n_subjects += len(series.subjects)
+        n_written += series_written
+        if len(series_errors) > 0:
+            errors[name] = series_errors
+
+        if layout == 'container' and len(series_errors) > 0:
+            # Keep the folder so that the failed subjects can be written with resume
+            logger.warning(f'Not packing series {series.name} since some subjects failed')
+        elif layout == 'container':
+            entries = scan_series(series_path, include_details=True)
+            pack_series(series_path, entries, series_container_path,
+                        keep_hidden=[COMPLETE_MARKER_FILENAME])
+            shutil.rmtree(series_path)
+
+    if num_workers is not None:
+        n_failed = sum(len(v) for v in errors.values())
+        report = {
+            'n_subjects': n_subjects,
+            'n_written': n_written,
+            'n_skipped': n_subjects - n_written - n_failed,
+            'n_failed': n_failed,
+            'errors': errors
+        }
+        report_path = dataset_path / WRITE_REPORT_FILENAME
+        logger.info(f'Wrote {n_written}/{n_subjects} subjects, see {report_path}')
+        report_path.write_text(json.dumps(report, indent=JSON_INDENT), encoding='utf-8')
+
+    manifest_path = dataset_path / MANIFEST_FILENAME
+    if manifest:
+        write_manifest(dataset_path)
+    elif manifest_path.exists():
+        # Remove the manifest of an overwritten dataset since it may be stale
+        logger.info(f'Removing old manifest {manifest_path}...')
+        manifest_path.unlink()
+
+    return errors
@@ -2,8 +2,9 @@ import json
 import numpy as np
 import pytest
 
-from sleeplab_format.extractor import config, cli
-from sleeplab_format import reader
+from sleeplab_format.extractor import config, cli, preprocess
+from sleeplab_format import reader, writer
+from sleeplab_format.models import ColumnarAnnotations
 
 
 def test_extract_preprocess(ds_dir, tmp_path, example_extractor_config_path):
@@ -139,3 +140,62 @@ def test_rename(ds_dir, tmp_path, example_extractor_config_path):
         extr_sarr = extr_subj.sample_arrays['s1_renamed']
         assert orig_sarr.attributes.model_dump(exclude='name') == extr_sarr.attributes.model_dump(exclude='name')
         assert (orig_sarr.values == extr_sarr.values).all()
+
+
+def test_process_array_resets_window_func(ds_dir, example_extractor_config_path):
+    ds = reader.read_dataset(ds_dir)
+    cfg = config.parse_config(example_extractor_config_path)
+    subj = ds.series['series1'].subjects['10001']
+
+    resampled = preprocess.process_array(subj.sample_arrays, cfg.series_configs[0].array_configs[0])
+    assert resampled.window_func is None
+    assert len(resampled.read_window(0.0, 10.0)) == 8 * 10
+
+    renamed = preprocess.process_array(subj.sample_arrays, cfg.series_configs[0].array_configs[4])
+    assert renamed.window_func is not None
+
+
+def test_normalization_uses_statistics(ds_dir, tmp_path, example_extractor_config_path):
+    ds = reader.read_dataset(ds_dir)
+    subj = ds.series['series1'].subjects['10001']
+    subj.sample_arrays['s1'].values_func = lambda: np.linspace(-1.0, 3.0, 100, dtype=np.float32)
+    writer.write_dataset(ds, tmp_path, statistics=True)
+    ds = reader.read_dataset(tmp_path / ds.name)
+    sarr = ds.series['series1'].subjects['10001'].sample_arrays['s1']
+    s = np.arange(10, dtype=np.float32)
+
+    # The statistics of the stored array are used instead of the given signal only if enabled
+    stats = sarr.attributes.statistics
+    np.testing.assert_allclose(
+        preprocess.z_score_norm(s, sarr.attributes, use_statistics=True), (s - stats.mean) / stats.std)
+    np.testing.assert_allclose(
+        preprocess.z_score_norm(s, sarr.attributes), (s - s.mean()) / s.std())
+    np.testing.assert_allclose(
+        preprocess.iqr_norm(s, sarr.attributes, use_statistics=True),
+        (s - stats.median) / (stats.q75 - stats.q25))
+    np.testing.assert_allclose(
+        preprocess.iqr_norm(s, sarr.attributes), (s - 4.5) / 4.5)
+
+    # The statistics are removed when the values are processed
+    cfg = config.parse_config(example_extractor_config_path)
+    subj = ds.series['series1'].subjects['10001']
+    resampled = preprocess.process_array(subj.sample_arrays, cfg.series_configs[0].array_configs[0])
+    assert resampled.attributes.statistics is None
+    renamed = preprocess.process_array(subj.sample_arrays, cfg.series_configs[0].array_configs[4])
+    assert renamed.attributes.statistics == stats
+
+
+def test_extract_hypnogram_epochs(ds_dir, tmp_path, example_extractor_config_path):
+    dst_dir = tmp_path / 'extracted_datasets'
+
+    cfg = config.parse_config(example_extractor_config_path)
+    cfg.hypnogram_epoch_sec = 30.0
+    cli.extract(ds_dir, dst_dir, cfg)
+
+    subject_dir = dst_dir / 'dataset1_extracted' / 'series1' / '10001'
+    assert (subject_dir / f'scorer_1_hypnogram{reader.EPOCH_ARRAY_SUFFIX}').exists()
+
+    extr_ds = reader.read_dataset(dst_dir / 'dataset1_extracted')
+    hypnogram = extr_ds.series['series1'].subjects['10001'].annotations['scorer_1_hypnogram']
+    epochs = reader.read_epoch_array(subject_dir, 'scorer_1_hypnogram')
+    assert np.array_equal(epochs, ColumnarAnnotations.from_annotations(hypnogram).to_epoch_array())
@@ -0,0 +1,114 @@
+import gc
+import numpy as np
+import pytest
+
+from datetime import datetime
+from sleeplab_format.cache import ArrayCache, array_cache, configure_array_cache
+from sleeplab_format.models import ArrayAttributes, SampleArray
+
+
+def _sample_array(n: int) -> SampleArray:
+    attributes = ArrayAttributes(name='s1', start_ts=datetime(2018, 1, 1), sampling_rate=1.0)
+    return SampleArray(attributes=attributes, values_func=lambda: np.zeros(n, dtype=np.uint8))
+
+
+class _Owner:
+    pass
+
+
+def test_array_cache_lru_eviction():
+    cache = ArrayCache(max_bytes=250)
+    owners = [_Owner() for _ in range(3)]
+    funcs = [lambda: np.zeros(100, dtype=np.uint8) for _ in range(3)]
+
+    cache.get(owners[0], funcs[0])
+    cache.get(owners[1], funcs[1])
+    cache.get(owners[0], funcs[0])
+    cache.get(owners[2], funcs[2])
+
+    # The least recently used array was evicted
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'evictions': 1,
+                             'n_arrays': 2, 'nbytes': 200, 'max_bytes': 250}
+    assert cache.release(owners[0])
+    assert not cache.release(owners[1])
+    assert cache.nbytes == 100
+
+    # Arrays larger than the budget are not cached
+    cache.get(owners[1], lambda: np.zeros(300, dtype=np.uint8))
+    assert cache.nbytes == 100
+
+    cache.resize(50)
+    assert len(cache) == 0
+
+
+def test_array_cache_owner_lifetime():
+    cache = ArrayCache(max_bytes=None)
+    owner = _Owner()
+    func = lambda: np.zeros(10)
+    values = cache.get(owner, func)
+    assert cache.get(owner, func) is values
+
+    # Replacing the function invalidates the cached values
+    assert cache.get(owner, lambda: np.ones(10))[0] == 1.0
+
+    del owner
+    gc.collect()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_array_cache_reference_cycles():
+    cache = ArrayCache(max_bytes=10_000)
+    gc_threshold = gc.get_threshold()
+    gc.set_threshold(10, 1, 1)
+    try:
+        for i in range(2000):
+            # The owners are in reference cycles, so that the garbage collector runs
+            # their finalizers, and half of the functions refer to their owner
+            owner = _Owner()
+            owner.self_ref = owner
+            if i % 2 == 0:
+                owner.func = lambda owner=owner: np.zeros(10, dtype=np.uint8)
+            else:
+                owner.func = lambda: np.zeros(10, dtype=np.uint8)
+            cache.get(owner, owner.func)
+        del owner
+    finally:
+        gc.set_threshold(*gc_threshold)
+
+    gc.collect()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_array_cache_memmap_not_counted(tmp_path):
+    path = tmp_path / 'data.npy'
+    np.save(path, np.zeros(1000))
+    cache = ArrayCache(max_bytes=100)
+    owner = _Owner()
+    func = lambda: np.load(path, mmap_mode='r')
+    values = cache.get(owner, func)
+    assert cache.get(owner, func) is values
+    assert cache.nbytes == 0
+
+
+@pytest.fixture
+def small_array_cache():
+    max_bytes = array_cache.max_bytes
+    array_cache.clear()
+    array_cache.reset_stats()
+    yield configure_array_cache(150)
+    array_cache.clear()
+    configure_array_cache(max_bytes)
+
+
+def test_samplearray_values_cache(small_array_cache):
+    sarr1, sarr2 = _sample_array(100), _sample_array(100)
+    values = sarr1.values
+    assert sarr1.values is values
+
+    # Reading the second array evicts the first one
+    _ = sarr2.values
+    assert sarr1.values is not values
+    assert small_array_cache.stats()['evictions'] == 2
+
+    assert sarr1.release()
+    assert small_array_cache.nbytes == 0
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import zarr
+
+from sleeplab_format import compression, reader, writer
+
+
+@pytest.fixture
+def random_walk():
+    # A signal with small differences between consecutive samples
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.integers(-2, 3, size=2**16)).astype(np.int16)
+
+
+def test_select_codec_size(random_walk):
+    config = compression.select_codec(random_walk, goal='size')
+    assert config['filters'][0]['id'] == 'delta'
+
+
+def test_select_codec_float_without_delta():
+    rng = np.random.default_rng(0)
+    eeg = rng.normal(size=2**16).astype(np.float32)
+    config = compression.select_codec(eeg)
+    assert all(f['id'] != 'delta' for f in config['filters'] or [])
+
+
+def test_select_codec_speed(random_walk):
+    pipelines = compression.candidate_pipelines(random_walk.dtype)
+    config = compression.select_codec(random_walk, goal='speed', min_ratio=2.0)
+    assert config in pipelines.values()
+
+    ratio, _ = compression._trial(random_walk, *compression.get_codecs(config))
+    assert ratio >= 2.0
+
+
+def test_resolve_name_config():
+    configs = {'SpO2': 'auto', 'EEG*': {'compressor': None}, '*': {'goal': 'speed'}}
+    assert compression.resolve_name_config('SpO2', configs) == 'auto'
+    assert compression.resolve_name_config('EEG C4-M1', configs) == {'compressor': None}
+    assert compression.is_auto(compression.resolve_name_config('ECG', configs))
+    assert compression.resolve_name_config('ECG', None) is None
+
+
+def test_write_dataset_zarr_codecs(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    zarr_codecs = {
+        's1': {'filters': [{'id': 'shuffle', 'elementsize': 4}], 'compressor': {'id': 'zstd', 'level': 3}},
+        '*': 'auto'
+    }
+    writer.write_dataset(dataset, ds_dir, array_format='zarr', zarr_codecs=zarr_codecs)
+
+    subject_dir = ds_dir / dataset.name / 'series1' / '10001'
+    z = zarr.open_array(str(subject_dir / 's1' / 'data.zarr'), mode='r')
+    assert z.filters[0].codec_id == 'shuffle'
+    assert z.compressor.get_config() == {'id': 'zstd', 'level': 3, 'checksum': False}
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    for series_name, series in dataset.series.items():
+        for sid, subject in series.subjects.items():
+            for name, sarr in subject.sample_arrays.items():
+                sarr_read = ds_read.series[series_name].subjects[sid].sample_arrays[name]
+                np.testing.assert_array_equal(sarr_read.values, sarr.values_func())
+
+
+def test_write_dataset_zarr_chunk_sec(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format='zarr', zarr_chunk_sec=30.0)
+
+    subject_dir = ds_dir / dataset.name / 'series1' / '10001'
+    assert zarr.open_array(str(subject_dir / 's1' / 'data.zarr'), mode='r').chunks == (30*32,)
+    assert zarr.open_array(str(subject_dir / 's2' / 'data.zarr'), mode='r').chunks == (30*64,)
+
+
+def test_chunk_access_report():
+    epochs = [(30.0 * i, 30.0) for i in range(99)]
+    report = compression.chunk_access_report(epochs, 100.0, [30.0, 45.0, 300.0])
+
+    assert report.loc[30.0, 'read_amplification'] == 1.0
+    assert report.loc[30.0, 'chunks_per_window'] == 1.0
+    assert report.loc[45.0, 'chunks_per_window'] == pytest.approx(4/3)
+    assert report.loc[300.0, 'read_amplification'] == 10.0
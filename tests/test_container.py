@@ -0,0 +1,110 @@
+import gc
+import numpy as np
+import pytest
+import zipfile
+
+from sleeplab_format import reader, writer
+from sleeplab_format.container import CONTAINER_SUFFIX, INDEX_FILENAME, open_container
+from sleeplab_format.models import ColumnarAnnotations
+
+from .test_reader import _assert_datasets_equal
+
+
+@pytest.mark.parametrize('array_format', ['numpy', 'parquet', 'zarr'])
+def test_write_read_container(dataset, tmp_path, array_format):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format=array_format,
+                         annotation_format='parquet', layout='container')
+
+    # Each series is a single file next to the dataset metadata
+    ds_path = ds_dir / dataset.name
+    assert sorted(p.name for p in ds_path.iterdir()) == ['metadata.json', f'series1{CONTAINER_SUFFIX}']
+    with zipfile.ZipFile(ds_path / f'series1{CONTAINER_SUFFIX}') as zf:
+        assert zf.namelist()[0] == INDEX_FILENAME
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
+
+    ds_read = reader.read_dataset(ds_path)
+    _assert_datasets_equal(dataset, ds_read)
+
+    sarr = ds_read.series['series1'].subjects['10001'].sample_arrays['s1']
+    assert np.array_equal(sarr.read_window(1.0, 2.0), sarr.values[32:96])
+
+
+def test_read_container_memmap(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, layout='container')
+    ds_read = reader.read_dataset(ds_dir / dataset.name, lazy=True, columnar_annotations=True)
+
+    subject = ds_read.series['series1'].subjects['10001']
+    orig = dataset.series['series1'].subjects['10001']
+    values = subject.sample_arrays['s1'].values
+    assert isinstance(values, np.memmap)
+    assert np.array_equal(values, orig.sample_arrays['s1'].values)
+
+    columnar = subject.annotations['automatic_aasmevents']
+    assert isinstance(columnar, ColumnarAnnotations)
+    assert columnar.to_annotations().model_dump() == orig.annotations['automatic_aasmevents'].model_dump()
+
+
+@pytest.mark.parametrize('array_format', ['numpy', 'zarr'])
+def test_write_read_container_packed(dataset, tmp_path, array_format):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format=array_format, packed=True,
+                         layout='container', manifest=True)
+    ds_read = reader.read_dataset(ds_dir / dataset.name, zarr_mode='open')
+    _assert_datasets_equal(dataset, ds_read)
+
+
+def test_overwrite_container_with_directory(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, layout='container')
+    writer.write_dataset(dataset, ds_dir)
+
+    ds_path = ds_dir / dataset.name
+    assert not (ds_path / f'series1{CONTAINER_SUFFIX}').exists()
+    _assert_datasets_equal(dataset, reader.read_dataset(ds_path))
+
+
+def test_read_metadata_table_container(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, layout='container')
+
+    df = reader.read_metadata_table(ds_dir / dataset.name / 'series1')
+    assert sorted(df.index) == sorted(dataset.series['series1'].subjects.keys())
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name, subject_filter=lambda m: m.subject_id == '10001')
+    assert list(ds_read.series['series1'].subjects.keys()) == ['10001']
+
+
+def test_close_container(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format='zarr', layout='container')
+    series_dir = ds_dir / dataset.name / 'series1'
+
+    with open_container(series_dir) as container:
+        arr_path = series_dir / '10001' / 's1' / 'data.zarr'
+        values = container.open_zarr(arr_path)[:]
+        assert set(container.subject_entries) == {'10001', '10002', '10003'}
+        assert container._zip_file is not None and container._zip_store is not None
+    assert container._zip_file is None and container._zip_store is None
+
+    # The archive is reopened on later use
+    assert np.array_equal(container.open_zarr(arr_path)[:], values)
+    assert container.read_bytes(series_dir / '10001' / 'metadata.json')
+    container.close()
+
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_read_container_zarr_after_series_collected(dataset, tmp_path, packed):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format='zarr', packed=packed, layout='container')
+    ds_read = reader.read_dataset(ds_dir / dataset.name, zarr_mode='open')
+    subject = ds_read.series['series1'].subjects['10001']
+    _ = subject.sample_arrays['s1'].read_window(0.0, 1.0)
+
+    # The container is closed with the series, and the opened arrays reopen it
+    del ds_read
+    gc.collect()
+    orig = dataset.series['series1'].subjects['10001'].sample_arrays['s1'].values_func()
+    np.testing.assert_array_equal(subject.sample_arrays['s1'].read_window(1.0, 2.0), orig[32:96])
+    np.testing.assert_array_equal(subject.sample_arrays['s1'].values, orig)
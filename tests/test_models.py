@@ -1,6 +1,8 @@
 import numpy as np
+import pyarrow as pa
 import pytest
 
+from datetime import datetime
 from sleeplab_format.models import *
 from pydantic import ValidationError
 
@@ -24,3 +26,221 @@ def test_extra_fields_forbidden(subjects, series):
 
     with pytest.raises(ValidationError):
         ds = Dataset(name='ds', series=series, extra_field='extra')
+
+
+def test_samplearray_read_window():
+    values = np.arange(100, dtype=np.float32)
+    sarr = SampleArray(
+        attributes=ArrayAttributes(
+            name='s', start_ts='2018-01-01T23:10:04', sampling_interval=0.5),
+        values_func=lambda: values)
+
+    # Without window_func, the window is sliced from values
+    assert (sarr.read_window(10.0, 5.0) == values[20:30]).all()
+
+
+def test_columnar_annotations_validation():
+    table = pa.table({
+        'name': ['N1', 'W'],
+        'start_ts': [datetime(2018, 1, 1, 23, 10, 4), datetime(2018, 1, 1, 23, 10, 34)],
+        'start_sec': [0.0, 30.0],
+        'duration': [30.0, None],
+    })
+    hg = ColumnarAnnotations(scorer='scorer_1', type='hypnogram', table=table)
+    assert hg.table['duration'].to_pylist() == [30.0, 0.0]
+    assert hg.table['input_channel'].null_count == 2
+    assert hg[0].name == AASMSleepStage.N1
+
+    with pytest.raises(ValidationError):
+        ColumnarAnnotations(scorer='scorer_1', type='aasmevents', table=table)
+
+    with pytest.raises(ValidationError):
+        ColumnarAnnotations(scorer='scorer_1', type='hypnogram', table=table.drop_columns(['start_sec']))
+
+
+def test_samplearray_chunks_func():
+    attributes = ArrayAttributes(name='s1', start_ts=datetime(2018, 1, 1), sampling_rate=2.0)
+    sarr = SampleArray(
+        attributes=attributes,
+        chunks_func=lambda: (np.arange(i, i + 3) for i in range(0, 9, 3)))
+    np.testing.assert_array_equal(sarr.values, np.arange(9))
+
+    with pytest.raises(ValidationError):
+        SampleArray(attributes=attributes)
+
+
+def test_statistics_accumulator():
+    rng = np.random.default_rng(0)
+    values = rng.normal(loc=5.0, size=10_000)
+    values[:50] = values.max()
+    values[100:110] = np.nan
+
+    accumulator = StatisticsAccumulator(sample_size=2**16)
+    for chunk in np.array_split(values, 7):
+        accumulator.update(chunk)
+    stats = accumulator.result()
+
+    finite = values[~np.isnan(values)]
+    assert stats.count == len(finite)
+    assert stats.nan_count == 10
+    assert stats.mean == pytest.approx(finite.mean())
+    assert stats.std == pytest.approx(finite.std())
+    assert (stats.min, stats.max) == (finite.min(), finite.max())
+    assert stats.clip_count == 50 + 1 + 1
+
+    # The quartiles are exact when the whole array fits in the sample
+    assert stats.median == pytest.approx(np.median(finite))
+    assert stats.q25 == pytest.approx(np.percentile(finite, 25))
+
+    # The quartiles are estimated from a sample of longer arrays
+    stats = compute_statistics(finite, sample_size=1000)
+    assert stats.sample_size == 1000
+    assert stats.median == pytest.approx(np.median(finite), abs=0.1)
+    assert stats.mean == pytest.approx(finite.mean())
+
+
+def test_columnar_annotations_from_arrays():
+    hg = ColumnarAnnotations.from_arrays(
+        'scorer_1', 'hypnogram',
+        start_sec=np.arange(4) * 30.0,
+        name_codes=np.array([0, 1, 1, 0]),
+        categories=['W', 'N2'],
+        duration=np.full(4, 30.0),
+        recording_start_ts=datetime(2018, 1, 1, 23, 0))
+
+    np.testing.assert_array_equal(hg.name_codes, [0, 1, 1, 0])
+    assert hg.categories == ['W', 'N2']
+    assert hg[2].start_ts == datetime(2018, 1, 1, 23, 1)
+
+    # Round-trip through the typed annotations model
+    hypnogram = hg.to_annotations(Hypnogram)
+    assert isinstance(hypnogram, Hypnogram)
+    assert hypnogram.annotations[1].name == AASMSleepStage.N2
+    roundtrip = ColumnarAnnotations.from_annotations(hypnogram)
+    assert roundtrip.table.equals(hg.table.cast(roundtrip.table.schema))
+
+    with pytest.raises(ValidationError):
+        ColumnarAnnotations.from_arrays(
+            'scorer_1', 'hypnogram', start_sec=[0.0], names=['not_a_stage'],
+            recording_start_ts=datetime(2018, 1, 1))
+
+
+def test_columnar_annotations_from_records():
+    records = [
+        {'name': 'SPO2_DESAT', 'start_ts': '2018-01-01T23:00:10', 'start_sec': 10.0,
+         'duration': 12.0, 'extra_attributes': {'min_spo2': 88}},
+        {'name': 'SPO2_DESAT', 'start_ts': '2018-01-01T23:01:00.500000', 'start_sec': 60.5,
+         'extra_attributes': {'drop': 4.0}},
+        {'name': 'SNORE', 'start_ts': '2018-01-01T23:02:00', 'start_sec': 120.0},
+    ]
+    events = ColumnarAnnotations.from_records('automatic', 'aasmevents', records)
+    assert pa.types.is_struct(events.extra_attributes.type)
+    np.testing.assert_array_equal(events.duration, [12.0, 0.0, 0.0])
+
+    # The missing extra attributes of each annotation are not filled in
+    expected = AASMEvents.model_validate(
+        {'scorer': 'automatic', 'type': 'aasmevents', 'annotations': records})
+    assert events.to_annotations(AASMEvents) == expected
+    assert events[1] == expected.annotations[1]
+
+    # The names outside the enum are only found by the explicit check
+    records[2]['name'] = 'WHISTLE'
+    events = ColumnarAnnotations.from_records('automatic', 'aasmevents', records, validate='light')
+    annotations = events.to_annotations(validate='light')
+    assert annotations.annotations[2].name == 'WHISTLE'
+    for a in [events, annotations]:
+        with pytest.raises(ValueError, match='WHISTLE'):
+            check_annotation_names(a)
+    check_annotation_names(expected)
+
+
+def test_hypnogram_to_epoch_array():
+    start_ts = datetime(2018, 1, 1, 23, 0)
+
+    def _ann(name, start_sec, duration):
+        return {'name': name, 'start_ts': start_ts, 'start_sec': start_sec, 'duration': duration}
+
+    # A gap at 60-90 s, a two-epoch annotation, and an overlap at 150 s
+    hg = Hypnogram(scorer='scorer_1', annotations=[
+        _ann('W', 0.0, 30.0),
+        _ann('N1', 30.0, 30.0),
+        _ann('N2', 90.0, 60.0),
+        _ann('R', 150.0, 30.0),
+        _ann('N3', 140.0, 40.0),
+    ])
+
+    epochs = hg.to_epoch_array(epoch_sec=30.0)
+    assert epochs.dtype == np.uint8
+    np.testing.assert_array_equal(epochs, [0, 1, 255, 2, 2, 4])
+
+    value_map = {'W': 0, 'N1': 1, 'N2': 1, 'N3': 1}
+    epochs = hg.to_epoch_array(value_map=value_map, default=9, n_epochs=8)
+    np.testing.assert_array_equal(epochs, [0, 1, 9, 1, 1, 9, 9, 9])
+
+    # The result is cached and read-only
+    assert hg.to_epoch_array(value_map=value_map, default=9, n_epochs=8) is epochs
+    assert not epochs.flags.writeable
+
+    columnar = ColumnarAnnotations.from_annotations(hg)
+    np.testing.assert_array_equal(columnar.to_epoch_array(), hg.to_epoch_array())
+
+
+def test_interval_index():
+    rng = np.random.default_rng(0)
+    start_sec = rng.uniform(0, 1000, size=500)
+    duration = rng.choice([0.0, 10.0, 30.0], size=500)
+    index = IntervalIndex(start_sec, duration)
+    end_sec = start_sec + duration
+
+    windows = rng.uniform(0, 1000, size=100)
+    window_ends = windows + 30.0
+    w, idx = index.overlapping_batch(windows, window_ends)
+    for i, (a, b) in enumerate(zip(windows, window_ends)):
+        expected = np.flatnonzero((start_sec < b) & ((end_sec > a) | (start_sec >= a)))
+        assert sorted(idx[w == i]) == sorted(expected)
+        assert sorted(index.overlapping(a, b)) == sorted(expected)
+
+        expected = np.flatnonzero((start_sec >= a) & (end_sec <= b))
+        assert sorted(index.contained(a, b)) == sorted(expected)
+
+        expected = np.flatnonzero((start_sec <= a) & ((end_sec > a) | (start_sec == a)))
+        assert sorted(index.at(a)) == sorted(expected)
+
+
+def test_interval_index_long_intervals():
+    # One long interval does not widen the scan of the short ones
+    start_sec = np.append(np.arange(10_000) * 30.0, 0.0)
+    duration = np.append(np.full(10_000, 30.0), 300_000.0)
+    index = IntervalIndex(start_sec, duration)
+    windows, pos = index._candidates(np.array([150_000.0]), np.array([150_030.0]), side='left')
+    assert len(pos) <= 3
+    assert sorted(index.overlapping(150_000.0, 150_030.0)) == [5000, 10_000]
+    assert sorted(index.at(15.0)) == [0, 10_000]
+
+
+def test_annotations_interval_index():
+    start_ts = datetime(2018, 1, 1, 23, 0)
+    events = AASMEvents(scorer='automatic', annotations=[
+        {'name': 'SPO2_DESAT', 'start_ts': start_ts, 'start_sec': 40.0, 'duration': 15.0},
+        {'name': 'SNORE', 'start_ts': start_ts, 'start_sec': 5.0, 'duration': 2.0},
+        {'name': 'AROUSAL', 'start_ts': start_ts, 'start_sec': 58.0},
+    ])
+    assert [a.name for a in events.overlapping(30.0, 60.0)] == [AASMEvent.SPO2_DESAT, AASMEvent.AROUSAL]
+
+    # The index is cached, and rebuilt if the annotations are replaced
+    index = events.interval_index
+    assert events.interval_index is index
+    assert events == events.model_copy()
+    events.annotations = events.annotations[:1]
+    assert len(events.interval_index) == 1
+
+    # The index is rebuilt after modifying the annotations in place without changing their number
+    events.annotations[0] = events.annotations[0].model_copy(update={'start_sec': 100.0})
+    assert events.overlapping(30.0, 60.0) == []
+    events.annotations[0].start_sec = 40.0
+    events.clear_cache()
+    assert len(events.overlapping(30.0, 60.0)) == 1
+    assert AASMEvents.model_validate_json(events.model_dump_json()) == events
+
+    columnar = ColumnarAnnotations.from_annotations(events)
+    np.testing.assert_array_equal(columnar.interval_index.overlapping(30.0, 60.0), [0])
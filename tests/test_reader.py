@@ -1,9 +1,16 @@
+import json
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
 import subprocess
+import zarr
 
+from datetime import datetime, timedelta
 from sleeplab_format import reader, writer
 from pathlib import Path
 
-from sleeplab_format.models import Dataset
+from sleeplab_format.models import ColumnarAnnotations, Dataset, LazySubjects, SampleArray, Sex
 
 
 def _assert_dirs_equal(dir1, dir2):
@@ -88,3 +95,419 @@ def test_read_write(tmp_path: Path):
 
     # Assert that the created dataset is equal to tests/datasets
     _assert_dirs_equal(str(ds_dir.resolve()), str(tests_ds_dir.resolve()))
+
+
+def test_read_dataset_max_workers(dataset: Dataset):
+    tests_ds_dir = Path(__file__).parent / 'datasets' / 'dataset1'
+    ds_read = reader.read_dataset(tests_ds_dir, max_workers=4)
+    _assert_datasets_equal(dataset, ds_read)
+
+    # The subject order should equal to sequential reading
+    ds_seq = reader.read_dataset(tests_ds_dir)
+    assert (list(ds_read.series['series1'].subjects.keys())
+            == list(ds_seq.series['series1'].subjects.keys()))
+
+
+def test_read_subject_max_workers(dataset: Dataset):
+    subject_dir = Path(__file__).parent / 'datasets' / 'dataset1' / 'series1' / '10001'
+    subj_read = reader.read_subject(subject_dir, max_workers=4)
+    subj_seq = reader.read_subject(subject_dir)
+
+    assert list(subj_read.sample_arrays.keys()) == list(subj_seq.sample_arrays.keys())
+    assert list(subj_read.annotations.keys()) == list(subj_seq.annotations.keys())
+
+
+def test_write_read_manifest(dataset: Dataset, tmp_path: Path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, manifest=True)
+
+    # The subject metadata should be read from the manifest
+    (ds_dir / dataset.name / 'series1' / '10001' / 'metadata.json').unlink()
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    _assert_datasets_equal(dataset, ds_read)
+
+    with pytest.raises(FileNotFoundError):
+        reader.read_dataset(ds_dir / dataset.name, use_manifest=False)
+
+
+@pytest.mark.parametrize('array_format', ['numpy', 'parquet', 'zarr'])
+def test_manifest_details(dataset: Dataset, tmp_path: Path, array_format: str):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format=array_format, manifest=True)
+
+    manifest = reader.read_manifest(ds_dir / dataset.name)
+    entry = manifest.series['series1']['10001']
+    assert entry.sample_arrays['s1'].format == array_format
+    assert entry.sample_arrays['s1'].shape == [60*32]
+    assert entry.sample_arrays['s1'].dtype == '<f4'
+    assert entry.sample_arrays['s1'].nbytes > 0
+    assert set(entry.annotations.keys()) == {
+        'automatic_aasmevents', 'scorer_1_hypnogram', 'study_logs'}
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    _assert_datasets_equal(dataset, ds_read)
+
+    # Overwriting the dataset without a manifest removes the old manifest
+    writer.write_dataset(dataset, ds_dir, array_format=array_format)
+    assert reader.read_manifest(ds_dir / dataset.name) is None
+
+
+def test_read_dataset_lazy(dataset: Dataset):
+    tests_ds_dir = Path(__file__).parent / 'datasets' / 'dataset1'
+    ds_read = reader.read_dataset(tests_ds_dir, lazy=True, subject_cache_size=2)
+    subjects = ds_read.series['series1'].subjects
+
+    assert isinstance(subjects, LazySubjects)
+    assert len(subjects) == 3
+    assert '10001' in subjects
+    assert '10004' not in subjects
+
+    _assert_datasets_equal(dataset, ds_read)
+
+    # The same subject object is returned from the cache
+    assert subjects['10003'] is subjects['10003']
+    assert subjects._read.cache_info().currsize == 2
+
+
+def test_read_dataset_lazy_manifest(dataset: Dataset, tmp_path: Path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, manifest=True)
+    ds_read = reader.read_dataset(ds_dir / dataset.name, lazy=True)
+    _assert_datasets_equal(dataset, ds_read)
+
+
+@pytest.mark.parametrize('array_format', ['numpy', 'parquet', 'zarr'])
+def test_read_window(dataset: Dataset, tmp_path: Path, array_format: str):
+    values = np.arange(60*32, dtype=np.float32)
+    subj = dataset.series['series1'].subjects['10001']
+    subj.sample_arrays['s1'] = subj.sample_arrays['s1'].model_copy(
+        update={'values_func': lambda: values})
+
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format=array_format)
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    sarr = ds_read.series['series1'].subjects['10001'].sample_arrays['s1']
+
+    assert sarr.window_func is not None
+    assert (sarr.read_window(10.0, 30.0) == values[320:1280]).all()
+
+    # The window is clipped to the bounds of the array
+    assert (sarr.read_window(50.0, 30.0) == values[1600:]).all()
+    assert len(sarr.read_window(70.0, 30.0)) == 0
+
+    ref_ts = sarr.attributes.start_ts - timedelta(seconds=5)
+    assert (sarr.read_window(15.0, 30.0, ref_ts=ref_ts) == values[320:1280]).all()
+
+
+def test_read_parquet_window_row_groups(tmp_path: Path):
+    values = np.arange(1000, dtype=np.float32)
+    data_path = tmp_path / 'data.parquet'
+    pq.write_table(pa.Table.from_arrays([values], names=['data']), data_path, row_group_size=100)
+
+    _, window_func = reader._array_funcs(data_path, 'parquet')
+    assert (window_func(150, 420) == values[150:420]).all()
+    assert (window_func(0, 100) == values[0:100]).all()
+    assert (window_func(950, 1100) == values[950:]).all()
+    assert len(window_func(1000, 1100)) == 0
+
+
+@pytest.mark.parametrize('zarr_chunk_cache_size', [None, 2])
+def test_read_zarr_open(dataset: Dataset, tmp_path: Path, zarr_chunk_cache_size: int | None):
+    values = np.arange(60*32, dtype=np.float32)
+    subj = dataset.series['series1'].subjects['10001']
+    subj.sample_arrays['s1'] = subj.sample_arrays['s1'].model_copy(
+        update={'values_func': lambda: values})
+
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format='zarr')
+    ds_read = reader.read_dataset(
+        ds_dir / dataset.name,
+        zarr_mode='open',
+        zarr_chunk_cache_size=zarr_chunk_cache_size)
+    _assert_datasets_equal(dataset, ds_read)
+
+    sarr = ds_read.series['series1'].subjects['10001'].sample_arrays['s1']
+    if zarr_chunk_cache_size is None:
+        assert isinstance(sarr.values, zarr.Array)
+    else:
+        assert isinstance(sarr.values, reader.ChunkCachedArray)
+
+    assert (sarr.read_window(10.0, 30.0) == values[320:1280]).all()
+    assert sarr.values[5] == values[5]
+    assert sarr.values[-1] == values[-1]
+    assert (sarr.values[100:50] == values[100:50]).all()
+
+    # Rewrite the lazily read dataset
+    writer.write_dataset(ds_read, tmp_path / 'rewritten', array_format='parquet')
+
+
+def test_chunk_cached_array(tmp_path: Path):
+    values = np.arange(1000, dtype=np.int16)
+    z = zarr.array(values, chunks=(100,))
+    arr = reader.ChunkCachedArray(z, cache_size=3)
+
+    assert (arr[150:420] == values[150:420]).all()
+    assert (arr[150:420:7] == values[150:420:7]).all()
+    assert (arr[::-1] == values[::-1]).all()
+    assert arr._read_chunk.cache_info().currsize == 3
+
+    # Cached chunks cannot be modified through the returned views
+    with pytest.raises(ValueError):
+        arr[0:10][0] = 1
+
+    assert (np.asarray(arr) == values).all()
+    with pytest.raises(IndexError):
+        arr[1000]
+
+
+def test_read_parquet_mmap(dataset: Dataset, tmp_path: Path):
+    values = np.arange(60*32, dtype=np.float32)
+    subj = dataset.series['series1'].subjects['10001']
+    subj.sample_arrays['s1'] = subj.sample_arrays['s1'].model_copy(
+        update={'values_func': lambda: values})
+
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, array_format='parquet', parquet_row_group_sec=10.0)
+
+    data_path = ds_dir / dataset.name / 'series1' / '10001' / 's1' / 'data.parquet'
+    assert pq.ParquetFile(data_path).metadata.num_row_groups == 6
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name, parquet_mode='mmap')
+    _assert_datasets_equal(dataset, ds_read)
+
+    sarr = ds_read.series['series1'].subjects['10001'].sample_arrays['s1']
+    assert (sarr.read_window(15.0, 20.0) == values[480:1120]).all()
+
+    # A window within a single row group is a read-only zero-copy view
+    window = sarr.read_window(10.0, 5.0)
+    assert (window == values[320:480]).all()
+    assert not window.flags.writeable
+
+
+def test_read_columnar_annotations(dataset: Dataset, tmp_path: Path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, annotation_format='parquet')
+    ds_read = reader.read_dataset(ds_dir / dataset.name, columnar_annotations=True)
+
+    orig = dataset.series['series1'].subjects['10001'].annotations['automatic_aasmevents']
+    columnar = ds_read.series['series1'].subjects['10001'].annotations['automatic_aasmevents']
+    assert isinstance(columnar, ColumnarAnnotations)
+    assert len(columnar) == len(orig.annotations)
+    assert pa.types.is_dictionary(columnar.table['name'].type)
+    assert (columnar.start_sec == [a.start_sec for a in orig.annotations]).all()
+    assert (columnar.duration == [a.duration for a in orig.annotations]).all()
+
+    # Annotation objects are created on demand
+    assert columnar[0] == orig.annotations[0]
+    assert columnar[-1] == orig.annotations[-1]
+    assert [a.model_dump() for a in columnar] == [a.model_dump() for a in orig.annotations]
+    assert columnar.to_annotations().model_dump() == orig.model_dump()
+
+    # Datasets with columnar annotations can be written
+    writer.write_dataset(ds_read, tmp_path / 'rewritten')
+    ds_rewritten = reader.read_dataset(tmp_path / 'rewritten' / dataset.name)
+    _assert_datasets_equal(dataset, ds_rewritten)
+
+
+def test_read_columnar_annotations_json(dataset: Dataset, tmp_path: Path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, annotation_format='json')
+    ds_read = reader.read_dataset(ds_dir / dataset.name, columnar_annotations=True)
+
+    for sid, subject in dataset.series['series1'].subjects.items():
+        for key, orig in subject.annotations.items():
+            columnar = ds_read.series['series1'].subjects[sid].annotations[key]
+            assert isinstance(columnar, ColumnarAnnotations)
+            assert columnar.to_annotations().model_dump() == orig.model_dump()
+
+
+@pytest.mark.parametrize('manifest', [False, True])
+def test_read_dataset_name_filters(dataset: Dataset, tmp_path: Path, manifest: bool):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, manifest=manifest)
+
+    # The files of the filtered arrays and annotations should never be opened
+    subject_dir = ds_dir / dataset.name / 'series1' / '10001'
+    (subject_dir / 's2' / 'attributes.json').write_text('corrupted')
+    (subject_dir / 'study_logs.a.json').write_text('corrupted')
+
+    ds_read = reader.read_dataset(
+        ds_dir / dataset.name,
+        array_names=['s1'],
+        annotation_names=['*_hypnogram', 'automatic_*'])
+
+    for subj in ds_read.series['series1'].subjects.values():
+        assert list(subj.sample_arrays.keys()) == ['s1']
+        assert set(subj.annotations.keys()) == {'scorer_1_hypnogram', 'automatic_aasmevents'}
+
+    subj = reader.read_subject(subject_dir, array_names=['s1'], annotation_names=[])
+    assert list(subj.sample_arrays.keys()) == ['s1']
+    assert subj.annotations is None
+
+
+@pytest.mark.parametrize('manifest', [False, True])
+def test_read_dataset_subject_filter(dataset: Dataset, tmp_path: Path, manifest: bool):
+    subjects = dataset.series['series1'].subjects
+    subjects['10001'].metadata.sex = Sex.FEMALE
+    subjects['10001'].metadata.lights_off = datetime(2018, 1, 1, 23, 15, 0)
+    subjects['10002'].metadata.sex = Sex.FEMALE
+    subjects['10002'].metadata.age = 52.0
+
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, manifest=manifest)
+
+    # The filtered out subjects should not be read
+    (ds_dir / dataset.name / 'series1' / '10003' / 's1' / 'attributes.json').write_text('corrupted')
+
+    ds_read = reader.read_dataset(
+        ds_dir / dataset.name,
+        subject_filter=lambda m: m.sex == Sex.FEMALE)
+    assert sorted(ds_read.series['series1'].subjects.keys()) == ['10001', '10002']
+
+    ds_read = reader.read_dataset(
+        ds_dir / dataset.name,
+        subject_filter="age >= 24 and lights_off.notna() and sex == 'FEMALE'")
+    assert list(ds_read.series['series1'].subjects.keys()) == ['10001']
+
+    ds_read = reader.read_dataset(
+        ds_dir / dataset.name, subject_filter='age > 50', lazy=True)
+    assert list(ds_read.series['series1'].subjects.keys()) == ['10002']
+
+
+def test_read_metadata_table(dataset: Dataset):
+    series_dir = Path(__file__).parent / 'datasets' / 'dataset1' / 'series1'
+    df = reader.read_metadata_table(series_dir)
+    assert sorted(df.index) == ['10001', '10002', '10003']
+    assert (df['sex'] == 'MALE').all()
+    assert (df['age'] == 24.0).all()
+
+
+@pytest.mark.parametrize('manifest', [False, True])
+def test_read_dataset_cache(dataset: Dataset, tmp_path: Path, manifest: bool, monkeypatch):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, manifest=manifest)
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name, use_cache=True)
+    _assert_datasets_equal(dataset, ds_read)
+    assert (ds_dir / dataset.name / reader.CACHE_DIRNAME / reader.CACHE_FILENAME).exists()
+
+    # A warm read uses only the cache
+    def _fail(*args, **kwargs):
+        raise AssertionError('the cache was not used')
+
+    with monkeypatch.context() as m:
+        m.setattr(reader, 'scan_dataset', _fail)
+        m.setattr(reader, 'read_manifest', _fail)
+        ds_read = reader.read_dataset(ds_dir / dataset.name, use_cache=True)
+        _assert_datasets_equal(dataset, ds_read)
+
+    # Modifying the dataset invalidates the cache
+    dataset.series['series1'].subjects['10001'].metadata.age = 100.0
+    writer.write_dataset(dataset, ds_dir, manifest=manifest)
+    ds_read = reader.read_dataset(ds_dir / dataset.name, use_cache=True)
+    assert ds_read.series['series1'].subjects['10001'].metadata.age == 100.0
+
+
+def test_read_dataset_cache_dir(dataset: Dataset, tmp_path: Path):
+    cache_dir = tmp_path / 'cache'
+    tests_ds_dir = Path(__file__).parent / 'datasets' / 'dataset1'
+    ds_read = reader.read_dataset(tests_ds_dir, use_cache=True, cache_dir=cache_dir)
+    _assert_datasets_equal(dataset, ds_read)
+    assert (cache_dir / reader.CACHE_FILENAME).exists()
+
+
+@pytest.mark.parametrize('array_format', ['numpy', 'zarr'])
+@pytest.mark.parametrize('manifest', [False, True])
+def test_packed_arrays(dataset: Dataset, tmp_path: Path, array_format: str, manifest: bool):
+    # Add arrays sharing the sampling rate of s1
+    for subj in dataset.series['series1'].subjects.values():
+        s1 = subj.sample_arrays['s1']
+        for name, offset in [('s3', 1.0), ('s4', 2.0)]:
+            values = np.arange(60*32, dtype=np.float32) + offset
+            subj.sample_arrays[name] = SampleArray(
+                attributes=s1.attributes.model_copy(update={'name': name}),
+                values_func=lambda values=values: values)
+
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(
+        dataset, ds_dir, array_format=array_format, packed=True, manifest=manifest)
+
+    subject_dir = ds_dir / dataset.name / 'series1' / '10001'
+    assert sorted(p.name for p in subject_dir.iterdir() if p.is_dir()) == ['_packed_0', 's2']
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    _assert_datasets_equal(dataset, ds_read)
+
+    sarrs = ds_read.series['series1'].subjects['10001'].sample_arrays
+    assert (sarrs['s3'].read_window(10.0, 5.0) == np.arange(320, 480) + 1.0).all()
+    if array_format == 'numpy':
+        # The rows are views of the same memory-mapped array
+        assert not sarrs['s3'].values.flags.owndata
+        assert sarrs['s3'].values.base is sarrs['s4'].values.base
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name, array_names=['s3'])
+    assert ds_read.series['series1'].subjects['10001'].sample_arrays.keys() == {'s3'}
+
+    entry = reader.scan_subject(subject_dir, include_details=True)
+    assert entry.sample_arrays['s4'].row == 2
+    assert entry.sample_arrays['s4'].shape == [60*32]
+
+
+@pytest.mark.parametrize('annotation_format', ['json', 'parquet'])
+@pytest.mark.parametrize('validate', ['light', 'none'])
+def test_read_validation_levels(dataset: Dataset, tmp_path: Path, annotation_format: str, validate: str):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, annotation_format=annotation_format, manifest=True)
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name, validate=validate)
+    _assert_datasets_equal(dataset, ds_read)
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name, validate=validate, columnar_annotations=True)
+    columnar = ds_read.series['series1'].subjects['10001'].annotations['scorer_1_hypnogram']
+    assert columnar.name_codes.dtype == np.int32
+
+
+@pytest.mark.parametrize('layout', ['directory', 'container'])
+def test_validate_dataset(dataset: Dataset, tmp_path: Path, layout: str):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, layout=layout)
+    assert reader.validate_dataset(ds_dir / dataset.name, max_workers=2) == {}
+
+
+def test_light_validation_skips_checks(dataset: Dataset, tmp_path: Path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir)
+    subject_dir = ds_dir / dataset.name / 'series1' / '10001'
+
+    # Define both sampling_rate and sampling_interval, and an invalid sleep stage
+    attributes_path = subject_dir / 's1' / 'attributes.json'
+    attributes = json.loads(attributes_path.read_text())
+    attributes_path.write_text(json.dumps({**attributes, 'sampling_interval': 1.0}))
+    hypnogram_path = subject_dir / 'scorer_1_hypnogram.a.json'
+    hypnogram = json.loads(hypnogram_path.read_text())
+    hypnogram['annotations'][0]['name'] = 'S5'
+    hypnogram_path.write_text(json.dumps(hypnogram))
+
+    with pytest.raises(ValueError, match='cannot define both'):
+        reader.read_dataset(ds_dir / dataset.name)
+    ds_read = reader.read_dataset(ds_dir / dataset.name, validate='light')
+    assert ds_read.series['series1'].subjects['10001'].sample_arrays['s1'].attributes.sampling_interval == 1.0
+
+    errors = reader.validate_dataset(ds_dir / dataset.name)
+    assert list(errors.keys()) == [
+        'series1/10001/s1/attributes.json',
+        'series1/10001/scorer_1_hypnogram.a.json',
+    ]
+    assert 'invalid annotation names' in errors['series1/10001/scorer_1_hypnogram.a.json']
+
+    # The annotation names are only checked on request, so that older files can be read
+    with pytest.raises(ValueError, match='invalid annotation names'):
+        reader.read_annotation(hypnogram_path, check_names=True)
+    assert reader.read_annotation(hypnogram_path).annotations[0].name == 'S5'
+    assert reader.read_annotation(hypnogram_path, columnar_annotations=True).categories[0] == 'S5'
+
+    # Malformed types are still rejected
+    attributes_path.write_text(json.dumps({**attributes, 'sampling_rate': 'fast'}))
+    with pytest.raises(ValueError):
+        reader.read_dataset(ds_dir / dataset.name, validate='light')
@@ -1,8 +1,20 @@
+import functools
+import json
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import shutil
 import subprocess
+import zarr
 
-from sleeplab_format import writer
+from datetime import datetime
+from sleeplab_format import reader, writer
+from sleeplab_format.models import *
 from pathlib import Path
 
+from .test_reader import _assert_datasets_equal
+
 
 def test_write_dataset(dataset, tmp_path):
     ds_dir = tmp_path / 'datasets'
@@ -31,3 +43,411 @@ def test_overwrite_existing_dataset(dataset, tmp_path):
     p = subprocess.run(['diff', '-r',
         str(ds_dir.resolve()), str(tests_ds_dir.resolve())])
     assert p.returncode == 0
+
+
+def test_write_parquet_annotations_schema(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, annotation_format='parquet')
+
+    subject_dir = ds_dir / dataset.name / 'series1' / '10001'
+    schema = pq.read_schema(subject_dir / 'automatic_aasmevents.a.parquet')
+    assert pa.types.is_dictionary(schema.field('name').type)
+    assert schema.field('start_ts').type == pa.timestamp('us')
+    assert schema.field('start_sec').type == pa.float64()
+    assert schema.field('duration').type == pa.float64()
+    assert pa.types.is_struct(schema.field('extra_attributes').type)
+
+    # No extra_attributes column if no annotation has them
+    schema = pq.read_schema(subject_dir / 'scorer_1_hypnogram.a.parquet')
+    assert 'extra_attributes' not in schema.names
+
+    meta = json.loads((subject_dir / 'automatic_aasmevents.a_meta.json').read_text())
+    assert meta == {'scorer': 'automatic', 'type': 'aasmevents'}
+
+
+def _picklable_dataset(dataset):
+    dataset = dataset.model_copy(deep=True)
+    for series in dataset.series.values():
+        for subject in series.subjects.values():
+            for sarr in subject.sample_arrays.values():
+                sarr.values_func = functools.partial(np.array, sarr.values_func())
+    return dataset
+
+
+def test_write_dataset_num_workers(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    errors = writer.write_dataset(_picklable_dataset(dataset), ds_dir, num_workers=2)
+    assert errors == {}
+
+    report_path = ds_dir / dataset.name / writer.WRITE_REPORT_FILENAME
+    report = json.loads(report_path.read_text())
+    assert report['n_written'] == report['n_subjects'] == 3
+    report_path.unlink()
+
+    tests_ds_dir = Path(__file__).parent / 'datasets'
+    p = subprocess.run(['diff', '-r',
+        str(ds_dir.resolve()), str(tests_ds_dir.resolve())])
+    assert p.returncode == 0
+
+
+def test_write_dataset_num_workers_errors(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    dataset = _picklable_dataset(dataset)
+
+    # A lambda cannot be sent to a worker process
+    subject = dataset.series['series1'].subjects['10001']
+    sarr = next(iter(subject.sample_arrays.values()))
+    values = sarr.values_func()
+    sarr.values_func = lambda: values
+
+    errors = writer.write_dataset(dataset, ds_dir, num_workers=2)
+    assert list(errors) == ['series1']
+    assert list(errors['series1']) == ['10001']
+
+    report = json.loads((ds_dir / dataset.name / writer.WRITE_REPORT_FILENAME).read_text())
+    assert report['n_failed'] == 1
+    assert report['n_written'] == report['n_subjects'] - 1
+    assert (ds_dir / dataset.name / 'series1' / '10002').exists()
+
+    # The failed subject is removed instead of being left without sample arrays
+    assert not (ds_dir / dataset.name / 'series1' / '10001').exists()
+    assert reader.validate_dataset(ds_dir / dataset.name) == {}
+
+    # A series with failed subjects is not packed
+    writer.write_dataset(dataset, ds_dir, num_workers=2, layout='container')
+    assert (ds_dir / dataset.name / 'series1').is_dir()
+    assert not (ds_dir / dataset.name / 'series1.slf.zip').exists()
+
+
+
+def test_write_dataset_num_workers_errors_keep_written_subject(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    dataset = _picklable_dataset(dataset)
+    writer.write_dataset(dataset, ds_dir)
+
+    # A subject which fails to be rewritten keeps its previously written data
+    subject = dataset.series['series1'].subjects['10001']
+    subject.metadata.age = 77.0
+    sarr = next(iter(subject.sample_arrays.values()))
+    values = sarr.values_func()
+    sarr.values_func = lambda: values
+    errors = writer.write_dataset(dataset, ds_dir, num_workers=2)
+    assert list(errors['series1']) == ['10001']
+
+    series_path = ds_dir / dataset.name / 'series1'
+    assert sorted(p.name for p in series_path.iterdir()) == ['10001', '10002', '10003']
+    assert reader.validate_dataset(ds_dir / dataset.name) == {}
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    subject_read = ds_read.series['series1'].subjects['10001']
+    assert subject_read.metadata.age != 77.0
+    np.testing.assert_array_equal(subject_read.sample_arrays[sarr.attributes.name].values, values)
+
+def test_write_dataset_container_errors_remove_old_container(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    dataset = _picklable_dataset(dataset)
+    writer.write_dataset(dataset, ds_dir, layout='container')
+
+    # Rewrite the series with modified metadata, and one subject failing in a worker process
+    for subject in dataset.series['series1'].subjects.values():
+        subject.metadata.age = 77.0
+    sarr = next(iter(dataset.series['series1'].subjects['10001'].sample_arrays.values()))
+    values = sarr.values_func()
+    sarr.values_func = lambda: values
+    errors = writer.write_dataset(dataset, ds_dir, num_workers=2, layout='container')
+    assert list(errors['series1']) == ['10001']
+
+    # The stale container is not read instead of the rewritten folder
+    assert not (ds_dir / dataset.name / 'series1.slf.zip').exists()
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    assert sorted(ds_read.series['series1'].subjects) == ['10002', '10003']
+    assert all(s.metadata.age == 77.0 for s in ds_read.series['series1'].subjects.values())
+
+
+@pytest.mark.parametrize('array_format', ['numpy', 'parquet', 'zarr'])
+@pytest.mark.parametrize('layout', ['directory', 'container'])
+def test_write_read_dataset_num_workers(dataset, tmp_path, array_format, layout):
+    src_dir = tmp_path / 'src'
+    writer.write_dataset(dataset, src_dir, array_format=array_format, layout=layout,
+                         quantize={'s2': 0.01})
+    ds_read = reader.read_dataset(src_dir / dataset.name)
+
+    dst_dir = tmp_path / 'dst'
+    errors = writer.write_dataset(ds_read, dst_dir, array_format=array_format,
+                                  num_workers=2, resume=True)
+    assert errors == {}
+    _assert_datasets_equal(ds_read, reader.read_dataset(dst_dir / dataset.name))
+
+    # The subjects skipped by resume are not counted as written
+    writer.write_dataset(ds_read, dst_dir, array_format=array_format, num_workers=2, resume=True)
+    report = json.loads((dst_dir / dataset.name / writer.WRITE_REPORT_FILENAME).read_text())
+    assert (report['n_written'], report['n_skipped'], report['n_failed']) == (0, 3, 0)
+
+
+def test_validate_dataset_missing_arrays(dataset, tmp_path):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir)
+    for p in (ds_dir / dataset.name / 'series1' / '10002').iterdir():
+        if p.is_dir():
+            shutil.rmtree(p)
+
+    errors = reader.validate_dataset(ds_dir / dataset.name)
+    assert list(errors) == ['series1/10002']
+
+
+def test_write_dataset_resume(dataset, tmp_path, monkeypatch):
+    ds_dir = tmp_path / 'datasets'
+    series_path = ds_dir / dataset.name / 'series1'
+    writer.write_dataset(dataset, ds_dir, resume=True)
+    for sid in ['10001', '10002', '10003']:
+        assert (series_path / sid / writer.COMPLETE_MARKER_FILENAME).exists()
+
+    # Simulate an interrupted write and modifications after the first write
+    (series_path / '.10004.tmp').mkdir()
+    dataset.series['series1'].subjects['10001'].metadata.age = 100.0
+    next((series_path / '10002').glob('*/data.npy')).unlink()
+
+    written = []
+    write_subject = writer.write_subject
+
+    def _write_subject(subject, subject_path, **kwargs):
+        written.append(subject.metadata.subject_id)
+        write_subject(subject, subject_path, **kwargs)
+
+    monkeypatch.setattr(writer, 'write_subject', _write_subject)
+    writer.write_dataset(dataset, ds_dir, resume=True)
+
+    assert written == ['10001', '10002']
+    assert not (series_path / '.10004.tmp').exists()
+    assert not (series_path / '.10001.tmp').exists()
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    assert ds_read.series['series1'].subjects['10001'].metadata.age == 100.0
+    for name, sarr in dataset.series['series1'].subjects['10002'].sample_arrays.items():
+        sarr_read = ds_read.series['series1'].subjects['10002'].sample_arrays[name]
+        np.testing.assert_array_equal(sarr_read.values_func(), sarr.values_func())
+
+
+
+def test_write_dataset_resume_container(dataset, tmp_path, monkeypatch):
+    ds_dir = tmp_path / 'datasets'
+    ds_path = ds_dir / dataset.name
+    writer.write_dataset(dataset, ds_dir, layout='container', resume=True)
+
+    written = []
+    write_subject = writer.write_subject
+
+    def _write_subject(subject, subject_path, **kwargs):
+        written.append(subject.metadata.subject_id)
+        write_subject(subject, subject_path, **kwargs)
+
+    monkeypatch.setattr(writer, 'write_subject', _write_subject)
+
+    # A complete container is skipped
+    container_path = ds_path / 'series1.slf.zip'
+    mtime = container_path.stat().st_mtime_ns
+    writer.write_dataset(dataset, ds_dir, layout='container', resume=True)
+    assert written == []
+    assert container_path.stat().st_mtime_ns == mtime
+
+    # Only the modified subject is rewritten after unpacking the container
+    dataset.series['series1'].subjects['10001'].metadata.age = 100.0
+    writer.write_dataset(dataset, ds_dir, layout='container', resume=True)
+    assert written == ['10001']
+    assert sorted(p.name for p in ds_path.iterdir()) == ['metadata.json', 'series1.slf.zip']
+
+    ds_read = reader.read_dataset(ds_path)
+    assert ds_read.series['series1'].subjects['10001'].metadata.age == 100.0
+    _assert_datasets_equal(dataset, ds_read)
+
+@pytest.mark.parametrize('array_format', ['numpy', 'parquet', 'zarr'])
+def test_write_sample_arrays_chunks(tmp_path, array_format):
+    values = np.arange(1000, dtype=np.float32)
+    chunk_sizes = [1, 99, 300, 0, 600]
+    bounds = np.cumsum([0] + chunk_sizes)
+
+    def _chunks():
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            yield values[start:stop]
+
+    def _values():
+        raise AssertionError('values_func should not be called')
+
+    sarr = SampleArray(
+        attributes=ArrayAttributes(name='s1', start_ts=datetime(2018, 1, 1), sampling_rate=100.0),
+        values_func=_values,
+        chunks_func=_chunks)
+    subject = Subject(
+        metadata=SubjectMetadata(subject_id='1', recording_start_ts=datetime(2018, 1, 1)),
+        sample_arrays={'s1': sarr})
+
+    writer.write_sample_arrays(
+        subject, tmp_path, format=array_format,
+        zarr_chunksize=4 * 256, parquet_row_group_sec=2.5)
+
+    sarr_read = reader.read_sample_array(tmp_path / 's1')
+    np.testing.assert_array_equal(np.asarray(sarr_read.values_func()), values)
+
+    data_path = tmp_path / 's1' / reader.ARRAY_FILENAMES[array_format]
+    if array_format == 'zarr':
+        assert zarr.open_array(str(data_path), mode='r').chunks == (256,)
+    elif array_format == 'parquet':
+        pq_file = pq.ParquetFile(data_path)
+        assert pq_file.metadata.num_row_groups == 4
+        assert pq_file.metadata.row_group(0).num_rows == 250
+
+
+
+
+@pytest.mark.parametrize('dtype', [
+    np.dtype(np.float32),
+    np.dtype([(f'channel_with_a_long_name_{i}', np.float32) for i in range(8)]),
+    np.dtype([(f'channel_with_a_long_name_{i}', np.float32) for i in range(3000)])])
+def test_write_npy_chunks_header(tmp_path, dtype):
+    values = np.zeros((1000, 2, 3), dtype=dtype)
+    path = tmp_path / 'data.npy'
+    writer._write_npy_chunks(path, [values[:10], values[10:]])
+
+    # The header of the many fields needs format version 2.0 and is above the default limit of np.load
+    loaded = np.load(path, mmap_mode='r', max_header_size=200_000)
+    assert loaded.shape == values.shape and loaded.dtype == dtype
+    assert loaded.offset % 64 == 0
+    np.testing.assert_array_equal(loaded, values)
+
+    with pytest.raises(ValueError, match='trailing dimensions'):
+        writer._write_npy_chunks(path, [values[:10], values[10:, :1]])
+
+@pytest.mark.parametrize('array_format', ['zarr', 'parquet'])
+def test_write_low_rate_array_chunks(tmp_path, array_format):
+    # Chunks and row groups of 10 s round to zero samples at 1/30 Hz
+    values = np.arange(100, dtype=np.float32)
+    sarr = SampleArray(
+        attributes=ArrayAttributes(name='hr', start_ts=datetime(2018, 1, 1), sampling_interval=30.0),
+        values_func=lambda: values)
+    subject = Subject(
+        metadata=SubjectMetadata(subject_id='1', recording_start_ts=datetime(2018, 1, 1)),
+        sample_arrays={'hr': sarr})
+
+    writer.write_sample_arrays(subject, tmp_path, format=array_format,
+                               zarr_chunk_sec=10.0, parquet_row_group_sec=10.0)
+
+    data_path = tmp_path / 'hr' / reader.ARRAY_FILENAMES[array_format]
+    if array_format == 'zarr':
+        assert zarr.open_array(str(data_path), mode='r').chunks == (1,)
+    else:
+        assert pq.ParquetFile(data_path).metadata.num_row_groups == 100
+    sarr_read = reader.read_sample_array(tmp_path / 'hr')
+    np.testing.assert_array_equal(np.asarray(sarr_read.values_func()), values)
+
+@pytest.mark.parametrize('array_format', ['numpy', 'parquet', 'zarr'])
+def test_write_dataset_quantize(dataset, tmp_path, array_format):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=60*32).astype(np.float32)
+    subj = dataset.series['series1'].subjects['10001']
+    subj.sample_arrays['s1'] = subj.sample_arrays['s1'].model_copy(
+        update={'values_func': lambda: values})
+
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(
+        dataset, ds_dir, array_format=array_format, quantize={'s1': 1e-3, '*': 'auto'})
+
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    sarr = ds_read.series['series1'].subjects['10001'].sample_arrays['s1']
+    assert sarr.attributes.scale == pytest.approx(2e-3)
+    assert np.asarray(sarr.raw_values_func()).dtype == np.int16
+    assert sarr.values.dtype == np.float32
+    assert np.abs(sarr.values - values).max() <= 1e-3 + 1e-6
+    np.testing.assert_array_equal(sarr.read_window(10.0, 5.0), sarr.values[320:480])
+
+    # The constant array s2 is quantized to zeros with the offset
+    sarr = ds_read.series['series1'].subjects['10001'].sample_arrays['s2']
+    assert (np.asarray(sarr.raw_values_func()) == 0).all()
+    np.testing.assert_allclose(sarr.values, 1.23)
+
+    # Quantized arrays are copied without requantizing
+    ds_dir2 = tmp_path / 'datasets2'
+    writer.write_dataset(ds_read, ds_dir2, array_format=array_format)
+    ds_read2 = reader.read_dataset(ds_dir2 / dataset.name)
+    sarr1 = ds_read.series['series1'].subjects['10001'].sample_arrays['s1']
+    sarr2 = ds_read2.series['series1'].subjects['10001'].sample_arrays['s1']
+    assert sarr2.attributes == sarr1.attributes
+    np.testing.assert_array_equal(sarr2.raw_values_func(), sarr1.raw_values_func())
+
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_write_dataset_statistics(dataset, tmp_path, packed):
+    subj = dataset.series['series1'].subjects['10001']
+    values = np.arange(60*32, dtype=np.float32)
+    subj.sample_arrays['s1'] = subj.sample_arrays['s1'].model_copy(
+        update={'values_func': None, 'chunks_func': lambda: np.array_split(values, 4)})
+
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, packed=packed, statistics=True, quantize={'s2': 'auto'})
+    ds_read = reader.read_dataset(ds_dir / dataset.name)
+    sample_arrays = ds_read.series['series1'].subjects['10001'].sample_arrays
+
+    stats = sample_arrays['s1'].attributes.statistics
+    assert stats.count == len(values)
+    assert stats.mean == pytest.approx(values.mean())
+    assert stats.std == pytest.approx(values.std())
+    assert stats.median == pytest.approx(np.median(values))
+    assert (stats.min, stats.max, stats.clip_count) == (0.0, len(values) - 1, 2)
+
+    # The statistics of quantized arrays are computed from the physical values
+    stats = sample_arrays['s2'].attributes.statistics
+    assert stats.mean == pytest.approx(1.23)
+    assert stats.clip_count == stats.count
+
+
+@pytest.mark.parametrize('layout', ['directory', 'container'])
+def test_write_hypnogram_epochs(dataset, tmp_path, layout):
+    ds_dir = tmp_path / 'datasets'
+    writer.write_dataset(dataset, ds_dir, hypnogram_epoch_sec=30.0, layout=layout)
+
+    series_dir = ds_dir / dataset.name / 'series1'
+    container = reader.open_container(series_dir)
+    for sid, subject in dataset.series['series1'].subjects.items():
+        hg = Hypnogram.model_validate(subject.annotations['scorer_1_hypnogram'].model_dump())
+        epochs = reader.read_epoch_array(series_dir / sid, 'scorer_1_hypnogram', container=container)
+        assert isinstance(epochs, np.memmap)
+        np.testing.assert_array_equal(epochs, hg.to_epoch_array(epoch_sec=30.0))
+        assert reader.read_epoch_array(series_dir / sid, 'automatic_aasmevents', container=container) is None
+
+
+def test_write_quantized_requires_integers(dataset, tmp_path):
+    subj = dataset.series['series1'].subjects['10001']
+    s1 = subj.sample_arrays['s1']
+    subj.sample_arrays['s1'] = s1.model_copy(
+        update={'attributes': s1.attributes.model_copy(update={'scale': 0.5})})
+
+    with pytest.raises(AssertionError):
+        writer.write_sample_arrays(subj, tmp_path)
+
+
+def test_write_quantize_skips_integers_and_labels(tmp_path):
+    labels = np.array([0, 1, 2, 1], dtype=np.uint8)
+    counts = np.array([3, 5, 7, 9], dtype=np.int32)
+    start_ts = datetime(2018, 1, 1)
+    sample_arrays = {
+        'labels': SampleArray(
+            attributes=ArrayAttributes(name='labels', start_ts=start_ts, sampling_rate=1.0,
+                                       value_map={0: 'W', 1: 'N1', 2: 'N2'}),
+            values_func=lambda: labels),
+        'counts': SampleArray(
+            attributes=ArrayAttributes(name='counts', start_ts=start_ts, sampling_rate=1.0),
+            values_func=lambda: counts)}
+    subject = Subject(
+        metadata=SubjectMetadata(subject_id='1', recording_start_ts=start_ts),
+        sample_arrays=sample_arrays)
+
+    # Glob patterns do not match integer or categorical arrays
+    writer.write_sample_arrays(subject, tmp_path, quantize={'*': 'auto'})
+    for name, values in [('labels', labels), ('counts', counts)]:
+        sarr = reader.read_sample_array(tmp_path / name)
+        assert sarr.attributes.scale is None
+        np.testing.assert_array_equal(sarr.values, values)
+
+    # Integer arrays are quantized by exact name, but categorical arrays cannot be
+    writer.write_sample_arrays(subject, tmp_path, quantize={'counts': 'auto'})
+    assert reader.read_sample_array(tmp_path / 'counts').attributes.scale is not None
+    with pytest.raises(AssertionError):
+        writer.write_sample_arrays(subject, tmp_path, quantize={'labels': 'auto'})